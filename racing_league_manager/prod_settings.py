@@ -59,6 +59,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # does nothing unless PROFILING is set
+    'standings.profiling.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -164,13 +166,46 @@ COUNTRIES_OVERRIDE = {
     'XI': _('Northern Ireland'),
 }
 
+# pages are served from local memory first and from the shared cache after that
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
-        'LOCATION': '{}/.cache'.format(BASE_DIR),
-    }
+        'BACKEND': 'standings.cache_backends.TieredCache',
+        'OPTIONS': {'LOCAL': 'local', 'SHARED': 'shared', 'LOCAL_TIMEOUT': 5},
+    },
+    'local': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    'shared': {
+        'BACKEND': 'standings.cache_backends.SQLiteCache',
+        'LOCATION': '{}/.cache/shared.sqlite3'.format(BASE_DIR),
+        'OPTIONS': {'MAX_ENTRIES': 20000},
+    },
 }
 
+# with more than one app server the shared cache has to be Redis (needs django-redis)
+if os.path.exists('/home/fsr/.config/fsr_redis_url.txt'):
+    with open('/home/fsr/.config/fsr_redis_url.txt') as f:
+        CACHES['shared'] = {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': f.read().strip(),
+        }
+
+# number of jobs `manage.py run_jobs` works on at the same time
+JOB_WORKER_CONCURRENCY = 2
+
+# seconds a job can be running before it is taken for dead (its worker killed) and queued again
+JOB_TIMEOUT = 3600
+
+# keep a packed copy of each race's laps (LapPack) for the race and lap pages, `manage.py pack_laps` fills older races
+PACKED_LAPS = False
+
+# record per request (and job) query counts, duplicate queries and hot path times to PROFILING_PATH,
+# see `manage.py profile_report` or the admin's profile report at /admin/profiles/
+PROFILING = False
+PROFILING_SAMPLE_RATE = 1
+PROFILING_PATH = '{}/.profiles/profiles.jsonl'.format(BASE_DIR)
+
 with open('/home/fsr/.config/fsr_sentry_io_dsn.txt') as f:
     SENTRY_DSN = f.read().strip()
 
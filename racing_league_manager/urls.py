@@ -15,9 +15,12 @@ Including another URLconf
 """
 from django.urls import path, include
 from django.contrib import admin
+from standings.admin import profile_report
 
 urlpatterns = [
-    path('', include('standings.urls')),
+    path('admin/profiles/', admin.site.admin_view(profile_report), name='profile_report'),
+    # before the site's urls, whose <division>/<season> pattern would otherwise take api/results and the like
     path('api/', include('standings_api.urls')),
+    path('', include('standings.urls')),
     path('admin/', admin.site.urls),
 ]
@@ -11,7 +11,10 @@ from django.forms import TextInput
 from .models import *
 import os
 import contextlib
-from .utils import format_time, expire_view_cache
+from .utils import format_time
+from . import cache
+from . import jobs
+from . import profiling
 from .filters import RLMFilter
 
 admin.site.site_header = 'FSR Admin'
@@ -22,17 +25,12 @@ admin.site.site_title = "FSR Admin"
 class ResultAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
-        expire_view_cache(
-            reverse('season', args=[obj.race.season.id]),
-            meta=request.META
+        jobs.enqueue(
+            'update_driver_stats',
+            season_id=obj.race.season_id,
+            driver_id=obj.driver_id,
+            from_round=obj.race.round_number
         )
-        expire_view_cache(
-            reverse('season_alternate', args=[obj.race.season.division.slug, obj.race.season.slug]),
-            meta=request.META
-        )
-
-        (stats, _) = SeasonStats.objects.get_or_create(season=obj.race.season, driver=obj.driver)
-        stats.update_stats()
 
     @staticmethod
     def season(obj):
@@ -87,9 +85,9 @@ class RaceAdmin(admin.ModelAdmin):
 
     def update_results(self, request, queryset):
         for obj in queryset:
-            obj.fill_attributes()
+            jobs.enqueue('fill_attributes', race_id=obj.id)
 
-        messages.add_message(request, messages.INFO, "{} race(s) updated".format(queryset.count()))
+        messages.add_message(request, messages.INFO, "{} race(s) queued for update".format(queryset.count()))
         return redirect(reverse("admin:standings_race_changelist"))
     update_results.short_description = 'Update result information (points, gaps, etc)'
 
@@ -106,6 +104,7 @@ class RaceAdmin(admin.ModelAdmin):
         )
     unfinalise.short_description = 'Set all results for a race to be unfinalised'
 
+    @cache.batched()
     def apply_penalties(self, request, queryset):
         if 'apply' in request.POST:
             race = Race.objects.get(pk=request.POST.get('_selected_action'))
@@ -172,16 +171,8 @@ class RaceAdmin(admin.ModelAdmin):
 
             if dsq or pens:
                 race.fill_attributes()
-
-            if 'clear-cache' in request.POST:
-                expire_view_cache(
-                    reverse('season', args=[race.season_id]),
-                    meta=request.META
-                )
-                expire_view_cache(
-                    reverse('season_alternate', args=[race.season.division.slug, race.season.slug]),
-                    meta=request.META
-                )
+            else:
+                race.season.refresh_snapshots(from_round=race.round_number)
 
             messages.add_message(request, messages.INFO, "Results for '{}' updated".format(race.name))
             return redirect(
@@ -229,6 +220,7 @@ class SeasonAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
         Result.objects.filter(race__season_id=obj.id).update(finalized=obj.finalized)
+        obj.refresh_snapshots()
 
     @staticmethod
     def league(obj):
@@ -261,33 +253,15 @@ class SeasonAdmin(admin.ModelAdmin):
 
     def update_stats(self, request, queryset):
         for obj in queryset:
-            obj.update_stats()
+            jobs.enqueue('update_stats', season_id=obj.id)
 
-        messages.add_message(request, messages.INFO, "Season stats updated")
+        messages.add_message(request, messages.INFO, "Season stats queued for update")
         return redirect(reverse("admin:standings_season_changelist"))
     update_stats.short_description = 'Update season based stats'
 
     def clear_cache(self, request, queryset):
-        for obj in queryset:
-            expire_view_cache(
-                reverse('season', args=[obj.id]),
-                meta=request.META
-            )
-            expire_view_cache(
-                reverse('season_alternate', args=[obj.division.slug, obj.slug]),
-                meta=request.META
-            )
-
-            for race in obj.race_set.all():
-                request.META['QUERY_STRING'] = f'upto={race.round_number}'
-                expire_view_cache(
-                    reverse('season', args=[obj.id]),
-                    meta=request.META
-                )
-                expire_view_cache(
-                    reverse('season_alternate', args=[obj.division.slug, obj.slug]),
-                    meta=request.META
-                )
+        cache.touch('season', *[obj.id for obj in queryset])
+        cache.touch_races(Race.objects.filter(season__in=queryset))
 
         messages.add_message(request, messages.INFO, "Cache cleared for selected seasons")
         return redirect(reverse("admin:standings_season_changelist"))
@@ -356,12 +330,18 @@ class LapAdmin(admin.ModelAdmin):
     ordering = ['lap_number']
     readonly_fields = ['result']
 
+    def delete_queryset(self, request, queryset):
+        packs = set(queryset.values_list('result_id', 'session'))
+        super().delete_queryset(request, queryset)
+
+        Lap.changed({result_id for result_id, _ in packs}, packs)
+
 
 @admin.register(LogFile)
 class LogFileAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         super().save_model(request, obj, form, change)
-        obj.process(request)
+        jobs.enqueue('process_log_file', log_file_id=obj.id, post_fields=list(request.POST))
 
     def delete_model(self, request, obj):
         with contextlib.suppress(FileNotFoundError):
@@ -381,7 +361,8 @@ class LogFileAdmin(admin.ModelAdmin):
 
     def summary(self, request, logfile_id):
         log_file = LogFile.objects.get(pk=logfile_id)
-        summary = json.loads(log_file.summary)
+        job = Job.objects.filter(task='process_log_file', payload__log_file_id=log_file.id).first()
+        summary = json.loads(log_file.summary) if log_file.summary else {'duplicates': [], 'lap_errors': {}}
         duplicates = []
         lap_errors = []
 
@@ -399,6 +380,7 @@ class LogFileAdmin(admin.ModelAdmin):
         context = dict(
             self.admin_site.each_context(request),
             log_file=log_file,
+            job=job,
             duplicates=duplicates,
             lap_errors=lap_errors,
             title="Log file summary"
@@ -413,9 +395,9 @@ class TrackAdmin(admin.ModelAdmin):
 
     def update_records(self, request, queryset):
         for obj in queryset:
-            obj.update_records()
+            jobs.enqueue('update_records', track_id=obj.id)
 
-        messages.add_message(request, messages.INFO, "Records for {} tracks updated".format(queryset.count()))
+        messages.add_message(request, messages.INFO, "Records for {} tracks queued for update".format(queryset.count()))
         return redirect(reverse("admin:standings_track_changelist"))
     update_records.short_description = 'Update track records'
 
@@ -433,8 +415,11 @@ class SeasonPenaltyAdmin(admin.ModelAdmin):
     list_select_related = ('season', 'driver', 'team')
 
     def save_model(self, request, obj, form, change):
-        super().save_model(request, obj, form, change)
-        obj.process()
+        # the aggregates the penalty expires are refreshed once, after a disqualification has zeroed the points
+        with cache.batched():
+            super().save_model(request, obj, form, change)
+            obj.process()
+        obj.season.refresh_snapshots()
 
 
 @admin.register(Team)
@@ -519,4 +504,37 @@ class TrackRecordAdmin(admin.ModelAdmin):
     formatted_lap_time.admin_order_field = 'formatted_lap_time'
 
 
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'task', 'payload', 'status', 'created', 'started', 'finished')
+    list_filter = ('status', 'task')
+    readonly_fields = ('created', 'started', 'finished')
+    actions = ['requeue']
+
+    def requeue(self, request, queryset):
+        # a running job is only queued again once it has outlived JOB_TIMEOUT
+        queryset = queryset.exclude(status='running', started__gte=jobs.stale_before())
+        count = queryset.update(status='queued', error='', started=None, finished=None)
+
+        messages.add_message(request, messages.INFO, "{} job(s) queued".format(count))
+        return redirect(reverse("admin:standings_job_changelist"))
+    requeue.short_description = 'Queue selected jobs again (running ones once stale)'
+
+
+def profile_report(request):
+    records = profiling.load()
+    sort = request.GET.get('sort', 'seconds')
+    if sort not in ('seconds', 'queries', 'duplicates'):
+        sort = 'seconds'
+
+    context = dict(
+        admin.site.each_context(request),
+        report=profiling.report(records, sort),
+        count=len(records),
+        enabled=profiling.enabled(),
+        title="Profile report"
+    )
+    return TemplateResponse(request, "admin/profile_report.html", context)
+
+
 admin.site.register([League, Division, PointSystem])
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class StandingsConfig(AppConfig):
     name = 'standings'
+
+    def ready(self):
+        # connects the signals that expire cached pages
+        from . import cache  # noqa: F401
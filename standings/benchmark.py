@@ -0,0 +1,490 @@
+from contextlib import contextmanager
+from datetime import timedelta
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from lxml import etree
+import os
+import random
+import tempfile
+import time
+from .utils import countback_sort
+
+
+RACE_POINTS = [25, 18, 15, 12, 10, 8, 6, 4, 2, 1]
+
+
+def timed(func, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def timed_queries(func):
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+
+    return elapsed, len(queries.captured_queries)
+
+
+@contextmanager
+def scratch_database():
+    """
+    Runs the enclosed benchmarks against a freshly migrated test database,
+    so synthetic data never touches the configured one.
+    """
+    from django.test.runner import DiscoverRunner
+
+    runner = DiscoverRunner(verbosity=0, interactive=False)
+    runner.setup_test_environment()
+    old_config = runner.setup_databases()
+    try:
+        yield
+    finally:
+        runner.teardown_databases(old_config)
+        runner.teardown_test_environment()
+
+
+# measurements where lower is better, the ones a baseline is checked against, and the
+# amount each may grow by regardless of the threshold so timer noise on fast pages is not a regression
+REGRESSION_FIELDS = {'seconds': 0.005, 'queries': 0, 'peak_kb': 64}
+
+
+def regressions(rows, baseline, threshold):
+    """
+    Compares benchmark rows with the baseline rows of the same name. Query
+    counts may not grow at all, times and memory may grow by `threshold`
+    (a fraction) before they count as a regression.
+    """
+    found = []
+    for row in rows:
+        previous = baseline.get(row['name'])
+        if previous is None:
+            continue
+
+        for field, slack in REGRESSION_FIELDS.items():
+            if field not in row or field not in previous:
+                continue
+
+            limit = previous[field] if field == 'queries' else previous[field] * (1 + threshold) + slack
+            if row[field] > limit:
+                found.append('{}: {} went from {} to {}'.format(row['name'], field, previous[field], row[field]))
+
+    return found
+
+
+def create_season(rounds=1, name='Benchmark'):
+    from .models import Division, League, PointSystem, Race, Season, Track
+
+    league = League.objects.create(name=name)
+    division = Division.objects.create(league=league, name=name, slug=name.lower())
+    point_system = PointSystem.objects.create(name=name, race_points=','.join(map(str, RACE_POINTS)))
+    season = Season.objects.create(division=division, name=name, slug=name.lower(), point_system=point_system)
+
+    start_time = timezone.now() - timedelta(days=7 * rounds)
+    for round_number in range(1, rounds + 1):
+        track = Track.objects.create(name='Track {}'.format(round_number), version='1', country='GB')
+        Race.objects.create(
+            season=season,
+            track=track,
+            round_number=round_number,
+            name='Round {}'.format(round_number),
+            short_name='R{:02d}'.format(round_number)[:3],
+            start_time=start_time + timedelta(days=7 * round_number)
+        )
+
+    return season
+
+
+def synthetic_log_file(path, driver_count=30, lap_count=60, session='Race', seed=0):
+    """
+    Writes an rFactor style results file, with the occasional pitstop and
+    missing lap time so the lap repair path is exercised too.
+    """
+    rng = random.Random(seed)
+    root = etree.Element('rFactorXML')
+    session_element = etree.SubElement(etree.SubElement(root, 'RaceResults'), session)
+
+    for idx in range(driver_count):
+        driver = etree.SubElement(session_element, 'Driver')
+        laps = []
+        elapsed = 0
+        for number in range(1, lap_count + 1):
+            lap_time = 90 + rng.random() * 5
+            elapsed += lap_time
+            laps.append((number, lap_time, elapsed))
+
+        for tag, value in [
+            ('Name', 'Driver {}'.format(idx + 1)),
+            ('VehFile', 'car_{}.veh'.format(idx % 10)),
+            ('CarType', 'Team {}'.format(idx // 2 + 1)),
+            ('CarClass', 'F1'),
+            ('LapRankIncludingDiscos', str(idx + 1)),
+            ('GridPos', str(driver_count - idx)),
+            ('Position', str(idx + 1)),
+            ('Laps', str(lap_count)),
+            ('FinishTime', '{:.4f}'.format(elapsed)),
+            ('FinishStatus', 'Finished Normally'),
+        ]:
+            etree.SubElement(driver, tag).text = value
+
+        for number, lap_time, elapsed in laps:
+            lap = etree.SubElement(driver, 'Lap', {
+                'num': str(number), 'p': str(idx + 1), 'et': '{:.4f}'.format(elapsed),
+                's1': '{:.4f}'.format(lap_time * 0.3), 's2': '{:.4f}'.format(lap_time * 0.4),
+                's3': '{:.4f}'.format(lap_time * 0.3), 'fcompound': '0,Medium (M)',
+                'twfl': '0.98', 'twfr': '0.97', 'twrl': '0.99', 'twrr': '0.96',
+            })
+            if number % 25 == 0:
+                lap.set('pit', '1')
+            lap.text = '--.----' if rng.random() < 0.01 else '{:.4f}'.format(lap_time)
+
+    etree.ElementTree(root).write(path, xml_declaration=True, encoding='utf-8')
+
+
+def log_file(repeat=1):
+    from .models import LogFile
+
+    rows = []
+    season = create_season()
+    race = season.race_set.first()
+
+    for driver_count, lap_count in [(30, 60), (30, 120)]:
+        handle, path = tempfile.mkstemp(suffix='.xml')
+        os.close(handle)
+        try:
+            synthetic_log_file(path, driver_count=driver_count, lap_count=lap_count)
+            for run in ['import', 're-import']:
+                elapsed, queries = timed_queries(lambda: LogFile(race=race, file=path).process())
+                rows.append({
+                    'name': 'log file {} drivers x {} laps ({})'.format(driver_count, lap_count, run),
+                    'seconds': elapsed,
+                    'queries': queries,
+                })
+        finally:
+            os.remove(path)
+            race.result_set.all().delete()
+
+    return rows
+
+
+log_file.needs_database = True
+
+
+def log_parse(repeat=3):
+    from .logparser import parse_log
+
+    rows = []
+    for driver_count, lap_count in [(30, 60), (40, 1000)]:
+        handle, path = tempfile.mkstemp(suffix='.xml')
+        os.close(handle)
+        try:
+            synthetic_log_file(path, driver_count=driver_count, lap_count=lap_count)
+            rows.append({
+                'name': 'log parse {} drivers x {} laps'.format(driver_count, lap_count),
+                'seconds': timed(lambda: sum(len(driver.lap_records) for driver in parse_log(path)), repeat),
+                'megabytes': os.path.getsize(path) / 1024 / 1024,
+            })
+        finally:
+            os.remove(path)
+
+    return rows
+
+
+def synthetic_standings(driver_count, race_count, countback_range, seed=0):
+    rng = random.Random(seed)
+    drivers = {
+        driver_id: {
+            'points': 0,
+            'positions': {x + 1: 0 for x in range(countback_range)},
+            'best_finish': 99
+        } for driver_id in range(driver_count)
+    }
+
+    for _ in range(race_count):
+        # only part of the grid turns up each round, which leaves plenty of ties
+        grid = rng.sample(range(driver_count), min(driver_count, rng.randint(20, 40)))
+        for idx, driver_id in enumerate(grid):
+            position = idx + 1
+            drivers[driver_id]['points'] += RACE_POINTS[idx] if idx < len(RACE_POINTS) else 0
+            drivers[driver_id]['best_finish'] = min(drivers[driver_id]['best_finish'], position)
+            if position <= countback_range:
+                drivers[driver_id]['positions'][position] += 1
+
+    return drivers
+
+
+def chained_countback_sort(drivers, countback_range):
+    """
+    The original one-sort-per-position countback, kept as the reference the
+    single composite-key sort is measured and tested against.
+    """
+    driver_sort = sorted(drivers, key=lambda item: drivers[item]['best_finish'])
+
+    for position in reversed(range(countback_range)):
+        driver_sort = sorted(driver_sort, key=lambda item: drivers[item]['positions'][position + 1], reverse=True)
+
+    return sorted(driver_sort, key=lambda item: drivers[item]['points'], reverse=True)
+
+
+def composite_countback_sort(drivers, countback_range):
+    return countback_sort(
+        drivers,
+        positions=lambda item: drivers[item]['positions'],
+        points=lambda item: drivers[item]['points'],
+        tie_breaker=lambda item: drivers[item]['best_finish'],
+        depth=countback_range
+    )
+
+
+def ranking(repeat=5):
+    rows = []
+    for driver_count, countback_range in [(40, 10), (200, 10), (200, 40), (1000, 40)]:
+        drivers = synthetic_standings(driver_count, 20, countback_range)
+        chained = timed(lambda: chained_countback_sort(drivers, countback_range), repeat)
+        composite = timed(lambda: composite_countback_sort(drivers, countback_range), repeat)
+
+        rows.append({
+            'name': 'ranking {} drivers, countback {}'.format(driver_count, countback_range),
+            'chained': chained,
+            'composite': composite,
+            'speedup': chained / composite if composite else 0
+        })
+
+    return rows
+
+
+SCANNED_GRID = (
+    '{% load standings_extras %}\n'
+    '{% for driver in drivers %}{% for race in races %}'
+    '{% with result=driver.results|find_result:race %}{{ result.position }}{% endwith %}'
+    '{% endfor %}{% endfor %}\n'
+    '{% for team in teams %}{% for driver in team.drivers %}{% for race in races %}'
+    '{% with result=team.results|find_results:race|find_driver:driver.driver %}{{ result.position }}{% endwith %}'
+    '{% endfor %}{% endfor %}{% endfor %}\n'
+)
+
+INDEXED_GRID = (
+    '{% load standings_extras %}\n'
+    '{% for driver in drivers %}{% for race in races %}'
+    '{% with result=driver.results_by_race|race_result:race %}{{ result.position }}{% endwith %}'
+    '{% endfor %}{% endfor %}\n'
+    '{% for team in teams %}{% for driver in team.drivers %}{% for race in races %}'
+    '{% with result=driver.results_by_race|race_result:race %}{{ result.position }}{% endwith %}'
+    '{% endfor %}{% endfor %}{% endfor %}\n'
+)
+
+
+def season_grid(repeat=5):
+    """
+    Renders the driver and team result grids of season.html, looking each
+    cell up by scanning the result lists and through the per-race index.
+    """
+    from django.template import Context, Template
+    from .engine import StandingsEngine
+    from .models import Driver, Result, Team
+
+    driver_count, rounds = 40, 20
+    rng = random.Random(0)
+    season = create_season(rounds, name='Grid')
+    drivers = Driver.objects.bulk_create(
+        [Driver(name='Driver {}'.format(idx + 1), slug='driver-{}'.format(idx + 1)) for idx in range(driver_count)]
+    )
+    teams = Team.objects.bulk_create(
+        [Team(name='Team {}'.format(idx + 1), slug='team-{}'.format(idx + 1)) for idx in range(driver_count // 2)]
+    )
+
+    results = []
+    for race in season.race_set.all():
+        for idx, driver_idx in enumerate(rng.sample(range(driver_count), driver_count)):
+            results.append(Result(
+                race=race, driver=drivers[driver_idx], team=teams[driver_idx // 2], position=idx + 1, qualifying=idx + 1
+            ))
+    Result.objects.bulk_create(results)
+
+    standings_drivers, standings_teams = StandingsEngine(season).build()
+    context = Context({
+        'drivers': standings_drivers,
+        'teams': standings_teams,
+        'races': list(season.race_set.all()),
+    })
+    scanned = timed(lambda: Template(SCANNED_GRID).render(context), repeat)
+    indexed = timed(lambda: Template(INDEXED_GRID).render(context), repeat)
+
+    return [{
+        'name': 'season grid {} drivers x {} rounds'.format(driver_count, rounds),
+        'scanned': scanned,
+        'indexed': indexed,
+        'speedup': scanned / indexed if indexed else 0
+    }]
+
+
+season_grid.needs_database = True
+
+
+def synthetic_league(driver_count=40, rounds=10, lap_count=30, seed=0):
+    """
+    Creates a finished season of `rounds` races between `driver_count`
+    drivers in two-driver teams, with race and qualifying laps, car numbers,
+    stats, team histories and track records, so every page has something to
+    show. The last race is moved into the future for the next race endpoint.
+    """
+    from .models import Driver, Lap, Result, SeasonCarNumber, Team, TeamHistory, TrackRecord
+
+    rng = random.Random(seed)
+    countries = ['GB', 'DE', 'FR', 'NL', 'FI', 'BR', 'ES', 'IT']
+    season = create_season(rounds, name='League')
+
+    drivers = Driver.objects.bulk_create([
+        Driver(
+            name='League Driver {}'.format(idx + 1), slug='league-driver-{}'.format(idx + 1), country=countries[idx % 8]
+        )
+        for idx in range(driver_count)
+    ])
+    teams = Team.objects.bulk_create([
+        Team(name='League Team {}'.format(idx + 1), slug='league-team-{}'.format(idx + 1), country=countries[idx % 8])
+        for idx in range((driver_count + 1) // 2)
+    ])
+    SeasonCarNumber.objects.bulk_create([
+        SeasonCarNumber(season=season, driver=driver, car_number=idx + 1) for idx, driver in enumerate(drivers)
+    ])
+
+    results = []
+    for race in season.race_set.all():
+        for idx, driver_idx in enumerate(rng.sample(range(driver_count), driver_count)):
+            results.append(Result(
+                race=race, driver=drivers[driver_idx], team=teams[driver_idx // 2], position=idx + 1,
+                qualifying=rng.randint(1, driver_count), race_laps=lap_count, race_time=lap_count * 90 + idx,
+                race_fastest_lap=89 + rng.random(), qualifying_fastest_lap=88 + rng.random()
+            ))
+    results = Result.objects.bulk_create(results)
+
+    laps = []
+    for result in results:
+        for number in range(1, lap_count + 1):
+            laps.append(Lap(
+                result=result, session='race', lap_number=number, position=result.position, lap_time=90 + rng.random(),
+                compound='0,Medium (M)', pitstop=number == lap_count // 2
+            ))
+        for number in range(1, 4):
+            laps.append(Lap(
+                result=result, session='qualify', lap_number=number, lap_time=88 + rng.random(), compound='0,Soft (S)'
+            ))
+    Lap.objects.bulk_create(laps, batch_size=2000)
+
+    for race in season.race_set.all():
+        race.fill_attributes()
+    TrackRecord.refresh(season.race_set.values_list('track_id', flat=True))
+    season.update_stats()
+    TeamHistory.refresh(season.id, [team.id for team in teams])
+
+    season.race_set.filter(round_number=rounds).update(start_time=timezone.now() + timedelta(days=1))
+
+    return season
+
+
+def league_urls(season):
+    """
+    (name, url) of every public page of the site and every API endpoint,
+    for the objects of a synthetic league.
+    """
+    race = season.race_set.order_by('round_number').first()
+    result = race.result_set.order_by('position').first()
+    (driver, team, division) = (result.driver, result.team, season.division)
+    country = driver.country.code
+    car_number = season.seasoncarnumber_set.get(driver=driver).car_number
+
+    return [
+        ('index', '/'),
+        ('league', '/league/{}/'.format(division.league_id)),
+        ('division', '/division/{}/'.format(division.id)),
+        ('season', '/season/{}/'.format(season.id)),
+        ('season stats', '/season/{}/stats'.format(season.id)),
+        ('season (slugs)', '/{}/{}'.format(division.slug, season.slug)),
+        ('driver', '/driver/{}/'.format(driver.id)),
+        ('driver (slug)', '/driver/{}/'.format(driver.slug)),
+        ('team', '/team/{}/'.format(team.id)),
+        ('team (slug)', '/team/{}/'.format(team.slug)),
+        ('race', '/race/{}/'.format(race.id)),
+        ('laps', '/laps/{}'.format(result.id)),
+        ('track', '/track/{}/'.format(race.track_id)),
+        ('countries', '/countries/'),
+        ('countries (division)', '/countries/{}/'.format(division.id)),
+        ('country', '/country/{}/'.format(country)),
+        ('country (division)', '/country/{}/{}/'.format(country, division.id)),
+        ('api drivers', '/api/drivers'),
+        ('api teams', '/api/teams'),
+        ('api results', '/api/results'),
+        ('api results (season)', '/api/results?season={}'.format(season.id)),
+        ('api driver', '/api/drivers/{}/{}'.format(car_number, season.id)),
+        ('api team', '/api/teams/{}'.format(team.id)),
+        ('api races', '/api/races'),
+        ('api race', '/api/races/{}'.format(race.id)),
+        ('api next race', '/api/next-race'),
+        ('api stats', '/api/stats?season={}'.format(season.id)),
+        ('api standings', '/api/standings/{}'.format(season.id)),
+        ('api team standings', '/api/standings/{}/team'.format(season.id)),
+        ('api division info', '/api/info/{}'.format(division.name)),
+        ('api season', '/api/season/{}'.format(season.id)),
+        ('api export results', '/api/export/results?season={}'.format(season.id)),
+        ('api export laps', '/api/export/laps?season={}'.format(season.id)),
+    ]
+
+
+def fetch(client, url):
+    response = client.get(url)
+    if response.status_code != 200:
+        raise AssertionError('{} answered {}'.format(url, response.status_code))
+
+    # streamed responses are only produced as they are read
+    if response.streaming:
+        for _ in response.streaming_content:
+            pass
+
+    return response
+
+
+def urls(repeat=3, drivers=40, rounds=10, laps=30):
+    """
+    Requests every page of a synthetic league with the view cache emptied
+    first, reporting the best wall time, the query count and the peak memory
+    allocated while rendering.
+    """
+    from django.core.cache import cache
+    from django.test import Client
+    import tracemalloc
+
+    season = synthetic_league(drivers, rounds, laps)
+    client = Client()
+
+    rows = []
+    for name, url in league_urls(season):
+        def render():
+            cache.clear()
+            fetch(client, url)
+
+        seconds = timed(render, repeat)
+        (_, queries) = timed_queries(render)
+
+        cache.clear()
+        tracemalloc.start()
+        try:
+            fetch(client, url)
+            (_, peak) = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        rows.append({'name': name, 'seconds': seconds, 'queries': queries, 'peak_kb': peak // 1024})
+
+    return rows
+
+
+urls.needs_database = True
+urls.synthetic_league = True
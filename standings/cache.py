@@ -0,0 +1,423 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.http import HttpResponse
+from contextlib import contextmanager
+from functools import wraps
+import hashlib
+import threading
+import time
+from .models import Division, Driver, DriverCareer, League, PointSystem, Race, Result, Season, SeasonCarNumber, \
+    SeasonPenalty, SeasonTyreMap, StandingsSnapshot, Team, TeamHistory, Track, TrackRecord
+
+
+# changes held back by batched() on this thread
+_batch = threading.local()
+
+
+def version_key(scope, pk):
+    return 'version:{}:{}'.format(scope, pk)
+
+
+def new_version():
+    # starting from the clock means a version that was evicted never comes back with an old value
+    return int(time.time() * 1000)
+
+
+def versions(dependencies):
+    keys = [version_key(scope, pk) for scope, pk in dependencies]
+    found = cache.get_many(keys)
+
+    for key in keys:
+        if key not in found:
+            cache.add(key, new_version(), None)
+            found[key] = cache.get(key)
+
+    return [found[key] for key in keys]
+
+
+def touch(scope, *pks):
+    """
+    Bumps the version of every `scope` object in `pks`, which expires all
+    cached responses that depend on them.
+    """
+    pending = getattr(_batch, 'pending', None)
+    if pending is not None:
+        pending['touch'].setdefault(scope, set()).update(pks)
+        return
+
+    for pk in set(pks):
+        if pk is None:
+            continue
+
+        try:
+            cache.incr(version_key(scope, pk))
+        except ValueError:
+            cache.set(version_key(scope, pk), new_version(), None)
+
+
+def touch_drivers(*driver_ids):
+    # driver pages are built from the career aggregate, so that is rebuilt too
+    pending = getattr(_batch, 'pending', None)
+    if pending is not None:
+        pending['careers'].update(driver_ids)
+    else:
+        DriverCareer.expire(driver_ids)
+
+    touch('driver', *driver_ids)
+
+
+def touch_teams(season_id, team_ids, driver_ids=()):
+    # team pages are built from the team history, so the season's rows for the teams are refreshed too
+    pending = getattr(_batch, 'pending', None)
+    if pending is not None:
+        (teams, drivers) = pending['history'].setdefault(season_id, (set(), set()))
+        teams.update(team_ids)
+        drivers.update(driver_ids)
+    else:
+        touch('team', *TeamHistory.refresh(season_id, team_ids, driver_ids))
+
+    touch('team', *team_ids)
+
+
+def expire_stats(season_ids=(), track_ids=()):
+    # marks the season stats and track records for manage.py stats_records to rebuild
+    pending = getattr(_batch, 'pending', None)
+    if pending is not None:
+        pending['seasons'].update(season_ids)
+        pending['tracks'].update(track_ids)
+    else:
+        Season.expire_stats(season_ids)
+        Track.expire_records(track_ids)
+
+
+def expire_snapshots(season_id, from_round=0):
+    # a change to a round's results alters the standings of that round and every one after it
+    pending = getattr(_batch, 'pending', None)
+    if pending is not None:
+        pending['snapshots'][season_id] = min(from_round, pending['snapshots'].get(season_id, from_round))
+    else:
+        StandingsSnapshot.expire(season_id, from_round)
+
+
+def snapshots_refreshed(season_id, from_round=None):
+    # snapshots rebuilt inside a batch after the changes that expired them don't need expiring again
+    pending = getattr(_batch, 'pending', None)
+    if pending is not None and (from_round or 0) <= pending['snapshots'].get(season_id, -1):
+        del pending['snapshots'][season_id]
+
+
+@contextmanager
+def batched():
+    """
+    Holds back the aggregate refreshes and version bumps made inside the
+    block, by signals or explicitly, and runs each of them once on the way
+    out. For code that saves many results one at a time.
+    """
+    if getattr(_batch, 'pending', None) is not None:
+        yield
+        return
+
+    _batch.pending = {
+        'touch': {}, 'careers': set(), 'history': {}, 'seasons': set(), 'tracks': set(), 'snapshots': {}, 'races': {}
+    }
+    try:
+        yield
+    finally:
+        pending = _batch.pending
+        _batch.pending = None
+
+        DriverCareer.expire(pending['careers'])
+        Season.expire_stats(pending['seasons'])
+        Track.expire_records(pending['tracks'])
+        for season_id, from_round in pending['snapshots'].items():
+            StandingsSnapshot.expire(season_id, from_round)
+        for season_id, (team_ids, driver_ids) in pending['history'].items():
+            pending['touch'].setdefault('team', set()).update(TeamHistory.refresh(season_id, team_ids, driver_ids))
+
+        for scope, pks in pending['touch'].items():
+            touch(scope, *pks)
+
+
+def touch_races(races):
+    """
+    Expires the races, their seasons and every driver and team with a result
+    in them, for changes written with bulk or queryset updates that send no
+    signals.
+    """
+    race_ids = [race.id for race in races]
+    touch('race', *race_ids)
+    touch('season', *[race.season_id for race in races])
+    expire_stats([race.season_id for race in races], [race.track_id for race in races])
+    for race in races:
+        expire_snapshots(race.season_id, race.round_number)
+
+    teams = {}
+    results = Result.objects.filter(race_id__in=race_ids).values_list('race__season_id', 'driver_id', 'team_id')
+    for season_id, driver_id, team_id in results:
+        teams.setdefault(season_id, set()).add(team_id)
+    touch_drivers(*[driver_id for _, driver_id, _ in results])
+
+    for season_id, team_ids in teams.items():
+        touch_teams(season_id, team_ids)
+
+
+def touch_pages(results):
+    """
+    Expires the race, season, driver and team pages that show any of
+    `results`, for changes to something those pages display alongside them
+    (a driver or team name, a race, its track, season or division).
+    """
+    rows = list(results.order_by().values_list('race_id', 'race__season_id', 'driver_id', 'team_id').distinct())
+
+    touch('race', *[race_id for race_id, _, _, _ in rows])
+    touch('season', *[season_id for _, season_id, _, _ in rows])
+    touch_drivers(*[driver_id for _, _, driver_id, _ in rows])
+    touch('team', *[team_id for _, _, _, team_id in rows])
+
+
+def race_of(result):
+    """
+    The (season_id, track_id, round_number) of a result's race, taken from
+    the race when it is already loaded and otherwise read once (once per
+    race in a batch, e.g. for the results of a cascading delete).
+    """
+    if Result._meta.get_field('race').is_cached(result):
+        race = result.race
+        return race.season_id, race.track_id, race.round_number
+
+    pending = getattr(_batch, 'pending', None)
+    if pending is not None and result.race_id in pending['races']:
+        return pending['races'][result.race_id]
+
+    race = Race.objects.filter(pk=result.race_id).values_list('season_id', 'track_id', 'round_number').first()
+    if pending is not None:
+        pending['races'][result.race_id] = race
+
+    return race
+
+
+def response_keys(request, dependencies):
+    """
+    Returns the key of the response for the current versions of its
+    dependencies, and the key the last response for the page is kept under
+    whatever the versions.
+    """
+    page = '{}|{}'.format(request.get_full_path(), request.META.get('HTTP_ACCEPT', ''))
+    versioned = zip(dependencies, versions(dependencies))
+    current = '|'.join([page] + ['{}:{}={}'.format(scope, pk, version) for (scope, pk), version in versioned])
+
+    return 'view:{}'.format(hashlib.md5(current.encode('utf-8')).hexdigest()), \
+        'view-stale:{}'.format(hashlib.md5(page.encode('utf-8')).hexdigest())
+
+
+def single_flight(key, compute, timeout=None, stale_key=None, lock_timeout=30):
+    """
+    Returns the cached value for `key`, calling `compute` when it is missing.
+
+    Only one caller at a time computes a key, across every process sharing
+    the cache. The others serve the value last stored under `stale_key` if
+    there is one, otherwise they wait for the result, and compute it
+    themselves if the lock outlives `lock_timeout`.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = 'lock:{}'.format(key)
+    deadline = time.time() + lock_timeout
+    while not cache.add(lock_key, True, lock_timeout):
+        if stale_key is not None:
+            value = cache.get(stale_key)
+            if value is not None:
+                return value
+
+        if time.time() > deadline:
+            break
+
+        time.sleep(0.05)
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+    try:
+        value = compute()
+        if value is not None:
+            cache.set(key, value, timeout)
+            if stale_key is not None:
+                cache.set(stale_key, value, timeout)
+    finally:
+        cache.delete(lock_key)
+
+    return value
+
+
+def cached_view(**scopes):
+    """
+    Caches a view's responses against the versions of the objects it shows,
+    given as scope=url kwarg, e.g. @cached_view(season='season_id').
+
+    Nothing is purged by hand, saving or deleting an object bumps its version
+    so the next request renders under a new key. While one request renders
+    the new version the others get the previous one.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            dependencies = [(scope, kwargs.get(kwarg)) for scope, kwarg in sorted(scopes.items())]
+            key, stale_key = response_keys(request, dependencies)
+            rendered = []
+
+            def render():
+                response = view(request, *args, **kwargs)
+                # template and rest framework responses are otherwise only rendered on the way out
+                if not getattr(response, 'is_rendered', True):
+                    response.render()
+                rendered.append(response)
+
+                if response.status_code == 200 and not response.streaming and not response.cookies:
+                    return {
+                        'content': response.content,
+                        'status': response.status_code,
+                        'headers': list(response.items())
+                    }
+
+                return None
+
+            cached = single_flight(key, render, getattr(settings, 'VIEW_CACHE_TIMEOUT', None), stale_key)
+            if rendered:
+                return rendered[0]
+
+            response = HttpResponse(cached['content'], status=cached['status'])
+            for header, value in cached['headers']:
+                response[header] = value
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+@receiver(post_save, sender=Season)
+@receiver(post_delete, sender=Season)
+def season_changed(sender, instance, **kwargs):
+    touch('season', instance.id)
+    expire_snapshots(instance.id)
+    touch_pages(Result.objects.filter(race__season_id=instance.id))
+
+
+@receiver(post_save, sender=Race)
+@receiver(post_delete, sender=Race)
+def race_changed(sender, instance, **kwargs):
+    touch('race', instance.id)
+    touch('season', instance.season_id)
+    # a race moved to another track takes its records with it
+    track_ids = [instance.track_id] + \
+        list(TrackRecord.objects.filter(race_id=instance.id).values_list('track_id', flat=True))
+    expire_stats([instance.season_id], track_ids)
+    # the race may have moved to another round
+    expire_snapshots(instance.season_id)
+    touch_pages(Result.objects.filter(race_id=instance.id))
+
+
+@receiver(post_save, sender=Result)
+@receiver(post_delete, sender=Result)
+def result_changed(sender, instance, **kwargs):
+    touch('race', instance.race_id)
+    touch_drivers(instance.driver_id, instance.subbed_by_id)
+
+    race = race_of(instance)
+    if race is None:
+        return
+
+    (season_id, track_id, round_number) = race
+    touch('season', season_id)
+    expire_stats([season_id], [track_id])
+    expire_snapshots(season_id, round_number)
+    # the driver may have moved from another team, so their rows for every team are refreshed
+    touch_teams(season_id, [instance.team_id], [instance.driver_id])
+
+
+@receiver(post_save, sender=SeasonCarNumber)
+@receiver(post_delete, sender=SeasonCarNumber)
+def car_number_changed(sender, instance, **kwargs):
+    touch('season', instance.season_id)
+
+
+@receiver(post_save, sender=SeasonPenalty)
+@receiver(post_delete, sender=SeasonPenalty)
+def penalty_changed(sender, instance, **kwargs):
+    touch('season', instance.season_id)
+    expire_stats([instance.season_id])
+    expire_snapshots(instance.season_id)
+    touch_drivers(instance.driver_id)
+    touch_teams(instance.season_id, [instance.team_id])
+
+
+@receiver(post_save, sender=Driver)
+@receiver(post_delete, sender=Driver)
+def driver_changed(sender, instance, **kwargs):
+    touch_drivers(instance.id)
+    touch_pages(Result.objects.filter(driver_id=instance.id))
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def team_changed(sender, instance, **kwargs):
+    # a team's page shows its parent
+    touch('team', instance.id, *Team.objects.filter(parent_id=instance.id).values_list('id', flat=True))
+    touch_pages(Result.objects.filter(team_id=instance.id))
+
+
+@receiver(post_save, sender=SeasonTyreMap)
+@receiver(post_delete, sender=SeasonTyreMap)
+def tyre_map_changed(sender, instance, **kwargs):
+    # race pages name the compounds through their season's map
+    touch('season', instance.season_id)
+    touch('race', *Race.objects.filter(season_id=instance.season_id).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=PointSystem)
+@receiver(pre_delete, sender=PointSystem)
+def point_system_changed(sender, instance, **kwargs):
+    # before a delete, which unsets the seasons' and races' point system without sending signals
+    races = Race.objects.filter(Q(season__point_system_id=instance.id) | Q(point_system_id=instance.id))
+    season_ids = set(races.values_list('season_id', flat=True)) | \
+        set(Season.objects.filter(point_system_id=instance.id).values_list('id', flat=True))
+
+    touch('season', *season_ids)
+    touch('race', *races.values_list('id', flat=True))
+    expire_stats(season_ids)
+    for season_id in season_ids:
+        expire_snapshots(season_id)
+    touch_pages(Result.objects.filter(race__in=races))
+
+
+# races without results yet are listed on their season's page, so the seasons are expired directly too
+@receiver(post_save, sender=Track)
+@receiver(post_delete, sender=Track)
+def track_changed(sender, instance, **kwargs):
+    races = Race.objects.filter(track_id=instance.id)
+    touch('race', *races.values_list('id', flat=True))
+    touch('season', *races.values_list('season_id', flat=True))
+    touch_pages(Result.objects.filter(race__track_id=instance.id))
+
+
+@receiver(post_save, sender=Division)
+@receiver(post_delete, sender=Division)
+def division_changed(sender, instance, **kwargs):
+    touch('season', *Season.objects.filter(division_id=instance.id).values_list('id', flat=True))
+    touch_pages(Result.objects.filter(race__season__division_id=instance.id))
+
+
+@receiver(post_save, sender=League)
+@receiver(post_delete, sender=League)
+def league_changed(sender, instance, **kwargs):
+    touch('season', *Season.objects.filter(division__league_id=instance.id).values_list('id', flat=True))
+    touch_pages(Result.objects.filter(race__season__division__league_id=instance.id))
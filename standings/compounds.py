@@ -0,0 +1,44 @@
+class CompoundMap:
+    """
+    A season's tyre compound map compiled into a matcher.
+
+    Each raw compound name from the log files is matched against the map
+    once and remembered, so translating a lap list is a dictionary lookup
+    per lap. Matchers are cached by tyre map id like point tables, dropped
+    when the map is saved and rebuilt if the names they were built from no
+    longer match.
+    """
+
+    _cache = {}
+
+    def __init__(self, tyre_map):
+        self.source = self.names(tyre_map)
+        self.patterns = [(f"c{x + 1}", name.lower()) for x, name in enumerate(self.source) if name]
+        self.mapped = {}
+
+    @staticmethod
+    def names(tyre_map):
+        return tuple(getattr(tyre_map, f"c{x + 1}") for x in range(7))
+
+    @classmethod
+    def for_tyre_map(cls, tyre_map):
+        matcher = cls._cache.get(tyre_map.id)
+        if matcher is None or matcher.source != cls.names(tyre_map):
+            matcher = cls(tyre_map)
+            if tyre_map.id is not None:
+                cls._cache[tyre_map.id] = matcher
+
+        return matcher
+
+    @classmethod
+    def invalidate(cls, tyre_map_id):
+        cls._cache.pop(tyre_map_id, None)
+
+    def map(self, compound):
+        mapped = self.mapped.get(compound)
+        if mapped is None:
+            lowered = compound.lower()
+            mapped = next((code for code, name in self.patterns if name in lowered), compound)
+            self.mapped[compound] = mapped
+
+        return mapped
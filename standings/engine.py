@@ -0,0 +1,396 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Subquery
+from .models import Driver, Race, Result, Season, SeasonPenalty, SeasonStats, StandingsSnapshot, Team
+from .utils import apply_gaps, apply_positions, countback_sort
+
+
+class StandingsEngine:
+    """
+    Builds the driver and team tables for a season.
+
+    Everything the tables need is loaded by a fixed number of bulk queries
+    (QUERY_COUNT) before a single pass over the results, so the cost of
+    building standings no longer grows with the number of drivers and teams.
+    """
+
+    # results, season penalties and season stats (best results)
+    QUERY_COUNT = 3
+
+    def __init__(self, season, upto=None):
+        self.season = season
+        self.upto = upto
+
+    def load_results(self):
+        results = Result.objects.filter(race__season=self.season).order_by('race_id', 'position', 'id').\
+            select_related('race', 'race__season', 'race__point_system', 'race__track', 'driver', 'team')
+
+        if self.upto:
+            results = results.filter(race__round_number__lte=self.upto)
+
+        return results
+
+    def load_penalties(self):
+        driver_penalties = {}
+        team_penalties = {}
+
+        for penalty in SeasonPenalty.objects.filter(season=self.season).order_by('id').\
+                select_related('season__division', 'driver', 'team'):
+            if penalty.driver_id is not None:
+                driver_penalties.setdefault(penalty.driver_id, penalty)
+            if penalty.team_id is not None:
+                team_penalties.setdefault(penalty.team_id, penalty)
+
+        return driver_penalties, team_penalties
+
+    def load_best_results(self):
+        stats = SeasonStats.objects.filter(season=self.season).\
+            select_related('best_result', 'best_result__race', 'best_result__race__season',
+                           'best_result__race__point_system')
+
+        return {stat.driver_id: stat.best_result for stat in stats}
+
+    def build(self, use_position=False):
+        drivers, teams = self.aggregate(self.load_results(), *self.load_penalties(), self.load_best_results())
+
+        return self.index_results(
+            apply_gaps(self.sort_drivers(drivers)),
+            apply_positions(self.sort_teams(teams), use_position=use_position)
+        )
+
+    def aggregate(self, results, driver_penalties, team_penalties, best_results, totals=None):
+        """
+        Adds `results` to the running totals of each driver and team. A
+        (drivers, teams, constructor_max) triple from an earlier call can be
+        passed as `totals` to carry on from where it left off.
+        """
+        season = self.season
+
+        (drivers, teams, constructor_max) = totals if totals is not None else ({}, {}, {})
+
+        for result in results:
+            if result.driver_id not in drivers:
+                best_result = best_results.get(result.driver_id)
+                best_finish = best_result.position if best_result is not None else 99
+
+                drivers[result.driver_id] = {
+                    'driver': result.driver,
+                    'teams': [result.team],
+                    'points': result.points,
+                    'results': [result],
+                    'positions': {x + 1: 0 for x in range(season.countback_range)},
+                    'position': 0,
+                    'best_finish': best_finish,
+                    'best_result': best_result,
+                    'season_penalty': None
+                }
+
+                if 0 < result.position <= season.countback_range:
+                    drivers[result.driver_id]['positions'][result.position] += 1
+
+                sp = driver_penalties.get(result.driver_id)
+                if sp is not None:
+                    drivers[result.driver_id]['season_penalty'] = sp
+                    drivers[result.driver_id]['points'] -= sp.points
+
+            else:
+                drivers[result.driver_id]['results'].append(result)
+                drivers[result.driver_id]['points'] += result.points
+                if result.team not in drivers[result.driver_id]['teams']:
+                    drivers[result.driver_id]['teams'].append(result.team)
+
+                if 0 < result.position <= season.countback_range:
+                    drivers[result.driver_id]['positions'][result.position] += 1
+
+            if not season.teams_disabled:
+                result.team_points_allocated = False
+                race_max = constructor_max.setdefault(result.race_id, {})
+                race_max.setdefault(result.team_id, 0)
+
+                if result.team_id not in teams:
+                    teams[result.team_id] = {
+                        'team': result.team,
+                        'points': result.points,
+                        'results': [result],
+                        'drivers': {result.driver_id: {'driver': result.driver, 'points': result.points}},
+                        'season_penalty': None
+                    }
+
+                    sp = team_penalties.get(result.team_id)
+                    if sp is not None:
+                        teams[result.team_id]['season_penalty'] = sp
+                        teams[result.team_id]['points'] -= sp.points
+
+                    race_max[result.team_id] += 1
+                    result.team_points_allocated = True
+
+                else:
+                    if season.constructor_max == 0 or race_max[result.team_id] < season.constructor_max:
+                        teams[result.team_id]['points'] += result.points
+                        race_max[result.team_id] += 1
+                        if season.constructor_max > 0 and result.classified:
+                            result.team_points_allocated = True
+
+                    teams[result.team_id]['results'].append(result)
+
+                    if result.driver_id not in teams[result.team_id]['drivers']:
+                        teams[result.team_id]['drivers'][result.driver_id] = {
+                            'driver': result.driver,
+                            'points': result.points
+                        }
+                    else:
+                        teams[result.team_id]['drivers'][result.driver_id]['points'] += result.points
+
+                teams[result.team_id]['driver_count'] = len(teams[result.team_id]['drivers'])
+
+        return drivers, teams
+
+    def sort_drivers(self, drivers):
+        # points, then countback, then best finish
+        driver_sort = countback_sort(
+            drivers,
+            positions=lambda item: drivers[item]['positions'],
+            points=lambda item: drivers[item]['points'],
+            tie_breaker=lambda item: drivers[item]['best_finish'],
+            depth=self.season.countback_range
+        )
+
+        sorted_drivers = [drivers[driver] for driver in driver_sort]
+        for idx, driver in enumerate(sorted_drivers):
+            driver['position'] = idx + 1
+
+        return sorted_drivers
+
+    @staticmethod
+    def sort_teams(teams):
+        team_sort = sorted(teams, key=lambda item: teams[item]['season_penalty'] is None, reverse=True)
+        team_sort = sorted(team_sort, key=lambda item: teams[item]['points'], reverse=True)
+
+        sorted_teams = []
+        for team in team_sort:
+            sorted_teams.append(teams[team])
+
+            team_drivers = teams[team]['drivers']
+            teams[team]['drivers'] = [
+                team_drivers[driver] for driver in
+                sorted(team_drivers, key=lambda item: team_drivers[item]['points'], reverse=True)
+            ]
+
+        return sorted_teams
+
+    def build_snapshots(self, from_round=None):
+        """
+        Builds the standings as they stood after each round of the season
+        from one load of its results, adding each round's results to the
+        totals carried over from the round before.
+        """
+        driver_penalties, team_penalties = self.load_penalties()
+        best_results = self.load_best_results()
+
+        rounds = {round_number: [] for round_number in self.season.race_set.values_list('round_number', flat=True)}
+        for result in self.load_results():
+            rounds[result.race.round_number].append(result)
+
+        totals = ({}, {}, {})
+        snapshots = []
+        for round_number in sorted(rounds):
+            drivers, teams = self.aggregate(
+                rounds[round_number], driver_penalties, team_penalties, best_results, totals
+            )
+            if from_round is not None and round_number < from_round:
+                continue
+
+            # sorting replaces each team's drivers with a sorted list, so a copy is sorted to keep the totals intact
+            teams = {team_id: dict(row) for team_id, row in teams.items()}
+            snapshots.append(StandingsSnapshot(
+                season=self.season,
+                round_number=round_number,
+                drivers=[self.serialize_driver(row) for row in apply_gaps(self.sort_drivers(drivers))],
+                teams=[self.serialize_team(row) for row in apply_positions(self.sort_teams(teams), use_position=True)]
+            ))
+
+        return snapshots
+
+    def refresh_snapshots(self, from_round=None, skip_locked=False):
+        # refreshes of a season take turns on its row lock, rather than inserting the same rounds at once
+        with transaction.atomic():
+            if not Season.lock(self.season.id, skip_locked=skip_locked):
+                return []
+
+            snapshots = self.build_snapshots(from_round=from_round)
+            stale = StandingsSnapshot.objects.filter(season=self.season)
+            if from_round is not None:
+                stale = stale.filter(round_number__gte=from_round)
+            stale.delete()
+
+            StandingsSnapshot.objects.bulk_create(snapshots)
+
+        return snapshots
+
+    def load_snapshot(self):
+        # the snapshot of the last round up to `upto`, never an earlier round's standing in for a missing one
+        rounds = Race.objects.filter(season=self.season).order_by('-round_number').values('round_number')
+        if self.upto:
+            rounds = rounds.filter(round_number__lte=self.upto)
+
+        return StandingsSnapshot.objects.filter(season=self.season, round_number=Subquery(rounds[:1])).first()
+
+    def refresh_missing(self):
+        """
+        Rebuilds the snapshots from the first round that has none onwards,
+        changes to results and penalties expire them from the round they
+        affect (see StandingsSnapshot.expire).
+        """
+        built = set(StandingsSnapshot.objects.filter(season=self.season).values_list('round_number', flat=True))
+        missing = sorted(set(self.season.race_set.values_list('round_number', flat=True)) - built)
+        if not missing:
+            return
+
+        # a reader doesn't wait on a job rebuilding the season, the standings are built without a snapshot meanwhile
+        try:
+            self.refresh_snapshots(from_round=missing[0], skip_locked=True)
+        except IntegrityError:
+            # another request rebuilt them first
+            pass
+
+    def read(self, use_position=False, with_results=True):
+        """
+        Returns the standings from the stored snapshot for the requested round,
+        rebuilding expired snapshots first and only falling back to a full
+        build when there is no usable snapshot.
+        """
+        snapshot = self.load_snapshot()
+        if snapshot is None:
+            self.refresh_missing()
+            snapshot = self.load_snapshot()
+
+        if snapshot is None:
+            return self.build(use_position=use_position)
+
+        standings = self.hydrate(snapshot, use_position=use_position, with_results=with_results)
+        if standings is None:
+            return self.build(use_position=use_position)
+
+        return standings
+
+    def hydrate(self, snapshot, use_position=False, with_results=True):
+        driver_results = {}
+        team_results = {}
+        results = {}
+
+        if with_results:
+            drivers = {}
+            teams = {}
+            for result in StandingsEngine(self.season, upto=snapshot.round_number).load_results():
+                results[result.id] = result
+                drivers[result.driver_id] = result.driver
+                teams[result.team_id] = result.team
+                driver_results.setdefault(result.driver_id, []).append(result)
+                team_results.setdefault(result.team_id, []).append(result)
+        else:
+            drivers = Driver.objects.in_bulk([row['driver_id'] for row in snapshot.drivers if row['driver_id']])
+            teams = Team.objects.in_bulk([row['team_id'] for row in snapshot.teams if row['team_id']])
+            drivers[None] = None
+            teams[None] = None
+
+        # the snapshot no longer matches the results, so it can't be trusted
+        if any(row['driver_id'] not in drivers for row in snapshot.drivers) or \
+                any(row['team_id'] not in teams for row in snapshot.teams):
+            return None
+
+        # best results can come from rounds after the snapshot, so load those in one go
+        best_result_ids = [row['best_result_id'] for row in snapshot.drivers if row['best_result_id']]
+        missing = [result_id for result_id in best_result_ids if result_id not in results]
+        best_results = {result_id: results[result_id] for result_id in best_result_ids if result_id in results}
+        if missing:
+            best_results.update(
+                Result.objects.select_related('race', 'race__season', 'race__point_system').in_bulk(missing)
+            )
+
+        sorted_drivers = []
+        for row in snapshot.drivers:
+            best_result = best_results.get(row['best_result_id'])
+
+            sorted_drivers.append({
+                'driver': drivers[row['driver_id']],
+                'teams': [teams.get(team_id) for team_id in row['team_ids']],
+                'points': row['points'],
+                'results': driver_results.get(row['driver_id'], []),
+                'positions': {pos + 1: count for pos, count in enumerate(row['positions'])},
+                'position': row['position'],
+                'gap': row['gap'],
+                'best_finish': row['best_finish'],
+                'best_result': best_result,
+                'season_penalty': row['season_penalty']
+            })
+
+        sorted_teams = []
+        for row in snapshot.teams:
+            for result in team_results.get(row['team_id'], []):
+                result.team_points_allocated = result.id in row['allocated']
+
+            sorted_teams.append({
+                'team': teams[row['team_id']],
+                'points': row['points'],
+                'results': team_results.get(row['team_id'], []),
+                'drivers': [{'driver': drivers.get(d['driver_id']), 'points': d['points']} for d in row['drivers']],
+                'driver_count': row['driver_count'],
+                'season_penalty': row['season_penalty']
+            })
+
+        return self.index_results(sorted_drivers, apply_positions(sorted_teams, use_position=use_position))
+
+    @staticmethod
+    def index_results(drivers, teams):
+        """
+        Gives every driver row, and every driver within a team row, a
+        race id -> result mapping so the season grid can look each cell up
+        directly instead of scanning the result lists.
+        """
+        for row in drivers:
+            row['results_by_race'] = {}
+            for result in row['results']:
+                row['results_by_race'].setdefault(result.race_id, result)
+
+        for row in teams:
+            driver_results = {}
+            for result in row['results']:
+                driver_results.setdefault(result.driver_id, {}).setdefault(result.race_id, result)
+
+            for driver in row['drivers']:
+                driver['results_by_race'] = driver_results.get(driver['driver'].id if driver['driver'] else None, {})
+
+        return drivers, teams
+
+    @staticmethod
+    def serialize_penalty(penalty):
+        if penalty is None:
+            return None
+
+        return str(penalty)
+
+    def serialize_driver(self, row):
+        return {
+            'driver_id': row['driver'].id if row['driver'] else None,
+            'team_ids': [team.id if team else None for team in row['teams']],
+            'points': row['points'],
+            'position': row['position'],
+            'gap': row['gap'],
+            'positions': [row['positions'][pos + 1] for pos in range(self.season.countback_range)],
+            'best_finish': row['best_finish'],
+            'best_result_id': row['best_result'].id if row['best_result'] else None,
+            'season_penalty': self.serialize_penalty(row['season_penalty'])
+        }
+
+    def serialize_team(self, row):
+        return {
+            'team_id': row['team'].id if row['team'] else None,
+            'points': row['points'],
+            'position': row['position'],
+            'gap': row['gap'],
+            'driver_count': row['driver_count'],
+            'drivers': [
+                {'driver_id': d['driver'].id if d['driver'] else None, 'points': d['points']} for d in row['drivers']
+            ],
+            'allocated': [result.id for result in row['results'] if result.team_points_allocated],
+            'season_penalty': self.serialize_penalty(row['season_penalty'])
+        }
@@ -0,0 +1,139 @@
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from contextlib import contextmanager
+from datetime import timedelta
+import logging
+import traceback
+from . import profiling
+from .cache import batched
+from .models import Job, LogFile, Race, Season, SeasonStats, Track
+
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def season_locked(season_id):
+    """
+    Runs a task in one transaction holding the season's row lock, so jobs
+    on the same season (the qualifying and race logs of a race, say) run one
+    after the other instead of creating its results and drivers at the same
+    moment. Pages are expired once the transaction has committed.
+    """
+    with batched(), transaction.atomic():
+        Season.lock(season_id)
+        yield
+
+
+def process_log_file(log_file_id, post_fields=None):
+    log_file = LogFile.objects.select_related('race').get(pk=log_file_id)
+    with season_locked(log_file.race.season_id):
+        log_file.process(post_fields)
+
+
+def fill_attributes(race_id):
+    race = Race.objects.get(pk=race_id)
+    with season_locked(race.season_id):
+        race.fill_attributes()
+
+
+def update_stats(season_id):
+    with season_locked(season_id):
+        Season.objects.get(pk=season_id).update_stats()
+
+
+def update_driver_stats(season_id, driver_id, from_round=None):
+    with season_locked(season_id):
+        (stats, _) = SeasonStats.objects.get_or_create(season_id=season_id, driver_id=driver_id)
+        stats.update_stats()
+        stats.season.refresh_snapshots(from_round=from_round)
+
+
+def update_records(track_id):
+    Track.objects.get(pk=track_id).update_records()
+
+
+tasks = {
+    'process_log_file': process_log_file,
+    'fill_attributes': fill_attributes,
+    'update_stats': update_stats,
+    'update_driver_stats': update_driver_stats,
+    'update_records': update_records,
+}
+
+
+def enqueue(task, **payload):
+    """
+    Queues a task for the worker (manage.py run_jobs), an identical job that
+    is still waiting to run is reused rather than queued twice.
+    """
+    if task not in tasks:
+        raise ValueError('Unknown task: {}'.format(task))
+
+    job = Job.objects.filter(task=task, payload=payload, status='queued').first()
+    if job is None:
+        job = Job.objects.create(task=task, payload=payload)
+
+    return job
+
+
+def stale_before():
+    return timezone.now() - timedelta(seconds=getattr(settings, 'JOB_TIMEOUT', 3600))
+
+
+def recover():
+    """
+    Queues again the jobs that have been running for longer than
+    JOB_TIMEOUT seconds, whose worker must have died with them.
+    """
+    count = Job.objects.filter(status='running', started__lt=stale_before()).update(
+        status='queued', started=None, error='Queued again after running for longer than JOB_TIMEOUT'
+    )
+    if count:
+        logger.warning('Queued {} stale running job(s) again'.format(count))
+
+    return count
+
+
+def claim():
+    # skip_locked lets any number of workers poll the same table without handing out a job twice
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(status='queued').order_by('id').first()
+        if job is not None:
+            job.status = 'running'
+            job.started = timezone.now()
+            job.save(update_fields=['status', 'started'])
+
+    return job
+
+
+def run(job):
+    logger.info('Running {} {}'.format(job.task, job.payload))
+    try:
+        with profiling.profile('job', job.task):
+            tasks[job.task](**job.payload)
+        job.status = 'done'
+        job.error = ''
+    except Exception:
+        logger.exception('{} failed'.format(job.task))
+        job.status = 'failed'
+        job.error = traceback.format_exc()
+
+    job.finished = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished'])
+
+    return job
+
+
+def run_pending():
+    recover()
+
+    count = 0
+    job = claim()
+    while job is not None:
+        run(job)
+        count += 1
+        job = claim()
+
+    return count
@@ -0,0 +1,152 @@
+from collections import namedtuple
+from lxml import etree
+import queue
+import re
+import threading
+
+
+DriverRecord = namedtuple('DriverRecord', [
+    'session', 'name', 'team', 'car_class', 'car', 'grid', 'position', 'laps', 'finished', 'finish_time',
+    'dnf_reason', 'fastest_lap', 'lap_records'
+])
+
+LapRecord = namedtuple('LapRecord', [
+    'number', 'position', 'sector_1', 'sector_2', 'sector_3', 'pitstop', 'lap_time', 'compound',
+    'wear_fl', 'wear_fr', 'wear_rl', 'wear_rr', 'elapsed', 'missing_time'
+])
+
+COMPOUND_RE = re.compile(r'\d,([^\(]+)\([^\)]+\)')
+
+_END = object()
+
+
+def get_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def get_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_compound(value):
+    return COMPOUND_RE.sub(r'\g<1>', value or '').strip().replace(' ', '_').lower()
+
+
+def read_lap(lap):
+    text = (lap.text or '').strip()
+
+    return LapRecord(
+        number=get_int(lap.get('num')),
+        position=get_int(lap.get('p')),
+        sector_1=get_float(lap.get('s1')),
+        sector_2=get_float(lap.get('s2')),
+        sector_3=get_float(lap.get('s3')),
+        pitstop=lap.get('pit') == '1',
+        lap_time=get_float(text),
+        compound=parse_compound(lap.get('fcompound')),
+        wear_fl=get_float(lap.get('twfl')),
+        wear_fr=get_float(lap.get('twfr')),
+        wear_rl=get_float(lap.get('twrl')),
+        wear_rr=get_float(lap.get('twrr')),
+        elapsed=get_float(lap.get('et')),
+        missing_time=text == '--.----'
+    )
+
+
+def read_driver(driver, session):
+    return DriverRecord(
+        session=session,
+        name=driver.findtext('Name'),
+        team=driver.findtext('CarType'),
+        car_class=driver.findtext('CarClass'),
+        car=driver.findtext('VehFile'),
+        grid=driver.findtext('GridPos'),
+        position=driver.findtext('Position'),
+        laps=driver.findtext('Laps'),
+        finished=driver.findtext('FinishStatus') == 'Finished Normally',
+        finish_time=driver.findtext('FinishTime'),
+        dnf_reason=driver.findtext('DNFReason'),
+        fastest_lap=driver.findtext('LapRankIncludingDiscos') == '1',
+        # laps without a number or position can't be stored
+        lap_records=[
+            record for record in (read_lap(lap) for lap in driver.iter('Lap'))
+            if record.number is not None and record.position is not None
+        ]
+    )
+
+
+def release(element):
+    # drop the element and everything before it so the tree never holds more than one driver
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+
+
+def parse_log(source):
+    """
+    Streams the drivers out of an rFactor results file one <Driver> at a time.
+
+    A file holding a <Qualify> session is read as qualifying, anything else
+    as a race, and the session is known by the time its first driver is read.
+    """
+    session = 'race'
+
+    for event, element in etree.iterparse(source, events=('start', 'end'), tag=('Qualify', 'Driver', 'Stream')):
+        if event == 'start':
+            if element.tag == 'Qualify':
+                session = 'qualify'
+            continue
+
+        if element.tag == 'Driver':
+            yield read_driver(element, session)
+
+        release(element)
+
+
+def read_ahead(iterable, size=32):
+    """
+    Consumes `iterable` on a background thread, so producing the next items
+    (parsing) overlaps with whatever the caller does with the current one.
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((_END, None))
+        except Exception as e:
+            put((_END, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _END:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
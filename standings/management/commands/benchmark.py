@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand, CommandError
+from standings import benchmark
+import json
+import os
+
+
+class Command(BaseCommand):
+    help = 'Run performance benchmarks'
+
+    targets = {
+        'ranking': benchmark.ranking,
+        'logfile': benchmark.log_file,
+        'logparse': benchmark.log_parse,
+        'season_grid': benchmark.season_grid,
+        'urls': benchmark.urls,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='*', help='Benchmarks to run ({})'.format(', '.join(self.targets)))
+        parser.add_argument('--repeat', type=int, default=5, help='Best of this many runs is reported')
+        parser.add_argument('--drivers', type=int, default=40, help='Drivers in the synthetic league')
+        parser.add_argument('--rounds', type=int, default=10, help='Races in the synthetic league')
+        parser.add_argument('--laps', type=int, default=30, help='Laps per race in the synthetic league')
+        parser.add_argument('--baseline', help='JSON file of earlier results to fail against on regressions')
+        parser.add_argument('--save-baseline', help='Write the results to this JSON file')
+        parser.add_argument(
+            '--threshold', type=float, default=0.25, help='Fraction times and memory may grow over the baseline'
+        )
+
+    def handle(self, *args, **options):
+        targets = options['targets'] or list(self.targets)
+        unknown = [target for target in targets if target not in self.targets]
+        if unknown:
+            raise CommandError('Unknown benchmark(s): {}'.format(', '.join(unknown)))
+
+        baseline = {}
+        if options['baseline']:
+            if not os.path.exists(options['baseline']):
+                raise CommandError('Baseline {} not found'.format(options['baseline']))
+            with open(options['baseline']) as infile:
+                baseline = json.load(infile)
+
+            if baseline.get('league', self.league(options)) != self.league(options):
+                raise CommandError('The baseline was measured on a league of {}'.format(baseline['league']))
+
+        if any(getattr(self.targets[target], 'needs_database', False) for target in targets):
+            with benchmark.scratch_database():
+                results = self.run_targets(targets, options)
+        else:
+            results = self.run_targets(targets, options)
+
+        if options['save_baseline']:
+            saved = {target: {row['name']: row for row in rows} for target, rows in results.items()}
+            saved['league'] = self.league(options)
+            with open(options['save_baseline'], 'w') as outfile:
+                json.dump(saved, outfile, indent=2)
+
+        found = []
+        for target, rows in results.items():
+            found += benchmark.regressions(rows, baseline.get(target, {}), options['threshold'])
+
+        if found:
+            raise CommandError('Regressions against {}:\n{}'.format(options['baseline'], '\n'.join(found)))
+
+    @staticmethod
+    def league(options):
+        return {'drivers': options['drivers'], 'rounds': options['rounds'], 'laps': options['laps']}
+
+    def run_targets(self, targets, options):
+        results = {}
+        for target in targets:
+            kwargs = {'repeat': options['repeat']}
+            if getattr(self.targets[target], 'synthetic_league', False):
+                kwargs.update(self.league(options))
+
+            results[target] = self.targets[target](**kwargs)
+            for row in results[target]:
+                details = ', '.join(
+                    '{}={:.6f}'.format(key, value) if isinstance(value, float) else '{}={}'.format(key, value)
+                    for key, value in row.items() if key != 'name'
+                )
+                self.stdout.write('{}: {}'.format(row['name'], details))
+
+        return results
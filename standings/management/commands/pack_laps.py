@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from standings.models import LapPack, Race
+import logging
+
+
+class Command(BaseCommand):
+    help = 'Pack the laps of races into LapPack rows (see PACKED_LAPS)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('races', nargs='*', type=int, help='Race ids, every race with laps by default')
+
+    def handle(self, *args, **options):
+        logger = logging.getLogger(__name__)
+
+        races = Race.objects.filter(result__lap__isnull=False).distinct().order_by('id')
+        if options['races']:
+            races = races.filter(id__in=options['races'])
+
+        for race in races:
+            logger.info('Packing laps for {}'.format(race.name))
+            LapPack.refresh(race)
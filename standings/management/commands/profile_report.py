@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from standings import profiling
+
+
+class Command(BaseCommand):
+    help = 'Show the slowest pages and jobs, and the most duplicated queries, recorded while PROFILING was set'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sort', choices=['seconds', 'queries', 'duplicates'], default='seconds', help='Rank pages by this mean'
+        )
+        parser.add_argument('--limit', type=int, default=20, help='Number of pages and queries to show')
+        parser.add_argument('--clear', action='store_true', help='Delete the recorded profiles')
+
+    def handle(self, *args, **options):
+        if options['clear']:
+            profiling.clear()
+            self.stdout.write('Profiles deleted')
+            return
+
+        records = profiling.load()
+        result = profiling.report(records, options['sort'], options['limit'])
+        self.stdout.write('{} profiles in {}'.format(len(records), profiling.store_path()))
+
+        self.stdout.write('\nWorst pages by mean {}:'.format(options['sort']))
+        for page in result['pages']:
+            timers = ', '.join('{} {:.3f}s'.format(name, seconds) for name, seconds in page['timers'].items())
+            self.stdout.write((
+                '  {} {} ({}x, e.g. {}): {:.3f}s (max {:.3f}s), {:.1f} queries (max {}), {:.1f} duplicates{}'
+            ).format(
+                page['kind'], page['name'], page['count'], page['example'], page['seconds'], page['max_seconds'],
+                page['queries'], page['max_queries'], page['duplicates'], '; ' + timers if timers else ''
+            ))
+
+        self.stdout.write('\nMost duplicated queries:')
+        for duplicate in result['duplicates']:
+            self.stdout.write('  {} extra runs, {:.3f}s, on {}\n    {}'.format(
+                duplicate['count'], duplicate['seconds'], ', '.join(duplicate['pages']), duplicate['sql']
+            ))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from standings.models import Season
+from standings.stats import rebuild_seasons
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the stats of every season (or those given) over a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('seasons', nargs='*', type=int, help='Season ids, every season by default')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+        parser.add_argument('--batch-size', type=int, default=10, help='Number of seasons written per transaction')
+
+    def handle(self, *args, **options):
+        seasons = Season.objects.all()
+        if options['seasons']:
+            seasons = seasons.filter(id__in=options['seasons'])
+
+        # the largest seasons go first so no worker is left with a long one at the end
+        season_ids = list(
+            seasons.annotate(results=Count('race__result')).order_by('-results', 'id').values_list('id', flat=True)
+        )
+        self.stdout.write('Rebuilding {} seasons with {} workers'.format(len(season_ids), options['workers']))
+
+        start = time.perf_counter()
+        (season_count, result_count) = (0, 0)
+        for (batch_seasons, batch_results) in rebuild_seasons(season_ids, options['workers'], options['batch_size']):
+            season_count += batch_seasons
+            result_count += batch_results
+            self.stdout.write('  {}/{} seasons'.format(season_count, len(season_ids)))
+
+        seconds = max(time.perf_counter() - start, 1e-6)
+        self.stdout.write('Rebuilt {} seasons ({} results) in {:.2f}s: {:.2f} seasons/s, {:.0f} results/s'.format(
+            season_count, result_count, seconds, season_count / seconds, result_count / seconds
+        ))
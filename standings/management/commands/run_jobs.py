@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from standings import jobs
+import threading
+import time
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (log files, race results, stats and records)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=getattr(settings, 'JOB_WORKER_CONCURRENCY', 1),
+            help='Number of jobs to run at the same time'
+        )
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+
+    def work(self, options, stop):
+        try:
+            while not stop.is_set():
+                if jobs.run_pending() == 0:
+                    if options['once']:
+                        return
+                    stop.wait(options['interval'])
+        finally:
+            # every worker thread has its own connection
+            connection.close()
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        workers = [
+            threading.Thread(target=self.work, args=(options, stop), daemon=True)
+            for _ in range(max(options['concurrency'], 1))
+        ]
+
+        for worker in workers:
+            worker.start()
+
+        try:
+            while any(worker.is_alive() for worker in workers):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for worker in workers:
+                worker.join()
@@ -1,17 +1,32 @@
 from django.core.management.base import BaseCommand
-from standings.models import Season, Track
+from standings.models import Season, Track, TrackRecord
+from standings.stats import rebuild_seasons
 import logging
 
+
 class Command(BaseCommand):
-    help = 'Update season stats and track records'
+    help = 'Update the stats of seasons and the records of tracks that changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Update every season and track, changed or not')
+        parser.add_argument('--parallel', type=int, default=1, help='Number of processes to update seasons with')
 
     def handle(self, *args, **options):
         logger = logging.getLogger(__name__)
 
-        for season in Season.objects.all():
-            logger.info('Updating stats for {}'.format(season.name))
-            season.update_stats()
+        seasons = Season.objects.order_by('id')
+        tracks = Track.objects.order_by('id')
+        if not options['all']:
+            seasons = seasons.filter(stats_stale=True)
+            tracks = tracks.filter(records_stale=True)
+
+        season_ids = list(seasons.values_list('id', flat=True))
+        done = 0
+        for (batch_seasons, _) in rebuild_seasons(season_ids, options['parallel']):
+            done += batch_seasons
+            logger.info('Updated stats for {}/{} seasons'.format(done, len(season_ids)))
 
-        for track in Track.objects.all():
-            logger.info('Updating records for {}'.format(track.name))
-            track.update_records()
+        track_ids = list(tracks.values_list('id', flat=True))
+        if track_ids:
+            logger.info('Updating records for {} tracks'.format(len(track_ids)))
+            TrackRecord.refresh(track_ids)
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:29
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('standings', '0059_auto_20221119_2335'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StandingsSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('round_number', models.IntegerField()),
+                ('drivers', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('teams', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('season', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='standings.Season')),
+            ],
+            options={
+                'ordering': ['round_number'],
+                'unique_together': {('season', 'round_number')},
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:59
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('standings', '0061_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverCareer',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seasons', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('divisions', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('stale', models.BooleanField(default=False)),
+                ('driver', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='career', to='standings.Driver')),
+            ],
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:02
+
+from django.contrib.postgres.aggregates import ArrayAgg
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_team_history(apps, schema_editor):
+    Result = apps.get_model('standings', 'Result')
+    SeasonPenalty = apps.get_model('standings', 'SeasonPenalty')
+    TeamHistory = apps.get_model('standings', 'TeamHistory')
+
+    penalties = SeasonPenalty.objects.filter(team__isnull=False, driver__isnull=False).\
+        values('team_id', 'season_id', 'driver_id').order_by().annotate(total=models.Sum('points'))
+    penalties = {(row['team_id'], row['season_id'], row['driver_id']): row['total'] for row in penalties}
+
+    totals = Result.objects.filter(team__isnull=False, driver__isnull=False).\
+        values('team_id', 'race__season_id', 'driver_id').order_by().\
+        annotate(total=models.Sum('points'), ids=ArrayAgg('id', ordering=('position', 'id')))
+
+    TeamHistory.objects.bulk_create([
+        TeamHistory(
+            team_id=row['team_id'], season_id=row['race__season_id'], driver_id=row['driver_id'], points=row['total'],
+            penalty_points=penalties.get((row['team_id'], row['race__season_id'], row['driver_id']), 0),
+            result_ids=row['ids']
+        ) for row in totals
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('standings', '0062_drivercareer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamHistory',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.FloatField(default=0)),
+                ('penalty_points', models.IntegerField(default=0)),
+                ('result_ids', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='standings.Driver')),
+                ('season', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='standings.Season')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='standings.Team')),
+            ],
+            options={
+                'verbose_name_plural': 'Team history',
+                'unique_together': {('team', 'season', 'driver')},
+            },
+        ),
+        migrations.RunPython(fill_team_history, migrations.RunPython.noop),
+    ]
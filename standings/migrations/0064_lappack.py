@@ -0,0 +1,29 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:10
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('standings', '0063_teamhistory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LapPack',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session', models.CharField(max_length=10)),
+                ('count', models.IntegerField(default=0)),
+                ('compounds', django.contrib.postgres.fields.jsonb.JSONField(default=list)),
+                ('data', models.BinaryField()),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lap_packs', to='standings.Result')),
+            ],
+            options={
+                'unique_together': {('result', 'session')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('standings', '0064_lappack'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='season',
+            name='stats_stale',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AddField(
+            model_name='track',
+            name='records_stale',
+            field=models.BooleanField(default=True),
+        ),
+    ]
@@ -1,15 +1,21 @@
-from django.db import models
-from django.db.models import Count, Min
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Count, F, Min
 from django_countries.fields import CountryField
 from django.contrib.postgres.fields import JSONField
 from datetime import date
-from lxml import etree
+import array
 import os
+import standings.compounds
+import standings.points
 import standings.utils
-from .utils import apply_positions, despacify, unique_slug_generator, check_field_overwrite
+from .logparser import parse_log, read_ahead
+from .names import NameResolver
+from .profiling import profiled
+from .utils import despacify, unique_slug_generator, check_field_overwrite, grouper
 import json
 import random
-import re
+import sys
 
 
 class PointSystem(models.Model):
@@ -24,14 +30,20 @@ class PointSystem(models.Model):
     def __str__(self):
         return "{} ({})".format(self.name, self.race_points)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        standings.points.PointTable.invalidate(self.id)
+
+    def delete(self, *args, **kwargs):
+        standings.points.PointTable.invalidate(self.id)
+        return super().delete(*args, **kwargs)
+
+    def compiled(self):
+        return standings.points.PointTable.for_point_system(self)
+
     def to_dict(self, race=True):
-        try:
-            if race:
-                return {int(k) + 1: float(v) for k, v in enumerate(self.race_points.split(','))}
-            else:
-                return {int(k) + 1: float(v) for k, v in enumerate(self.qualifying_points.split(','))}
-        except ValueError:
-            return {0: 0}
+        table = self.compiled()
+        return dict(table.race if race else table.qualifying)
 
     def extras_present(self):
         return self.pole_position > 0 or self.fastest_lap > 0 or self.lead_lap > 0 or self.most_laps_lead > 0
@@ -79,65 +91,20 @@ class Track(models.Model):
     length = models.FloatField(default=0)
     version = models.CharField(max_length=25)
     country = CountryField(blank=True)
+    # set when a result at the track changes, manage.py stats_records rebuilds the records of marked tracks
+    records_stale = models.BooleanField(default=True)
 
     def __str__(self):
         return '{} ({}, {})'.format(self.name, self.country, self.version)
 
-    def collate_results(self, session_type):
-        best = {}
-
-        if session_type == 'race':
-            results = Result.objects.filter(race__track=self, race_fastest_lap__gt=0).\
-                values('race__season_id', 'driver_id', 'race_id').annotate(
-                Min('race_fastest_lap')).order_by('race_fastest_lap')
-            key = 'race_fastest_lap__min'
-        else:
-            results = Result.objects.filter(race__track=self, qualifying_fastest_lap__gt=0).\
-                values('race__season_id', 'driver_id', 'race_id').annotate(
-                Min('qualifying_fastest_lap')).order_by('qualifying_fastest_lap')
-            key = 'qualifying_fastest_lap__min'
-
-        for result in results:
-            if result['race__season_id'] not in best:
-                best[result['race__season_id']] = {
-                    'driver': result['driver_id'],
-                    'race': result['race_id'],
-                    'lap_time': result[key],
-                    'update': True
-                }
-            elif result[key] < best[result['race__season_id']]['lap_time']:
-                best[result['race__season_id']] = {
-                    'new_driver': result['driver_id'],
-                    'new_race': result['race_id'],
-                    'lap_time': result[key],
-                    'update': True
-                }
-
-        return best
+    @classmethod
+    def expire_records(cls, track_ids):
+        track_ids = [track_id for track_id in track_ids if track_id is not None]
+        if track_ids:
+            cls.objects.filter(id__in=track_ids, records_stale=False).update(records_stale=True)
 
     def update_records(self):
-        best = {
-            'race': self.collate_results('race'),
-            'qualifying': self.collate_results('qualifying')
-        }
-
-        for session_type, session_best in best.items():
-            for season, record in session_best.items():
-                if record['update']:
-                    (tr, created) = TrackRecord.objects.get_or_create(
-                        driver_id=record['driver'],
-                        race_id=record['race'],
-                        season_id=season,
-                        track=self
-                    )
-
-                    if 'new_driver' in record:
-                        tr.driver_id = record['new_driver'],
-                        tr.race_id = record['new_race']
-
-                    tr.lap_time = record['lap_time']
-                    tr.session_type = session_type
-                    tr.save()
+        TrackRecord.refresh([self.id])
 
 
 class Season(models.Model):
@@ -167,6 +134,8 @@ class Season(models.Model):
     team_points_allocated = True
     slug = models.CharField(max_length=150, blank=True)
     countback_range = models.IntegerField(default=10, help_text="How far into result positions to count back for tie breaker rules")
+    # set when a result, lap or penalty of the season changes, manage.py stats_records rebuilds marked seasons
+    stats_stale = models.BooleanField(default=True)
 
     def __str__(self):
         return "{} ({})".format(self.name, self.division.name)
@@ -197,146 +166,26 @@ class Season(models.Model):
     class Meta:
         ordering = ['start_date']
 
+    @profiled('get_standings')
     def get_standings(self, use_position=False, upto=None):
-        season_penalty = self.seasonpenalty_set
+        from .engine import StandingsEngine
 
-        drivers = {}
-        teams = {}
-        constructor_max = {}
+        return StandingsEngine(self, upto=upto).build(use_position=use_position)
 
-        results = Result.objects.filter(race__season=self).order_by("race_id", "position").\
-            prefetch_related('race').prefetch_related('driver').prefetch_related('team').prefetch_related('race__track')
+    def get_snapshot_standings(self, use_position=False, upto=None, with_results=True):
+        from .engine import StandingsEngine
 
-        if upto:
-            results = results.filter(race__round_number__lte=upto)
+        return StandingsEngine(self, upto=upto).read(use_position=use_position, with_results=with_results)
 
-        for result in results:
-            if result.driver_id not in drivers:
-                try:
-                    best_result = self.seasonstats_set.get(driver=result.driver).best_result
-                    best_finish = best_result.position
-                except (SeasonStats.DoesNotExist, AttributeError):
-                    best_result = None
-                    best_finish = 99
-
-                drivers[result.driver_id] = {
-                    'driver': result.driver,
-                    'teams': [result.team],
-                    'points': result.points,
-                    'results': [result],
-                    'positions': {x + 1: 0 for x in range(self.countback_range)},
-                    'position': 0,
-                    'best_finish': best_finish,
-                    'best_result': best_result,
-                    'season_penalty': None
-                }
+    def refresh_snapshots(self, from_round=None):
+        from .cache import snapshots_refreshed, touch
+        from .engine import StandingsEngine
 
-                if result.position <= self.countback_range and result.position in drivers[result.driver_id]['positions']:
-                    drivers[result.driver_id]['positions'][result.position] += 1
+        snapshots = StandingsEngine(self).refresh_snapshots(from_round=from_round)
+        snapshots_refreshed(self.id, from_round)
+        touch('season', self.id)
 
-                try:
-                    sp = season_penalty.get(driver=result.driver)
-                    drivers[result.driver_id]['season_penalty'] = sp
-                    drivers[result.driver_id]['points'] -= sp.points
-                except SeasonPenalty.DoesNotExist:
-                    pass
-
-            else:
-                drivers[result.driver_id]['results'].append(result)
-                drivers[result.driver_id]['points'] += result.points
-                if result.team not in drivers[result.driver_id]['teams']:
-                    drivers[result.driver_id]['teams'].append(result.team)
-
-                if result.position <= self.countback_range and result.position > 0:
-                    drivers[result.driver_id]['positions'][result.position] += 1
-
-            if not self.teams_disabled:
-                result.team_points_allocated = False
-                if result.race_id not in constructor_max:
-                    constructor_max[result.race_id] = {
-                        result.team_id: 0
-                    }
-
-                if result.team_id not in constructor_max[result.race_id]:
-                    constructor_max[result.race_id][result.team_id] = 0
-
-                if result.team_id not in teams:
-                    teams[result.team_id] = {
-                        'team': result.team,
-                        'points': result.points,
-                        'results': [result],
-                        'drivers': {result.driver_id: {'driver': result.driver, 'points': result.points}},
-                        'season_penalty': None
-                    }
-
-                    try:
-                        sp = season_penalty.get(team=result.team)
-                        teams[result.team_id]['season_penalty'] = sp
-                        teams[result.team_id]['points'] -= sp.points
-                    except SeasonPenalty.DoesNotExist:
-                        pass
-
-                    constructor_max[result.race_id][result.team_id] += 1
-                    result.team_points_allocated = True
-
-                else:
-                    if self.constructor_max == 0 or \
-                            constructor_max[result.race_id][result.team_id] < self.constructor_max:
-                        teams[result.team_id]['points'] += result.points
-                        constructor_max[result.race_id][result.team_id] += 1
-                        if self.constructor_max > 0 and result.classified:
-                            result.team_points_allocated = True
-
-                    teams[result.team_id]['results'].append(result)
-
-                    if result.driver_id not in teams[result.team_id]['drivers']:
-                        teams[result.team_id]['drivers'][result.driver_id] = {
-                            'driver': result.driver,
-                            'points': result.points
-                        }
-                    else:
-                        teams[result.team_id]['drivers'][result.driver_id]['points'] += result.points
-
-                teams[result.team_id]['driver_count'] = len(teams[result.team_id]['drivers'])
-
-        sorted_drivers = []
-
-        # sort on best finish
-        driver_sort = sorted(drivers, key=lambda item: drivers[item]['best_finish'])
-
-        # countback sort
-        for position in reversed(range(self.countback_range)):
-            driver_sort = sorted(driver_sort, key=lambda item: drivers[item]['positions'][position + 1], reverse=True)
-
-        # finally a basic points sort
-        driver_sort = sorted(driver_sort, key=lambda item: drivers[item]['points'], reverse=True)
-        for pos, driver in enumerate(driver_sort):
-            sorted_drivers.append(drivers[driver])
-
-        sorted_teams = []
-        team_sort = sorted(teams, key=lambda item: teams[item]['season_penalty'] is None, reverse=True)
-        team_sort = sorted(team_sort, key=lambda item: teams[item]['points'], reverse=True)
-        for _, team in enumerate(team_sort):
-            sorted_teams.append(teams[team])
-
-            teams[team]['sorted_drivers'] = []
-            driver_sort = sorted(
-                teams[team]['drivers'],
-                key=lambda item: teams[team]['drivers'][item]['points'],
-                reverse=True
-            )
-            for _, driver in enumerate(driver_sort):
-                teams[team]['sorted_drivers'].append(teams[team]['drivers'][driver])
-
-            teams[team]['drivers'] = teams[team]['sorted_drivers']
-            del teams[team]['sorted_drivers']
-
-        for idx, driver in enumerate(sorted_drivers):
-            driver["position"] = idx + 1
-
-        return sorted_drivers, apply_positions(sorted_teams, use_position=use_position)
-        return apply_positions(sorted_drivers, use_position=use_position), \
-            apply_positions(sorted_teams, use_position=use_position)
+        return snapshots
 
     def generate_image(self, mode, data):
         from PIL import Image, ImageDraw, ImageFont
@@ -393,10 +242,53 @@ class Season(models.Model):
         self.generate_image('driver', standings_driver)
         self.generate_image('team', standings_team)
 
+    @classmethod
+    def lock(cls, season_id, skip_locked=False):
+        """
+        Takes the season's row lock for the rest of the transaction, which
+        whatever rewrites its results or snapshots holds so that two of them
+        take turns. Returns False if `skip_locked` and someone else has it.
+        """
+        rows = cls.objects.select_for_update(skip_locked=skip_locked).filter(pk=season_id).order_by()
+        return bool(list(rows.values_list('id', flat=True)))
+
+    @classmethod
+    def expire_stats(cls, season_ids):
+        season_ids = [season_id for season_id in season_ids if season_id is not None]
+        if season_ids:
+            cls.objects.filter(id__in=season_ids, stats_stale=False).update(stats_stale=True)
+
     def update_stats(self):
-        for driver in Driver.objects.filter(result__race__season=self).distinct():
-            (stat, _) = SeasonStats.objects.get_or_create(season=self, driver=driver)
-            stat.update_stats()
+        from .stats import SeasonStatsBuilder
+
+        # cleared first, so a change made during the rebuild marks the season again
+        Season.objects.filter(pk=self.pk).update(stats_stale=False)
+        try:
+            SeasonStatsBuilder(self).update()
+            self.refresh_snapshots()
+        except Exception:
+            Season.expire_stats([self.pk])
+            raise
+
+
+class StandingsSnapshot(models.Model):
+    season = models.ForeignKey(Season, on_delete=models.CASCADE)
+    round_number = models.IntegerField()
+    drivers = JSONField(default=list)
+    teams = JSONField(default=list)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['round_number']
+        unique_together = ('season', 'round_number')
+
+    def __str__(self):
+        return "{} (round {})".format(self.season, self.round_number)
+
+    @classmethod
+    def expire(cls, season_id, from_round=0):
+        # deleted rather than rebuilt here, the next read of the standings rebuilds them (StandingsEngine.read)
+        cls.objects.filter(season_id=season_id, round_number__gte=from_round).delete()
 
 
 class Race(models.Model):
@@ -431,72 +323,27 @@ class Race(models.Model):
             {"url": "race", "object": self}
         ]
 
+    @profiled('fill_attributes')
     def fill_attributes(self):
-        total_race_time = 0
-        total_lap_count = 0
+        from .cache import touch_races
+        from .points import PointsCalculator
 
         ps = self.point_system if self.point_system else self.season.point_system
-        ll = self.laps_lead()
-        ml = ll.first()
-        season_penalty = SeasonPenalty.objects.filter(season=self.season)
 
         # make sure the fastest lap has been set
         self.find_fastest_lap()
 
-        for result in self.result_set.all():
-            if result.position == 1:
-                result.gap = '-'
-                total_lap_count = result.race_laps
-                total_race_time = result.race_time
-
-            if result.race_laps < total_lap_count:
-                result.gap = '{} laps down'.format(total_lap_count - result.race_laps)
-            else:
-                result.gap = standings.utils.format_time(result.race_time - total_race_time)
-
-            # make sure the fastest lap has been set
-            self.find_fastest_lap()
-
-            # check classification rules
-            if self.season.allocate_points(total_lap_count, result.race_laps):
-                result.points = ps.to_dict().get(result.position, 0)
-                result.points += ps.to_dict(False).get(result.qualifying, 0)
-                if result.fastest_lap:
-                    result.points += ps.fastest_lap
-                result.classified = True
-            else:
-                result.points = 0
-                result.classified = False
-
-            # pole position
-            if result.qualifying == 1:
-                result.points += ps.pole_position
-
-            # most laps lead
-            if ml is not None and ml['driver_id'] == result.driver_id:
-                result.points += ps.most_laps_lead
-
-            # points per lap lead
-            for driver in ll:
-                if driver['driver_id'] == result.driver_id:
-                    result.points += ps.lead_lap
+        results = list(self.result_set.all())
+        disqualified = set(SeasonPenalty.objects.filter(
+            season_id=self.season_id, disqualified=True, driver__isnull=False
+        ).values_list('driver_id', flat=True))
 
-            # point deduction
-            result.points -= result.point_deduction
+        PointsCalculator(ps).score(self.season, results, list(self.laps_lead()), disqualified)
+        Result.objects.bulk_update([r for r in results if not r.finalized], ['gap', 'points', 'classified'])
 
-            # multiplier
-            result.points *= result.points_multiplier
-
-            try:
-                sp = season_penalty.get(driver=result.driver)
-            except SeasonPenalty.DoesNotExist:
-                sp = None
-
-            if (sp and sp.disqualified) or result.race_penalty_dsq:
-                result.points = 0
-
-            if not result.finalized:
-                result.save()
+        # expires the snapshots from this round on, so it goes before they are rebuilt
+        touch_races([self])
+        self.season.refresh_snapshots(from_round=self.round_number)
 
     def tooltip(self):
         tooltip = "{name}<br/>{time}".format(
@@ -536,8 +383,12 @@ class Driver(models.Model):
         return "{} ({})".format(self.name, self.country)
 
     def collect_results(self, other_driver_ids):
+        from .cache import touch_races
+
+        races = list(Race.objects.filter(result__driver_id__in=other_driver_ids).distinct())
         for driver in Driver.objects.filter(id__in=other_driver_ids):
             driver.result_set.update(driver=self)
+        touch_races(races)
 
     def save(self, *args, **kwargs):
         self.slug = unique_slug_generator(self, self.name)
@@ -555,8 +406,14 @@ class Team(models.Model):
         return "{} ({})".format(self.name, self.id)
 
     def collect_results(self, other_team_ids):
+        from .cache import touch_races, touch_teams
+
+        races = list(Race.objects.filter(result__team_id__in=other_team_ids).distinct())
         for team in Team.objects.filter(id__in=other_team_ids):
             team.result_set.update(team=self)
+        touch_races(races)
+        for season_id in {race.season_id for race in races}:
+            touch_teams(season_id, other_team_ids)
 
     def save(self, *args, **kwargs):
         self.slug = unique_slug_generator(self, self.name)
@@ -571,6 +428,86 @@ class TrackRecord(models.Model):
     session_type = models.CharField(max_length=10)
     lap_time = models.FloatField(default=0)
 
+    # session type: the Result field holding its fastest lap
+    sessions = {
+        'race': 'race_fastest_lap',
+        'qualifying': 'qualifying_fastest_lap',
+    }
+
+    @classmethod
+    def best_laps(cls, session_type, track_ids=None):
+        """
+        The fastest lap of every season at every track (or those in
+        `track_ids`) as (track_id, season_id, driver_id, race_id, lap_time),
+        taking the first row of each (track, season) with DISTINCT ON so the
+        whole lot is one query. Ties go to whoever set the time first.
+        """
+        field = cls.sessions[session_type]
+        results = Result.objects.filter(**{'{}__gt'.format(field): 0}).\
+            filter(driver__isnull=False, race__track__isnull=False)
+        if track_ids is not None:
+            results = results.filter(race__track_id__in=track_ids)
+
+        # ordered by the columns themselves, ordering by a relation's _id would use Season's default ordering
+        return results.\
+            order_by(F('race__track_id').asc(), F('race__season_id').asc(), field, 'race__start_time', 'id').\
+            distinct('race__track_id', 'race__season_id').\
+            values_list('race__track_id', 'race__season_id', 'driver_id', 'race_id', field)
+
+    @classmethod
+    def refresh(cls, track_ids=None):
+        """
+        Rebuilds the records of every track (or those in `track_ids`) and
+        clears their records_stale mark.
+        """
+        tracks = Track.objects.all() if track_ids is None else Track.objects.filter(id__in=track_ids)
+        tracks.filter(records_stale=True).update(records_stale=False)
+        try:
+            cls.rebuild(track_ids)
+        except Exception:
+            Track.expire_records(tracks.values_list('id', flat=True))
+            raise
+
+    @classmethod
+    def rebuild(cls, track_ids=None):
+        # one record per track, season and session, created, updated and deleted in bulk
+        best = {}
+        for session_type in cls.sessions:
+            for (track_id, season_id, driver_id, race_id, lap_time) in cls.best_laps(session_type, track_ids):
+                best[(track_id, season_id, session_type)] = (driver_id, race_id, lap_time)
+
+        records = cls.objects.all() if track_ids is None else cls.objects.filter(track_id__in=track_ids)
+
+        existing = {}
+        stale = []
+        for record in records.order_by('id'):
+            key = (record.track_id, record.season_id, record.session_type)
+            if key in best and key not in existing:
+                existing[key] = record
+            else:
+                stale.append(record.id)
+
+        created = []
+        changed = []
+        for key, (driver_id, race_id, lap_time) in best.items():
+            record = existing.get(key)
+            if record is None:
+                created.append(cls(
+                    track_id=key[0], season_id=key[1], session_type=key[2],
+                    driver_id=driver_id, race_id=race_id, lap_time=lap_time
+                ))
+            elif (record.driver_id, record.race_id, record.lap_time) != (driver_id, race_id, lap_time):
+                (record.driver_id, record.race_id, record.lap_time) = (driver_id, race_id, lap_time)
+                changed.append(record)
+
+        if not (stale or created or changed):
+            return
+
+        with transaction.atomic():
+            cls.objects.filter(id__in=stale).delete()
+            cls.objects.bulk_create(created, batch_size=500)
+            cls.objects.bulk_update(changed, ['driver_id', 'race_id', 'lap_time'], batch_size=500)
+
 
 class Result(models.Model):
     race = models.ForeignKey(Race, on_delete=models.CASCADE)
@@ -660,7 +597,19 @@ class SeasonStats(models.Model):
     class Meta:
         verbose_name_plural = 'Season stats'
 
+    stat_fields = [
+        'best_result', 'attendance', 'wins', 'podiums', 'points_finishes', 'pole_positions', 'fastest_laps',
+        'laps_lead', 'laps_completed', 'winner', 'penalty_points', 'race_penalty_time', 'race_penalty_positions',
+        'qualifying_penalty_grid', 'qualifying_penalty_bog', 'qualifying_penalty_sfp', 'race_penalty_dsq',
+        'qualifying_penalty_dsq', 'positions', 'dnf_reasons', 'qualifying', 'season_position'
+    ]
+
     def update_stats(self):
+        from .stats import SeasonStatsBuilder
+
+        return SeasonStatsBuilder(self.season).update(stats=[self])
+
+    def reset(self):
         self.attendance = 0
         self.wins = 0
         self.podiums = 0
@@ -682,87 +631,70 @@ class SeasonStats(models.Model):
         self.positions = {}
         self.dnf_reasons = {}
         self.qualifying = {}
-        self.winner = False
+        self.season_position = 99
 
-        standings = self.season.get_standings(use_position=True)
-        try:
-            self.season_position = [r for r in standings[0] if r['driver'] == self.driver][0]['position']
-        except IndexError:
-            self.delete()
-            return False
+    def add_result(self, result, ps_season, laps_completed=0, laps_lead=0):
+        self.attendance += 1
+
+        if self.best_result is None or self.best_result.position > result.position:
+            self.best_result = result
 
         try:
-            ps_season = self.season.point_system.to_dict()
+            ps_race = result.race.point_system.compiled()
         except AttributeError:
-            ps_season = None
-
-        for result in Result.objects.filter(race__season=self.season, driver=self.driver):
-            self.attendance += 1
-
-            if self.best_result is None or self.best_result.position > result.position:
-                self.best_result = result
+            ps_race = None
 
-            try:
-                ps_race = result.race.point_system.to_dict()
-            except AttributeError:
-                ps_race = None
+        if (ps_race and result.position <= ps_race.depth) or \
+                (ps_season and result.position <= ps_season.depth):
+            self.points_finishes += 1
 
-            if (ps_race and result.position <= len(ps_race)) or \
-                    (ps_season and result.position <= len(ps_season)):
-                self.points_finishes += 1
+        if result.position == 1:
+            self.wins += 1
 
-            if result.position == 1:
-                self.wins += 1
+        if 1 <= result.position <= 3:
+            self.podiums += 1
 
-            if 1 <= result.position <= 3:
-                self.podiums += 1
+        if result.qualifying == 1:
+            self.pole_positions += 1
 
-            if result.qualifying == 1:
-                self.pole_positions += 1
+        if result.fastest_lap:
+            self.fastest_laps += 1
 
-            if result.fastest_lap:
-                self.fastest_laps += 1
+        self.laps_lead += laps_lead
+        self.laps_completed += laps_completed
 
-            self.laps_lead += result.lap_set.filter(position=1, session='race').aggregate(Count('id'))['id__count']
-            self.laps_completed += result.lap_set.filter(session='race').aggregate(Count('id'))['id__count']
+        self.penalty_points += result.penalty_points
+        self.race_penalty_time += result.race_penalty_time
+        self.race_penalty_positions += result.race_penalty_positions
+        self.qualifying_penalty_grid += result.qualifying_penalty_grid
 
-            self.penalty_points += result.penalty_points
-            self.race_penalty_time += result.race_penalty_time
-            self.race_penalty_positions += result.race_penalty_positions
-            self.qualifying_penalty_grid += result.qualifying_penalty_grid
+        if result.qualifying_penalty_bog:
+            self.qualifying_penalty_bog += 1
 
-            if result.qualifying_penalty_bog:
-                self.qualifying_penalty_bog += 1
+        if result.qualifying_penalty_sfp:
+            self.qualifying_penalty_sfp += 1
 
-            if result.qualifying_penalty_sfp:
-                self.qualifying_penalty_sfp += 1
+        if result.race_penalty_dsq:
+            self.race_penalty_dsq += 1
 
-            if result.race_penalty_dsq:
-                self.race_penalty_dsq += 1
+        if result.qualifying_penalty_dsq:
+            self.qualifying_penalty_dsq += 1
 
-            if result.qualifying_penalty_dsq:
-                self.qualifying_penalty_dsq += 1
-
-            if result.position not in self.positions:
-                self.positions[result.position] = 1
-            else:
-                self.positions[result.position] += 1
-
-            if result.dnf_reason != '':
-                if result.dnf_reason not in self.dnf_reasons:
-                    self.dnf_reasons[result.dnf_reason] = 1
-                else:
-                    self.dnf_reasons[result.dnf_reason] += 1
+        if result.position not in self.positions:
+            self.positions[result.position] = 1
+        else:
+            self.positions[result.position] += 1
 
-            if result.qualifying not in self.qualifying:
-                self.qualifying[result.qualifying] = 1
+        if result.dnf_reason != '':
+            if result.dnf_reason not in self.dnf_reasons:
+                self.dnf_reasons[result.dnf_reason] = 1
             else:
-                self.qualifying[result.qualifying] += 1
+                self.dnf_reasons[result.dnf_reason] += 1
 
-        if self.season.finalized and self.season_position == 1:
-            self.winner = True
-
-        self.save()
+        if result.qualifying not in self.qualifying:
+            self.qualifying[result.qualifying] = 1
+        else:
+            self.qualifying[result.qualifying] += 1
 
     @staticmethod
     def collate(stats, focus='driver'):
@@ -827,6 +759,136 @@ class SeasonStats(models.Model):
         return collated_stats
 
 
+class DriverCareer(models.Model):
+    """
+    A driver's profile page precomputed: the points scored for each team in
+    each season and the season stats collated per division. It is marked
+    stale whenever one of the driver's results, penalties or season stats
+    changes and rebuilt from grouped queries the next time it is read.
+    """
+    driver = models.OneToOneField(Driver, on_delete=models.CASCADE, related_name='career')
+    seasons = JSONField(default=list)
+    divisions = JSONField(default=list)
+    stale = models.BooleanField(default=False)
+
+    @classmethod
+    def for_driver(cls, driver):
+        career = cls.objects.filter(driver=driver).first()
+        if career is None:
+            career = cls(driver=driver)
+
+        if career.pk is None or career.stale:
+            career.refresh()
+
+        return career
+
+    @classmethod
+    def expire(cls, driver_ids):
+        driver_ids = [driver_id for driver_id in driver_ids if driver_id is not None]
+        if driver_ids:
+            cls.objects.filter(driver_id__in=driver_ids, stale=False).update(stale=True)
+
+    def refresh(self):
+        stats = list(
+            SeasonStats.objects.filter(driver_id=self.driver_id).select_related('driver', 'season', 'best_result')
+        )
+        positions = {stat.season_id: stat.season_position for stat in stats}
+
+        team_points = {}
+        for row in Result.objects.filter(driver_id=self.driver_id).values('race__season_id', 'team_id').\
+                annotate(points=models.Sum('points'), first=Min('position')).order_by('first', 'team_id'):
+            team_points.setdefault(row['race__season_id'], {})[row['team_id']] = row['points']
+
+        for penalty in SeasonPenalty.objects.filter(driver_id=self.driver_id, team__isnull=False):
+            if penalty.team_id in team_points.get(penalty.season_id, {}):
+                team_points[penalty.season_id][penalty.team_id] -= penalty.points
+
+        seasons = Season.objects.filter(id__in=team_points).select_related('division')
+        seasons = sorted(sorted(seasons, key=lambda item: item.start_date), key=lambda item: item.division.order)
+        self.seasons = [
+            {
+                'season_id': season.id,
+                'position': positions.get(season.id),
+                'teams': [{'team_id': team_id, 'points': points} for team_id, points in team_points[season.id].items()]
+            } for season in seasons
+        ]
+
+        divisions = {season.division_id: season.division for season in seasons}
+        self.divisions = [
+            {
+                'division_id': division.id,
+                'name': division.name,
+                'stats': SeasonStats.collate([stat for stat in stats if stat.season.division_id == division.id])
+            } for division in sorted(divisions.values(), key=lambda item: (item.order, item.id))
+        ]
+
+        # two first renders of a driver's page (by id and by slug) can both get here without a row
+        (career, _) = DriverCareer.objects.update_or_create(
+            driver_id=self.driver_id, defaults={'seasons': self.seasons, 'divisions': self.divisions, 'stale': False}
+        )
+        self.pk = career.pk
+        self.stale = False
+
+
+class TeamHistory(models.Model):
+    """
+    The points each driver scored for a team in a season, with the ids of
+    the results behind them. Rows are refreshed for just the seasons, teams
+    and drivers whose results or penalties change, so a team page never has
+    to go through the team's whole result history.
+    """
+    team = models.ForeignKey(Team, on_delete=models.CASCADE)
+    season = models.ForeignKey(Season, on_delete=models.CASCADE)
+    driver = models.ForeignKey(Driver, on_delete=models.CASCADE)
+    points = models.FloatField(default=0)
+    penalty_points = models.IntegerField(default=0)
+    result_ids = JSONField(default=list)
+
+    class Meta:
+        unique_together = ('team', 'season', 'driver')
+        verbose_name_plural = 'Team history'
+
+    @classmethod
+    def refresh(cls, season_id, team_ids=(), driver_ids=()):
+        from django.contrib.postgres.aggregates import ArrayAgg
+
+        team_ids = [team_id for team_id in team_ids if team_id is not None]
+        driver_ids = [driver_id for driver_id in driver_ids if driver_id is not None]
+        match = models.Q(team_id__in=team_ids) | models.Q(driver_id__in=driver_ids)
+
+        totals = Result.objects.filter(match, race__season_id=season_id, team__isnull=False, driver__isnull=False).\
+            values('team_id', 'driver_id').order_by().\
+            annotate(total=models.Sum('points'), ids=ArrayAgg('id', ordering=('position', 'id')))
+        penalties = SeasonPenalty.objects.filter(match, season_id=season_id, team__isnull=False, driver__isnull=False).\
+            values('team_id', 'driver_id').order_by().annotate(total=models.Sum('points'))
+        penalties = {(row['team_id'], row['driver_id']): row['total'] for row in penalties}
+        rows = {(row.team_id, row.driver_id): row for row in cls.objects.filter(match, season_id=season_id)}
+
+        created = []
+        changed = []
+        for total in totals:
+            key = (total['team_id'], total['driver_id'])
+            values = (total['total'], penalties.get(key, 0), total['ids'])
+
+            row = rows.pop(key, None)
+            if row is None:
+                created.append(cls(
+                    team_id=key[0], season_id=season_id, driver_id=key[1],
+                    points=values[0], penalty_points=values[1], result_ids=values[2]
+                ))
+            elif (row.points, row.penalty_points, row.result_ids) != values:
+                (row.points, row.penalty_points, row.result_ids) = values
+                changed.append(row)
+
+        cls.objects.bulk_create(created)
+        cls.objects.bulk_update(changed, ['points', 'penalty_points', 'result_ids'])
+        if rows:
+            cls.objects.filter(id__in=[row.id for row in rows.values()]).delete()
+
+        # the teams whose rows changed, which can include teams the drivers have left
+        return {row.team_id for row in created + changed + list(rows.values())}
+
+
 class Lap(models.Model):
     result = models.ForeignKey(Result, on_delete=models.CASCADE)
     session = models.CharField(max_length=10)
@@ -847,6 +909,128 @@ class Lap(models.Model):
     class Meta:
         ordering = ['lap_number']
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        Lap.changed([self.result_id], [(self.result_id, self.session)])
+
+    def delete(self, *args, **kwargs):
+        deleted = super().delete(*args, **kwargs)
+        Lap.changed([self.result_id], [(self.result_id, self.session)])
+        return deleted
+
+    @staticmethod
+    def changed(result_ids, packs):
+        # Lap has no signals (they would stop laps being fast deleted with their results), so this does their work
+        from .cache import expire_stats, touch
+
+        for (result_id, session) in packs:
+            LapPack.repack(result_id, session)
+
+        races = Race.objects.filter(result__id__in=result_ids).values_list('id', 'season_id').distinct()
+        touch('race', *[race_id for race_id, _ in races])
+        expire_stats([season_id for _, season_id in races])
+
+
+class LapPack(models.Model):
+    """
+    Every lap of a result in one session, packed column by column into typed
+    binary arrays so a whole race or stint is read as a single row.
+
+    Packs are optional and kept alongside the Lap rows: a race is packed as a
+    whole after a log file import when PACKED_LAPS is set (or by manage.py
+    pack_laps), saving or deleting a lap repacks its result, and readers fall
+    back to the Lap rows for races without packs.
+    """
+    result = models.ForeignKey(Result, on_delete=models.CASCADE, related_name='lap_packs')
+    session = models.CharField(max_length=10)
+    count = models.IntegerField(default=0)
+    compounds = JSONField(default=list)
+    data = models.BinaryField()
+
+    # (field, array typecode) in the order the columns are stored, compounds are stored as indexes into `compounds`
+    columns = [
+        ('lap_number', 'i'), ('position', 'i'), ('pitstop', 'B'), ('compound', 'H'),
+        ('sector_1', 'd'), ('sector_2', 'd'), ('sector_3', 'd'), ('lap_time', 'd'), ('race_time', 'd'),
+        ('wear_fl', 'd'), ('wear_fr', 'd'), ('wear_rl', 'd'), ('wear_rr', 'd'),
+    ]
+
+    class Meta:
+        unique_together = ('result', 'session')
+
+    @classmethod
+    def pack(cls, result_id, session, laps):
+        laps = sorted(laps, key=lambda x: x.lap_number)
+        compounds = list(dict.fromkeys(lap.compound for lap in laps))
+        codes = {compound: index for index, compound in enumerate(compounds)}
+
+        data = bytearray()
+        for field, typecode in cls.columns:
+            if field == 'compound':
+                values = array.array(typecode, [codes[lap.compound] for lap in laps])
+            else:
+                values = array.array(typecode, [getattr(lap, field) for lap in laps])
+
+            # stored little endian whatever machine wrote them
+            if sys.byteorder == 'big':
+                values.byteswap()
+            data += values.tobytes()
+
+        return cls(result_id=result_id, session=session, count=len(laps), compounds=compounds, data=bytes(data))
+
+    def unpack(self):
+        """
+        Returns the packed laps as a dict of field: list of values, in lap
+        number order.
+        """
+        data = bytes(self.data)
+        offset = 0
+        columns = {}
+        for field, typecode in self.columns:
+            values = array.array(typecode)
+            size = values.itemsize * self.count
+            values.frombytes(data[offset:offset + size])
+            if sys.byteorder == 'big':
+                values.byteswap()
+            offset += size
+
+            if field == 'compound':
+                columns[field] = [self.compounds[code] for code in values]
+            elif field == 'pitstop':
+                columns[field] = [bool(value) for value in values]
+            else:
+                columns[field] = values.tolist()
+
+        return columns
+
+    def laps(self):
+        columns = self.unpack()
+        return [
+            Lap(result_id=self.result_id, session=self.session, **dict(zip(columns, values)))
+            for values in zip(*columns.values())
+        ]
+
+    @classmethod
+    def repack(cls, result_id, session):
+        # only races that were packed as a whole keep packs, so one is never created here
+        pack = cls.objects.filter(result_id=result_id, session=session).first()
+        if pack is not None:
+            packed = cls.pack(result_id, session, Lap.objects.filter(result_id=result_id, session=session))
+            (pack.count, pack.compounds, pack.data) = (packed.count, packed.compounds, packed.data)
+            pack.save()
+
+    @classmethod
+    def refresh(cls, race):
+        """
+        Rebuilds the packs of every result in `race` from its Lap rows.
+        """
+        laps = {}
+        for lap in Lap.objects.filter(result__race=race).order_by():
+            laps.setdefault((lap.result_id, lap.session), []).append(lap)
+
+        with transaction.atomic():
+            cls.objects.filter(result__race=race).delete()
+            cls.objects.bulk_create([cls.pack(result_id, session, rows) for (result_id, session), rows in laps.items()])
+
 
 class LogFile(models.Model):
     file = models.FileField(upload_to='log_files/%Y/%m/%d')
@@ -854,12 +1038,12 @@ class LogFile(models.Model):
     summary = models.TextField(default='', blank=True)
     session = models.CharField(max_length=10, default='', blank=True)
 
-    @staticmethod
-    def get_float(value):
-        try:
-            return float(value)
-        except (TypeError, ValueError):
-            return 0.0
+    grid_size = 100
+
+    lap_fields = [
+        'position', 'sector_1', 'sector_2', 'sector_3', 'pitstop', 'lap_time', 'compound',
+        'wear_fl', 'wear_fr', 'wear_rl', 'wear_rr'
+    ]
 
     def __str__(self):
         return '{} ({})'.format(os.path.basename(self.file.path), self.race)
@@ -876,128 +1060,138 @@ class LogFile(models.Model):
             {"url": "logfile", "object": self},
         ]
 
-    def process(self, request=None):
-        with open(self.file.name) as infile:
-            tree = etree.XML(infile.read().encode('utf-8'))
+    @profiled('LogFile.process')
+    def process(self, post_fields=None):
+        from .cache import batched
 
-        qualify = len(tree.xpath('//Qualify'))
-        if qualify > 0:
-            self.session = 'qualify'
-        else:
-            self.session = 'race'
+        # results are saved one driver at a time, the aggregates and pages they feed are refreshed once at the end
+        with batched():
+            self.import_results(post_fields)
 
-        compound_re = r'\d,([^\(]+)\([^\)]+\)'
+    def import_results(self, post_fields=None):
+        self.session = 'race'
         duplicates = []
         lap_errors = {}
         lap_ets = {}
-        drivers = tree.xpath('//Driver')
-        for driver in drivers:
-            driver_name = despacify(driver.xpath('./Name')[0].text)
-            try:
-                driver_obj = Driver.objects.get(name__unaccent=driver_name)
-            except Driver.DoesNotExist:
-                driver_obj = Driver.objects.create(name=driver_name)
-            except Driver.MultipleObjectsReturned:
-                driver_obj = Driver.objects.filter(name__unaccent=driver_name).annotate(
-                    result_count=Count('result')).order_by('-result_count').first()
-                if driver_name not in duplicates:
+        error_laps = []
+        new_laps = {}
+        changed_laps = {}
+        existing_laps = None
+
+        driver_names = NameResolver(Driver)
+        team_names = NameResolver(Team, match_accents=False)
+
+        # parsing runs ahead on its own thread while the previous drivers are written,
+        # names are resolved for a whole grid of drivers at a time
+        for grid in grouper(read_ahead(parse_log(self.file.name)), self.grid_size):
+            grid = [driver for driver in grid if driver is not None]
+            if existing_laps is None:
+                self.session = grid[0].session
+                existing_laps = {
+                    (lap.result_id, lap.lap_number): lap
+                    for lap in Lap.objects.filter(result__race=self.race, session=self.session)
+                }
+
+            driver_objs = driver_names.resolve([driver.name for driver in grid])
+            team_objs = team_names.resolve([driver.team for driver in grid])
+
+            for driver in grid:
+                driver_obj = driver_objs[despacify(driver.name)]
+                if driver_obj.id in driver_names.duplicates and driver_obj.id not in duplicates:
                     duplicates.append(driver_obj.id)
 
-            team_name = despacify(driver.xpath('./CarType')[0].text)
-            try:
-                (team_obj, created) = Team.objects.get_or_create(name=team_name)
-            except Team.MultipleObjectsReturned:
-                team_obj = Team.objects.filter(name__unaccent=team_name).annotate(
-                    result_count=Count('result')).order_by('-result_count').first()
-
-            (result, created) = Result.objects.get_or_create(
-                race=self.race, driver=driver_obj, team=team_obj
-            )
-
-            result.fastest_lap = driver.xpath('./LapRankIncludingDiscos')[0].text == '1'
-            result.car_class = driver.xpath('./CarClass')[0].text
-            result.car = driver.xpath('./VehFile')[0].text
-            if self.session == 'race':
-                result.qualifying = driver.xpath('./GridPos')[0].text
-                result.position = driver.xpath('./Position')[0].text
-                result.race_laps = driver.xpath('./Laps')[0].text
-            else:
-                result.qualifying_laps = driver.xpath('./Laps')[0].text
-                result.qualifying = driver.xpath('./Position')[0].text
+                team_obj = team_objs[despacify(driver.team)]
 
-            if driver.xpath('./FinishStatus')[0].text == 'Finished Normally':
-                try:
-                    result.race_time = driver.xpath('./FinishTime')[0].text
-                except IndexError:
+                (result, created) = Result.objects.get_or_create(
+                    race=self.race, driver=driver_obj, team=team_obj
+                )
+
+                result.fastest_lap = driver.fastest_lap
+                result.car_class = driver.car_class
+                result.car = driver.car
+                if self.session == 'race':
+                    result.qualifying = driver.grid
+                    result.position = driver.position
+                    result.race_laps = driver.laps
+                else:
+                    result.qualifying_laps = driver.laps
+                    result.qualifying = driver.position
+
+                if driver.finished:
+                    result.race_time = driver.finish_time or 0
+                else:
                     result.race_time = 0
-            else:
-                result.race_time = 0
-                try:
-                    result.dnf_reason = driver.xpath('./DNFReason')[0].text
-                except IndexError:
-                    result.dnf_reason = ''
+                    result.dnf_reason = driver.dnf_reason or ''
 
-            if request is not None:
-                check_field_overwrite(result, request.POST, created)
+                if post_fields is not None:
+                    check_field_overwrite(result, post_fields, created)
 
-            result.save()
+                result.save()
 
-            race_time = 0
-            fastest_lap = 0
+                race_time = 0
+                fastest_lap = 0
+
+                for lap in driver.lap_records:
+                    lap_key = (result.id, lap.number)
+                    lap_obj = existing_laps.get(lap_key)
+                    if lap_obj is None:
+                        lap_obj = new_laps.setdefault(
+                            lap_key, Lap(result=result, lap_number=lap.number, session=self.session)
+                        )
+                        previous = None
+                    else:
+                        previous = [getattr(lap_obj, field) for field in self.lap_fields]
+
+                    for field in self.lap_fields:
+                        setattr(lap_obj, field, getattr(lap, field))
+
+                    if previous is not None and previous != [getattr(lap_obj, field) for field in self.lap_fields]:
+                        changed_laps[lap_key] = lap_obj
 
-            laps = driver.xpath('.//Lap')
-            for lap in laps:
-                try:
-                    lap_number = int(lap.get('num'))
-                    (lap_obj, _) = Lap.objects.get_or_create(result=result, lap_number=lap_number, session=self.session)
-
-                    lap_obj.position = int(lap.get('p'))
-                    lap_obj.sector_1 = self.get_float(lap.get('s1'))
-                    lap_obj.sector_2 = self.get_float(lap.get('s2'))
-                    lap_obj.sector_3 = self.get_float(lap.get('s3'))
-                    lap_obj.pitstop = lap.get('pit') == '1'
-                    lap_obj.lap_time = self.get_float(lap.text)
-                    lap_obj.compound = re.sub(compound_re, r'\g<1>', lap.get('fcompound')).\
-                        strip().replace(' ', '_').lower()
-                    lap_obj.wear_fl = self.get_float(lap.get('twfl'))
-                    lap_obj.wear_fr = self.get_float(lap.get('twfr'))
-                    lap_obj.wear_rl = self.get_float(lap.get('twrl'))
-                    lap_obj.wear_rr = self.get_float(lap.get('twrr'))
-
-                    lap_obj.save()
                     if self.session == 'race':
                         if driver_obj.id not in lap_ets:
                             lap_ets[driver_obj.id] = []
-                        lap_ets[driver_obj.id].append(self.get_float(lap.get('et')))
+                        lap_ets[driver_obj.id].append(lap.elapsed)
 
-                    if lap.text.strip() == '--.----':
-                        if driver_obj.id not in lap_errors:
-                            lap_errors[driver_obj.id] = []
-                        lap_errors[driver_obj.id].append({"number": lap_obj.lap_number, "id": lap_obj.id})
+                    if lap.missing_time:
+                        error_laps.append((driver_obj.id, lap_obj))
 
-                    race_time += lap_obj.lap_time
-                    if lap_obj.lap_time > 0 and (lap_obj.lap_time < fastest_lap or fastest_lap == 0):
-                        fastest_lap = lap_obj.lap_time
-                except TypeError:
-                    pass
+                    race_time += lap.lap_time
+                    if lap.lap_time > 0 and (lap.lap_time < fastest_lap or fastest_lap == 0):
+                        fastest_lap = lap.lap_time
 
-            if self.session == 'race':
-                result.race_fastest_lap = fastest_lap
-                if result.race_time == 0:
-                    result.race_time = race_time
-            else:
-                result.qualifying_fastest_lap = fastest_lap
-                if result.qualifying_time == 0:
-                    result.qualifying_time = race_time
+                if self.session == 'race':
+                    result.race_fastest_lap = fastest_lap
+                    if result.race_time == 0:
+                        result.race_time = race_time
+                else:
+                    result.qualifying_fastest_lap = fastest_lap
+                    if result.qualifying_time == 0:
+                        result.qualifying_time = race_time
 
-            if request is not None:
-                check_field_overwrite(result, request.POST, created)
+                if post_fields is not None:
+                    check_field_overwrite(result, post_fields, created)
 
-            result.save()
+                result.save()
+
+        # laps are written in bulk once every driver has been read, re-imports only touch laps that changed
+        Lap.objects.bulk_create(new_laps.values(), batch_size=1000)
+        Lap.objects.bulk_update(changed_laps.values(), self.lap_fields, batch_size=1000)
+
+        for driver_id, lap_obj in error_laps:
+            if driver_id not in lap_errors:
+                lap_errors[driver_id] = []
+            lap_errors[driver_id].append({"number": lap_obj.lap_number, "id": lap_obj.id})
 
         if len(lap_errors) > 0 and self.session == 'race':
             self.fix_laps(lap_errors, lap_ets)
 
+        # bulk writes send no signals, so packs are rebuilt here or dropped rather than left stale
+        if getattr(settings, 'PACKED_LAPS', False):
+            LapPack.refresh(self.race)
+        else:
+            LapPack.objects.filter(result__race=self.race).delete()
+
         self.summary = json.dumps({'duplicates': duplicates, 'lap_errors': lap_errors})
         self.save()
 
@@ -1005,15 +1199,20 @@ class LogFile(models.Model):
 
     @staticmethod
     def fix_laps(errors, ets):
+        lap_objs = Lap.objects.in_bulk([lap['id'] for laps in errors.values() for lap in laps])
+
+        fixed = []
         for driver_id, laps in errors.items():
             for lap in laps:
                 try:
-                    lap_obj = Lap.objects.get(pk=lap['id'])
+                    lap_obj = lap_objs[lap['id']]
                     lap_obj.lap_time = ets[driver_id][lap['number']] - ets[driver_id][lap['number'] - 1]
-                    lap_obj.save()
-                except IndexError:
+                    fixed.append(lap_obj)
+                except (IndexError, KeyError):
                     pass
 
+        Lap.objects.bulk_update(fixed, ['lap_time'])
+
 
 class SeasonPenalty(models.Model):
     season = models.ForeignKey(Season, on_delete=models.CASCADE)
@@ -1026,6 +1225,8 @@ class SeasonPenalty(models.Model):
         verbose_name_plural = 'Season Penalties'
 
     def process(self):
+        from .cache import touch_races
+
         qs = None
         if self.disqualified:
             if self.driver:
@@ -1034,7 +1235,10 @@ class SeasonPenalty(models.Model):
                 qs = Result.objects.filter(team=self.team)
 
             if qs:
+                races = list(Race.objects.filter(id__in=qs.values('race_id')))
                 qs.update(points=0)
+                # the update sends no signals, the team history and pages are refreshed from the zeroed results here
+                touch_races(races)
 
     def __str__(self):
         string = '{}'.format(self.season)
@@ -1077,4 +1281,42 @@ class SeasonTyreMap(models.Model):
 
     def __str__(self):
         tyre_map = ["c{} = {}".format(x + 1, getattr(self, f"c{x + 1}")) for x in range(0,7) if getattr(self, f"c{x + 1}")]
-        return ", ".join(tyre_map)
\ No newline at end of file
+        return ", ".join(tyre_map)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        standings.compounds.CompoundMap.invalidate(self.id)
+
+    def delete(self, *args, **kwargs):
+        standings.compounds.CompoundMap.invalidate(self.id)
+        return super().delete(*args, **kwargs)
+
+    def compiled(self):
+        return standings.compounds.CompoundMap.for_tyre_map(self)
+
+
+class Job(models.Model):
+    status_choice = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    task = models.CharField(max_length=50)
+    payload = JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, default='queued', choices=status_choice)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        index_together = ('status', 'id')
+
+    def __str__(self):
+        return '{} ({})'.format(self.task, self.status)
+
+    def pending(self):
+        return self.status in ['queued', 'running']
@@ -0,0 +1,69 @@
+from django.contrib.postgres.lookups import Unaccent
+from django.db import connection
+from django.db.models import Count, F
+from .utils import despacify, unique_slugs
+
+
+class NameResolver:
+    """
+    Resolves the names read from a log file to drivers or teams in bulk.
+
+    Every candidate for a batch of names comes back from one query, ties
+    between duplicates go to the entry with the most results and anything
+    unknown is created with a single insert.
+    """
+
+    def __init__(self, model, match_accents=True):
+        self.model = model
+        self.match_accents = match_accents
+        self.duplicates = set()
+
+    def keys(self, names):
+        # folded by the database's unaccent, the same as the lookup that finds the candidates
+        if not self.match_accents:
+            return {name: name for name in names}
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT name, unaccent(name) FROM unnest(%s) AS name', [names])
+            return dict(cursor.fetchall())
+
+    def candidates(self, names):
+        if self.match_accents:
+            queryset = self.model.objects.filter(name__unaccent__in=names).annotate(key=Unaccent('name'))
+        else:
+            queryset = self.model.objects.filter(name__in=names).annotate(key=F('name'))
+
+        return queryset.annotate(result_count=Count('result')).order_by('id')
+
+    def resolve(self, names):
+        names = list(dict.fromkeys(despacify(name) for name in names))
+        keys = self.keys(names)
+
+        matches = {}
+        for candidate in self.candidates(names):
+            matches.setdefault(candidate.key, []).append(candidate)
+
+        resolved = {}
+        missing = {}
+        for name in names:
+            found = matches.get(keys[name])
+            if not found:
+                missing.setdefault(keys[name], name)
+                continue
+
+            best = max(found, key=lambda item: item.result_count)
+            if len(found) > 1:
+                self.duplicates.add(best.id)
+            resolved[name] = best
+
+        if missing:
+            titles = list(missing.values())
+            created = self.model.objects.bulk_create([
+                self.model(name=title, slug=slug) for title, slug in zip(titles, unique_slugs(self.model, titles))
+            ])
+            created = dict(zip(missing, created))
+            for name in names:
+                if name not in resolved:
+                    resolved[name] = created[keys[name]]
+
+        return resolved
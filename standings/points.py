@@ -0,0 +1,148 @@
+from .utils import format_time
+
+
+def position_colours(place_count):
+    colours = {
+        '-': 'default',
+        0: 'default',
+        1: 'yellow',
+        2: 'gray',
+        3: 'orange',
+        'Ret': 'retired',
+        'DSQ': 'black',
+        'DNS': 'default'
+    }
+
+    colours.update({x: 'green' for x in range(4, place_count)})
+
+    return colours
+
+
+class PointTable:
+    """
+    A point system's points strings parsed into lookup tables.
+
+    Tables are compiled once per point system and cached by id, the cached
+    copy is dropped when the point system is saved and recompiled if the
+    points strings it was built from no longer match.
+    """
+
+    _cache = {}
+
+    def __init__(self, point_system):
+        self.source = (point_system.race_points, point_system.qualifying_points)
+        self.race = self.parse(point_system.race_points)
+        self.qualifying = self.parse(point_system.qualifying_points)
+        self.depth = len(self.race)
+        self.colours = {key: 'pos-{}'.format(colour) for key, colour in position_colours(self.depth + 1).items()}
+
+    @staticmethod
+    def parse(points):
+        try:
+            return {int(k) + 1: float(v) for k, v in enumerate(points.split(','))}
+        except ValueError:
+            return {0: 0}
+
+    @classmethod
+    def for_point_system(cls, point_system):
+        table = cls._cache.get(point_system.id)
+        if table is None or table.source != (point_system.race_points, point_system.qualifying_points):
+            table = cls(point_system)
+            if point_system.id is not None:
+                cls._cache[point_system.id] = table
+
+        return table
+
+    @classmethod
+    def invalidate(cls, point_system_id):
+        cls._cache.pop(point_system_id, None)
+
+    def points(self, position):
+        return self.race.get(position, 0)
+
+    def qualifying_points(self, position):
+        return self.qualifying.get(position, 0)
+
+    def pays(self, position):
+        return position in self.race
+
+    def colour(self, position):
+        return self.colours.get(position, 'pos-blue')
+
+
+class PointsCalculator:
+    """
+    Scores all of a race's results in one go.
+
+    The point system's compiled table is used and laps led come in as a single
+    aggregate, so scoring a race costs the same number of queries however
+    many cars took part.
+    """
+
+    def __init__(self, point_system):
+        self.point_system = point_system
+        self.table = point_system.compiled()
+
+    @staticmethod
+    def gaps(results):
+        # results are in finishing order, gaps are relative to the winner seen so far
+        gaps = []
+        lap_totals = []
+        total_lap_count = 0
+        total_race_time = 0
+
+        for result in results:
+            if result.position == 1:
+                total_lap_count = result.race_laps
+                total_race_time = result.race_time
+
+            if result.race_laps < total_lap_count:
+                gaps.append('{} laps down'.format(total_lap_count - result.race_laps))
+            else:
+                gaps.append(format_time(result.race_time - total_race_time))
+
+            lap_totals.append(total_lap_count)
+
+        return gaps, lap_totals
+
+    def score(self, season, results, laps_lead, disqualified):
+        """
+        Sets gap, classified and points on each result (in finishing order).
+
+        `laps_lead` is the Race.laps_lead() aggregate, most laps first, and
+        `disqualified` the ids of drivers disqualified for the season.
+        """
+        ps = self.point_system
+        gaps, lap_totals = self.gaps(results)
+
+        most_laps_lead = laps_lead[0]['driver_id'] if laps_lead else None
+        lap_leaders = {row['driver_id'] for row in laps_lead}
+
+        classified = [season.allocate_points(total, result.race_laps) for total, result in zip(lap_totals, results)]
+        race_points = [self.table.points(result.position) for result in results]
+        qualifying_points = [self.table.qualifying_points(result.qualifying) for result in results]
+        fastest_lap = [ps.fastest_lap if result.fastest_lap else 0 for result in results]
+        pole_position = [ps.pole_position if result.qualifying == 1 else 0 for result in results]
+        most_laps = [ps.most_laps_lead if result.driver_id == most_laps_lead else 0 for result in results]
+        lead_lap = [ps.lead_lap if result.driver_id in lap_leaders else 0 for result in results]
+
+        for idx, result in enumerate(results):
+            if classified[idx]:
+                points = race_points[idx] + qualifying_points[idx] + fastest_lap[idx]
+            else:
+                points = 0
+
+            points += pole_position[idx]
+            points += most_laps[idx]
+            points += lead_lap[idx]
+            points -= result.point_deduction
+            points *= result.points_multiplier
+
+            if result.driver_id in disqualified or result.race_penalty_dsq:
+                points = 0
+
+            result.gap = gaps[idx]
+            result.classified = classified[idx]
+            result.points = points
+
+        return results
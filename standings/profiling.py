@@ -0,0 +1,299 @@
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from contextlib import contextmanager
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+
+# the profile being recorded on this thread, if any
+_local = threading.local()
+_write_lock = threading.Lock()
+logger = logging.getLogger(__name__)
+
+
+def enabled():
+    return getattr(settings, 'PROFILING', False)
+
+
+def store_path():
+    default = os.path.join(getattr(settings, 'BASE_DIR', ''), '.profiles', 'profiles.jsonl')
+    return getattr(settings, 'PROFILING_PATH', default)
+
+
+def fingerprint(sql):
+    """
+    Reduces a query to its shape, so the same query run with different
+    values (a lookup inside a loop) is counted as a duplicate.
+    """
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    sql = re.sub(r'%s', '?', sql)
+    return re.sub(r'\((?:\?, )+\?\)', '(...)', sql)
+
+
+class Profile:
+    def __init__(self, kind, name):
+        self.kind = kind
+        self.name = name
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.queries = {}
+        self.query_count = 0
+        self.query_seconds = 0
+        self.timers = {}
+        self.rendering = False
+        self.extra = {}
+        self.streaming = False
+
+    def execute(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query(sql, time.perf_counter() - start)
+
+    def query(self, sql, seconds):
+        entry = self.queries.setdefault(fingerprint(sql), [0, 0])
+        entry[0] += 1
+        entry[1] += seconds
+        self.query_count += 1
+        self.query_seconds += seconds
+
+    def timer(self, name, seconds):
+        self.timers[name] = self.timers.get(name, 0) + seconds
+
+    def record(self, seconds):
+        duplicates = sorted(
+            [
+                {'sql': sql, 'count': count, 'seconds': total}
+                for sql, (count, total) in self.queries.items() if count > 1
+            ],
+            key=lambda x: x['count'], reverse=True
+        )
+
+        return dict({
+            'kind': self.kind,
+            'name': self.name,
+            'time': self.started,
+            'seconds': seconds,
+            'queries': self.query_count,
+            'query_seconds': self.query_seconds,
+            'duplicates': duplicates[:10],
+            'timers': self.timers,
+        }, **self.extra)
+
+
+def write(record):
+    """
+    Appends a record to the store, the store is moved aside to .1 (replacing
+    the previous one) once it grows past PROFILING_MAX_BYTES.
+    """
+    path = store_path()
+    line = json.dumps(record) + '\n'
+
+    with _write_lock:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(path) and os.path.getsize(path) > getattr(settings, 'PROFILING_MAX_BYTES', 5 * 1024 * 1024):
+            os.replace(path, path + '.1')
+
+        with open(path, 'a') as outfile:
+            outfile.write(line)
+
+
+def save(current):
+    # a store that can't be written to shouldn't take the page down with it
+    try:
+        write(current.record(time.perf_counter() - current.start))
+    except OSError:
+        logger.exception('Could not write a profile to {}'.format(store_path()))
+
+
+def load():
+    records = []
+    for path in [store_path() + '.1', store_path()]:
+        if os.path.exists(path):
+            with open(path) as infile:
+                records += [json.loads(line) for line in infile if line.strip()]
+
+    return records
+
+
+def clear():
+    for path in [store_path() + '.1', store_path()]:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@contextmanager
+def profile(kind, name):
+    """
+    Records the queries and hot path timers of the enclosed block to the
+    store, when PROFILING is set. Yields the Profile, or None when nothing is
+    being recorded.
+    """
+    if not enabled() or getattr(_local, 'profile', None) is not None:
+        yield None
+        return
+
+    current = Profile(kind, name)
+    _local.profile = current
+    try:
+        with connection.execute_wrapper(current.execute):
+            yield current
+    finally:
+        _local.profile = None
+        if not current.streaming:
+            save(current)
+
+
+def stream(current, content):
+    """
+    Carries on recording `current` while a streaming response's content is
+    consumed, the queries of an export only run then. The profile is saved
+    once the stream ends instead of when the view returns.
+    """
+    _local.profile = current
+    try:
+        with connection.execute_wrapper(current.execute):
+            yield from content
+    finally:
+        _local.profile = None
+        save(current)
+
+
+@contextmanager
+def profiled(name):
+    """
+    Adds the time spent in the enclosed block, or decorated function, to the
+    `name` timer of the profile being recorded. Costs a thread local lookup
+    when nothing is.
+    """
+    current = getattr(_local, 'profile', None)
+    if current is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.timer(name, time.perf_counter() - start)
+
+
+def instrument_templates():
+    # templates include and extend each other, only the outermost render is timed
+    from django.template.base import Template
+
+    if getattr(Template, 'profiled', False):
+        return
+
+    render = Template._render
+
+    def _render(self, context):
+        current = getattr(_local, 'profile', None)
+        if current is None or current.rendering:
+            return render(self, context)
+
+        current.rendering = True
+        try:
+            with profiled('templates'):
+                return render(self, context)
+        finally:
+            current.rendering = False
+
+    Template._render = _render
+    Template.profiled = True
+
+
+class ProfilingMiddleware:
+    """
+    Records a profile of PROFILING_SAMPLE_RATE (by default all) of the
+    requests while PROFILING is set, and removes itself otherwise. See
+    manage.py profile_report or the admin's profile report (/admin/profiles/)
+    for the results.
+    """
+
+    def __init__(self, get_response):
+        if not enabled():
+            raise MiddlewareNotUsed
+
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 1)
+        instrument_templates()
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        with profile('request', request.path) as current:
+            response = self.get_response(request)
+            if current is not None:
+                match = request.resolver_match
+                current.extra.update(
+                    method=request.method,
+                    status=response.status_code,
+                    view=(match.view_name or match.func.__name__) if match else ''
+                )
+                if response.streaming:
+                    current.streaming = True
+                    response.streaming_content = stream(current, response.streaming_content)
+
+        return response
+
+
+def report(records, sort='seconds', limit=20):
+    """
+    Groups records by view (or job task) and returns the worst `limit`
+    groups by mean `sort` (seconds, queries or duplicates), and the
+    duplicated queries that were run the most times over.
+    """
+    groups = {}
+    duplicates = {}
+    for record in records:
+        key = (record['kind'], record.get('view') or record['name'])
+        group = groups.setdefault(key, {
+            'kind': record['kind'], 'name': key[1], 'example': record['name'], 'count': 0,
+            'seconds': 0, 'max_seconds': 0, 'queries': 0, 'max_queries': 0, 'duplicates': 0, 'timers': {}
+        })
+        extra = sum(duplicate['count'] - 1 for duplicate in record['duplicates'])
+
+        group['count'] += 1
+        group['seconds'] += record['seconds']
+        group['max_seconds'] = max(group['max_seconds'], record['seconds'])
+        group['queries'] += record['queries']
+        group['max_queries'] = max(group['max_queries'], record['queries'])
+        group['duplicates'] += extra
+        for name, seconds in record['timers'].items():
+            group['timers'][name] = group['timers'].get(name, 0) + seconds
+
+        for duplicate in record['duplicates']:
+            entry = duplicates.setdefault(
+                duplicate['sql'], {'sql': duplicate['sql'], 'count': 0, 'seconds': 0, 'pages': set()}
+            )
+            entry['count'] += duplicate['count'] - 1
+            entry['seconds'] += duplicate['seconds']
+            entry['pages'].add(key[1])
+
+    pages = []
+    for group in groups.values():
+        for field in ('seconds', 'queries', 'duplicates'):
+            group[field] /= group['count']
+        group['timers'] = {name: seconds / group['count'] for name, seconds in sorted(group['timers'].items())}
+        pages.append(group)
+
+    for entry in duplicates.values():
+        entry['pages'] = sorted(entry['pages'])
+
+    return {
+        'pages': sorted(pages, key=lambda x: x[sort], reverse=True)[:limit],
+        'duplicates': sorted(duplicates.values(), key=lambda x: x['count'], reverse=True)[:limit],
+    }
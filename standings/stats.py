@@ -0,0 +1,167 @@
+from django.core.cache import caches
+from django.db import connections, transaction
+from django.db.models import Count, Q
+import multiprocessing
+from .cache import batched, touch, touch_drivers
+from .engine import StandingsEngine
+from .models import Lap, Season, SeasonStats
+
+
+class SeasonStatsBuilder:
+    """
+    Fills the SeasonStats rows of a season from one pass over its results.
+
+    The standings are built once for every driver and laps led/completed come
+    from a single grouped aggregate, so a rebuild costs the same handful of
+    queries however many drivers and races the season has.
+    """
+
+    def __init__(self, season):
+        self.season = season
+
+    def load_laps(self, driver_ids=None):
+        laps = Lap.objects.filter(result__race__season=self.season, session='race')
+        if driver_ids is not None:
+            laps = laps.filter(result__driver_id__in=driver_ids)
+
+        laps = laps.order_by().values('result_id').annotate(
+            completed=Count('id'), lead=Count('id', filter=Q(position=1))
+        )
+
+        return {row['result_id']: (row['completed'], row['lead']) for row in laps}
+
+    def build(self, stats=None):
+        """
+        Recalculates `stats` (by default every driver who has raced in the
+        season) in memory, leaving the rows to create or change in
+        `updated` and those whose driver is no longer in the standings in
+        `stale`. Nothing is written until save().
+        """
+        engine = StandingsEngine(self.season)
+        self.results = list(engine.load_results())
+
+        if stats is None:
+            rows = {stat.driver_id: stat for stat in SeasonStats.objects.filter(season=self.season)}
+            driver_ids = None
+        else:
+            rows = {stat.driver_id: stat for stat in stats}
+            driver_ids = list(rows)
+
+        try:
+            ps_season = self.season.point_system.compiled()
+        except AttributeError:
+            ps_season = None
+
+        laps = self.load_laps(driver_ids)
+        best_results = {}
+        updated = {}
+        for result in self.results:
+            best = best_results.get(result.driver_id)
+            if best is None or best.position > result.position:
+                best_results[result.driver_id] = result
+
+            if driver_ids is not None and result.driver_id not in rows:
+                continue
+
+            stat = updated.get(result.driver_id)
+            if stat is None:
+                stat = rows.get(result.driver_id) or SeasonStats(season=self.season, driver_id=result.driver_id)
+                stat.reset()
+                updated[result.driver_id] = stat
+
+            (laps_completed, laps_lead) = laps.get(result.id, (0, 0))
+            stat.add_result(result, ps_season, laps_completed=laps_completed, laps_lead=laps_lead)
+
+        # the standings use the best results just found for the countback tie breaker
+        drivers, _ = engine.aggregate(self.results, *engine.load_penalties(), best_results)
+        for row in engine.sort_drivers(drivers):
+            stat = updated.get(row['driver'].id)
+            if stat is not None:
+                stat.season_position = row['position']
+                stat.winner = self.season.finalized and stat.season_position == 1
+
+        self.updated = updated
+        self.stale = [stat for driver_id, stat in rows.items() if driver_id not in updated]
+
+        return self
+
+    def save(self):
+        created = [stat for stat in self.updated.values() if stat.pk is None]
+        changed = [stat for stat in self.updated.values() if stat.pk is not None]
+
+        with transaction.atomic():
+            SeasonStats.objects.bulk_create(created)
+            SeasonStats.objects.bulk_update(changed, SeasonStats.stat_fields, batch_size=500)
+            SeasonStats.objects.filter(id__in=[stat.pk for stat in self.stale if stat.pk is not None]).delete()
+
+    def touch(self):
+        # driver and team pages show the season stats of every driver involved
+        touch_drivers(*self.updated, *[stat.driver_id for stat in self.stale])
+        touch('team', *[result.team_id for result in self.results if result.driver_id in self.updated])
+
+    def update(self, stats=None):
+        """
+        Recalculates and saves `stats`, see build(). When a single row was
+        asked for and its driver is no longer in the standings the row is
+        deleted and False is returned, just as SeasonStats.update_stats did.
+        """
+        self.build(stats)
+        self.save()
+        self.touch()
+
+        if stats is not None and self.stale:
+            return False
+
+        return None
+
+
+def rebuild_batch(season_ids):
+    """
+    Rebuilds the stats of every season in `season_ids` in memory and writes
+    them, with the seasons' standings snapshots, in a single transaction so
+    readers see all of the batch or none of it. Returns the number of
+    seasons and results rebuilt.
+    """
+    seasons = list(Season.objects.filter(id__in=season_ids).select_related('point_system'))
+    Season.objects.filter(id__in=season_ids).update(stats_stale=False)
+
+    try:
+        builders = [SeasonStatsBuilder(season).build() for season in seasons]
+        # pages are only expired, on the way out of the batch, once it is committed
+        with batched(), transaction.atomic():
+            for builder in builders:
+                builder.save()
+                builder.season.refresh_snapshots()
+                builder.touch()
+    except Exception:
+        Season.expire_stats(season_ids)
+        raise
+
+    return len(builders), sum(len(builder.results) for builder in builders)
+
+
+def rebuild_seasons(season_ids, processes=1, batch_size=10):
+    """
+    Rebuilds the stats of every season in `season_ids`, `batch_size`
+    seasons to a transaction, over a pool of `processes` workers. Yields the
+    (seasons, results) count of each batch as it is committed.
+    """
+    season_ids = list(season_ids)
+    batches = [season_ids[i:i + batch_size] for i in range(0, len(season_ids), batch_size)]
+
+    if processes <= 1:
+        for batch in batches:
+            yield rebuild_batch(batch)
+        return
+
+    with worker_pool(processes) as pool:
+        yield from pool.imap_unordered(rebuild_batch, batches)
+
+
+def worker_pool(processes):
+    # the workers open their own connections, a socket shared across a fork would be corrupted
+    connections.close_all()
+    for backend in caches.all():
+        backend.close()
+
+    return multiprocessing.Pool(processes)
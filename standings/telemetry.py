@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef
+from .models import Lap, LapPack
+
+
+class RaceTelemetry:
+    """
+    The race and qualifying laps of a race, loaded by one ordered query into
+    column lists, from which everything the race page charts is derived in a
+    single pass instead of a query per driver.
+    """
+
+    columns = ('result', 'driver', 'session', 'lap_number', 'lap_time', 'compound', 'pitstop')
+
+    def __init__(self, race, results, stm=None):
+        self.race = race
+        self.results = results
+        self.stm = stm
+
+        self.labels = []
+        self.winner_laps = []
+        self.lap_times = {}
+        self.pitstops = {}
+        self.compounds = {}
+        self.q_compounds = {}
+
+    def load_packs(self):
+        packs = LapPack.objects.filter(result__race=self.race).annotate(driver_id=F('result__driver_id'))
+
+        data = {column: [] for column in self.columns}
+        for pack in packs:
+            laps = pack.unpack()
+            data['result'] += [pack.result_id] * pack.count
+            data['driver'] += [pack.driver_id] * pack.count
+            data['session'] += [pack.session] * pack.count
+            for column in self.columns[3:]:
+                data[column] += laps[column]
+
+        return data
+
+    def load(self):
+        laps = Lap.objects.filter(result__race=self.race)
+
+        # a packed race is read a row per result and session rather than a row per lap, the laps of any result and
+        # session without a pack (added since, or not packed yet) are read as rows
+        if getattr(settings, 'PACKED_LAPS', False):
+            data = self.load_packs()
+            packed = LapPack.objects.filter(result_id=OuterRef('result_id'), session=OuterRef('session'))
+            laps = laps.annotate(packed=Exists(packed)).filter(packed=False)
+        else:
+            data = {column: [] for column in self.columns}
+
+        laps = laps.order_by('lap_number', 'id').values_list(
+            'result_id', 'result__driver_id', 'session', 'lap_number', 'lap_time', 'compound', 'pitstop'
+        )
+        for lap in laps:
+            for column, value in zip(self.columns, lap):
+                data[column].append(value)
+
+        return data
+
+    def build(self):
+        data = self.load()
+
+        winner = next((result.id for result in self.results if result.position == 1), None)
+        for result in self.results:
+            self.lap_times[result.driver_id] = []
+            self.pitstops[result.driver_id] = []
+
+        tyre_map = self.stm.compiled() if self.stm else None
+        for (result_id, driver_id, session, lap_number, lap_time, compound, pitstop) in zip(
+                *[data[column] for column in self.columns]):
+            if tyre_map is not None:
+                compound = tyre_map.map(compound)
+
+            if session == 'qualify':
+                best = self.q_compounds.get(driver_id)
+                if lap_time > 0 and (best is None or lap_time < best['lap_time']):
+                    self.q_compounds[driver_id] = {'compound': compound, 'lap_time': lap_time}
+                continue
+
+            if session != 'race':
+                continue
+
+            if result_id == winner:
+                self.labels.append(lap_number)
+                self.winner_laps.append(lap_time)
+
+            self.lap_times.setdefault(driver_id, []).append(lap_time)
+            self.pitstops.setdefault(driver_id, []).append([compound, pitstop, lap_number])
+
+            stints = self.compounds.setdefault(driver_id, [{'lap_count': 0}])
+            stints[-1]['lap_count'] += 1
+            stints[-1]['compound'] = compound
+            if pitstop:
+                stints.append({'lap_count': 0})
+
+        return self
@@ -1,4 +1,5 @@
 from django import template
+import standings.points
 import standings.utils
 from django.conf import settings
 from django.utils.safestring import mark_safe
@@ -34,28 +35,23 @@ def position_display(result):
     return special_positions.get(shown_position, result.position)
 
 
-def position_colour(result, season):
+def point_table(result, season):
     if result.race.point_system:
-        ps = result.race.point_system.to_dict()
+        return result.race.point_system.compiled()
     else:
-        ps = season.point_system.to_dict()
+        return season.point_system.compiled()
 
-    colours = get_colours(len(ps) + 1)
 
-    return "pos-{}".format(str(colours.get(result.position, 'blue')))
+def position_colour(result, season):
+    return point_table(result, season).colour(result.position)
 
 
 @register.filter(name='show_bullet')
 def show_bullet(result, season):
     content = ""
     if result is not None:
-        if result.race.point_system:
-            ps = result.race.point_system.to_dict()
-        else:
-            ps = season.point_system.to_dict()
-
         try:
-            if result.team_points_allocated and result.position in ps:
+            if result.team_points_allocated and point_table(result, season).pays(result.position):
                 content = mark_safe('&bull;')
         except AttributeError:
             pass
@@ -65,26 +61,7 @@ def show_bullet(result, season):
 
 @register.filter(name='pos_colour')
 def pos_colour(position, season):
-    colours = get_colours(len(season.point_system.to_dict()) + 1)
-
-    return "pos-{}".format(str(colours.get(position, 'blue')))
-
-
-def get_colours(place_count):
-    colours = {
-        '-': 'default',
-        0: 'default',
-        1: 'yellow',
-        2: 'gray',
-        3: 'orange',
-        'Ret': 'retired',
-        'DSQ': 'black',
-        'DNS': 'default'
-    }
-
-    colours.update({x: 'green' for x in range(4, place_count)})
-
-    return colours
+    return season.point_system.compiled().colour(position)
 
 
 @register.filter(name='find_result')
@@ -96,6 +73,11 @@ def find_result(results, race):
     return result
 
 
+@register.filter(name='race_result')
+def race_result(results_by_race, race):
+    return results_by_race.get(race.id)
+
+
 @register.filter(name='find_driver')
 def find_driver(results, driver):
     try:
@@ -121,11 +103,11 @@ def get_points(results, season):
         return 0
 
     points = 0
-    ps = season.point_system.to_dict()
+    ps = season.point_system.compiled()
     for result in results:
         if result.race.point_system:
-            ps = result.race.point_system.to_dict()
-        points += ps.get(result.position, 0)
+            ps = result.race.point_system.compiled()
+        points += ps.points(result.position)
 
     return points
 
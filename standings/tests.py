@@ -1,6 +1,33 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+import threading
+from datetime import timedelta
 
-from .models import Season
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.core.cache import caches
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from lxml import etree
+
+from .cache import single_flight
+from .benchmark import chained_countback_sort, composite_countback_sort, league_urls, regressions, synthetic_log_file, \
+    synthetic_standings, urls
+from .engine import StandingsEngine
+from .logparser import parse_log, read_ahead
+from . import jobs, profiling
+from .models import Driver, DriverCareer, Job, Lap, LapPack, LogFile, Race, Result, Season, SeasonPenalty, \
+    SeasonStats, SeasonTyreMap, StandingsSnapshot, Team, TeamHistory, Track, TrackRecord
+from .names import NameResolver
+from .telemetry import RaceTelemetry
+from .templatetags.standings_extras import find_driver, find_result, find_results, race_result
+from .utils import unique_slugs
 
 
 class SeasonModelTests(TestCase):
@@ -27,3 +54,786 @@ class SeasonModelTests(TestCase):
             assert position["driver"].id == driver_id
             assert position["points"] == driver_info["points"]
             assert position["position"] == driver_info["position"]
+
+    def test_standings_query_count_is_fixed(self):
+        s = Season.objects.get(pk=1)
+
+        with self.assertNumQueries(StandingsEngine.QUERY_COUNT):
+            s.get_standings()
+
+        with self.assertNumQueries(StandingsEngine.QUERY_COUNT):
+            s.get_standings(upto=2)
+
+    def assertSnapshotsMatch(self, s, uptos=(None, 1, 5)):
+        for upto in uptos:
+            live = s.get_standings(use_position=True, upto=upto)
+            snapshot = s.get_snapshot_standings(use_position=True, upto=upto)
+
+            self.assertEqual(
+                [(row['driver'].id, row['points'], row['position']) for row in live[0]],
+                [(row['driver'].id, row['points'], row['position']) for row in snapshot[0]]
+            )
+            self.assertEqual(
+                [(row['team'].id, row['points'], row['position']) for row in live[1]],
+                [(row['team'].id, row['points'], row['position']) for row in snapshot[1]]
+            )
+
+    def test_snapshot_standings_match_live_standings(self):
+        s = Season.objects.get(pk=1)
+        s.refresh_snapshots()
+        self.assertEqual(StandingsSnapshot.objects.filter(season=s).count(), s.race_set.count())
+
+        self.assertSnapshotsMatch(s)
+
+    def test_changes_expire_snapshots(self):
+        s = Season.objects.get(pk=1)
+        s.refresh_snapshots()
+
+        points = lambda: next(row['points'] for row in s.get_snapshot_standings()[0] if row['driver'].id == 99)
+        penalty = SeasonPenalty.objects.create(season=s, driver_id=99, points=50)
+        self.assertEqual(points(), 46)
+        self.assertSnapshotsMatch(s)
+
+        penalty.delete()
+        self.assertEqual(points(), 96)
+        self.assertSnapshotsMatch(s)
+
+        # only the rounds from the result's race on are rebuilt
+        result = Result.objects.get(race__season=s, race__round_number=3, position=1)
+        result.delete()
+        self.assertEqual(StandingsSnapshot.objects.filter(season=s).count(), 2)
+        self.assertSnapshotsMatch(s, (None, 2, 3))
+
+    def test_results_by_race_match_result_lookups(self):
+        s = Season.objects.get(pk=1)
+        races = list(s.race_set.all())
+
+        for drivers, teams in [s.get_standings(), s.get_snapshot_standings()]:
+            for row in drivers:
+                for race in races:
+                    self.assertIs(race_result(row['results_by_race'], race), find_result(row['results'], race))
+
+            for row in teams:
+                for driver in row['drivers']:
+                    for race in races:
+                        self.assertIs(
+                            race_result(driver['results_by_race'], race),
+                            find_driver(find_results(row['results'], race), driver['driver'])
+                        )
+
+
+class SeasonStatsTests(TestCase):
+    fixtures = ["division", "driver", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def test_update_stats_query_count_is_fixed(self):
+        season = Season.objects.get(pk=1)
+        with CaptureQueriesContext(connection) as full_season:
+            season.update_stats()
+
+        self.assertEqual(SeasonStats.objects.get(season=season, driver_id=99).season_position, 1)
+
+        Race.objects.filter(season=season, round_number__gt=2).delete()
+        with CaptureQueriesContext(connection) as short_season:
+            season.update_stats()
+
+        self.assertEqual(len(full_season.captured_queries), len(short_season.captured_queries))
+        stale = SeasonStats.objects.filter(season=season).exclude(driver__result__race__season=season)
+        self.assertFalse(stale.exists())
+
+    def test_single_driver_update_matches_season_update(self):
+        season = Season.objects.get(pk=1)
+        season.update_stats()
+        stats = SeasonStats.objects.get(season=season, driver_id=100)
+        expected = {field: getattr(stats, field) for field in SeasonStats.stat_fields}
+
+        SeasonStats.objects.filter(pk=stats.pk).update(wins=0, season_position=99, positions={})
+        stats = SeasonStats.objects.get(pk=stats.pk)
+        stats.update_stats()
+
+        stats = SeasonStats.objects.get(pk=stats.pk)
+        self.assertEqual({field: getattr(stats, field) for field in SeasonStats.stat_fields}, expected)
+
+    def test_stats_records_only_updates_changed_seasons(self):
+        call_command('stats_records')
+        self.assertFalse(Season.objects.filter(stats_stale=True).exists())
+        self.assertFalse(Track.objects.filter(records_stale=True).exists())
+
+        # nothing changed, so nothing is rebuilt
+        SeasonStats.objects.update(wins=99)
+        call_command('stats_records')
+        self.assertTrue(SeasonStats.objects.filter(wins=99).exists())
+
+        result = Result.objects.filter(race__season_id=1).select_related('race').first()
+        result.save()
+        self.assertEqual(list(Season.objects.filter(stats_stale=True).values_list('id', flat=True)), [1])
+        self.assertEqual(
+            list(Track.objects.filter(records_stale=True).values_list('id', flat=True)), [result.race.track_id]
+        )
+
+        call_command('stats_records')
+        self.assertFalse(SeasonStats.objects.filter(wins=99).exists())
+        self.assertFalse(Season.objects.filter(stats_stale=True).exists())
+
+    def test_rebuild_stats_matches_update_stats(self):
+        Season.objects.get(pk=1).update_stats()
+        fields = ['driver_id'] + SeasonStats.stat_fields
+        expected = list(SeasonStats.objects.filter(season_id=1).order_by('driver_id').values_list(*fields))
+
+        SeasonStats.objects.update(wins=99, season_position=99)
+        output = io.StringIO()
+        call_command('rebuild_stats', workers=1, batch_size=2, stdout=output)
+
+        rows = SeasonStats.objects.filter(season_id=1).order_by('driver_id').values_list(*fields)
+        self.assertEqual(list(rows), expected)
+        self.assertIn('Rebuilt 3 seasons', output.getvalue())
+        self.assertIn('results/s', output.getvalue())
+
+
+class ParallelStatsTests(TransactionTestCase):
+    # committed, so the forked workers see the fixtures over their own connections
+    fixtures = ["division", "driver", "lap", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def rows(self):
+        fields = ['season_id', 'driver_id'] + SeasonStats.stat_fields
+        return list(SeasonStats.objects.order_by('season_id', 'driver_id').values_list(*fields))
+
+    def test_forked_workers_match_a_serial_rebuild(self):
+        call_command('rebuild_stats', workers=1, stdout=io.StringIO())
+        expected = self.rows()
+        self.assertTrue(expected)
+
+        SeasonStats.objects.update(wins=99, season_position=99)
+        call_command('rebuild_stats', workers=2, batch_size=1, stdout=io.StringIO())
+        self.assertEqual(self.rows(), expected)
+
+        SeasonStats.objects.update(wins=99, season_position=99)
+        Season.objects.update(stats_stale=True)
+        call_command('stats_records', parallel=2)
+        self.assertEqual(self.rows(), expected)
+        self.assertFalse(Season.objects.filter(stats_stale=True).exists())
+
+
+class CachedViewTests(TestCase):
+    fixtures = ["division", "driver", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def setUp(self):
+        cache.clear()
+
+    def assertCached(self, url):
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_saving_a_result_expires_its_pages(self):
+        result = Result.objects.filter(race__season_id=1).select_related('race').first()
+        urls = [
+            reverse('season', args=[1]), reverse('race', args=[result.race_id]),
+            reverse('driver', args=[result.driver_id]), '/api/standings/1'
+        ]
+        for url in urls:
+            self.assertCached(url)
+
+        result.points += 10
+        result.save()
+
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            self.assertGreater(len(queries), 0, url)
+
+    def test_bulk_updates_expire_pages(self):
+        race = Race.objects.filter(season_id=1).first()
+        driver_id = race.result_set.first().driver_id
+        url = reverse('driver', args=[driver_id])
+        self.assertCached(url)
+
+        race.fill_attributes()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertGreater(len(queries), 0)
+
+    def assertExpired(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertGreater(len(queries), 0, url)
+
+    def test_changes_to_what_a_page_shows_expire_it(self):
+        result = Result.objects.filter(race__season_id=1).select_related('team').first()
+        urls = [
+            reverse('season', args=[1]),
+            reverse('race', args=[result.race_id]),
+            reverse('driver', args=[result.driver_id]),
+        ]
+        for url in urls:
+            self.assertCached(url)
+
+        result.team.name = 'Renamed'
+        result.team.save()
+        for url in urls:
+            self.assertExpired(url)
+
+        self.assertCached(urls[1])
+        Lap.objects.create(result=result, session='race', lap_number=1, lap_time=90.0)
+        self.assertExpired(urls[1])
+
+    def test_point_systems_tyre_maps_and_tracks_expire_pages(self):
+        season = Season.objects.select_related('point_system').get(pk=1)
+        race = Race.objects.filter(season=season).select_related('track').first()
+        urls = [reverse('season', args=[season.id]), reverse('race', args=[race.id])]
+
+        Result.objects.filter(race__season=season).delete()
+        for change in [season.point_system.save, SeasonTyreMap(season=season, c1='Soft').save, race.track.save]:
+            for url in urls:
+                self.assertCached(url)
+
+            change()
+            for url in urls:
+                self.assertExpired(url)
+
+    def test_unrelated_changes_keep_pages(self):
+        url = reverse('season', args=[1])
+        self.client.get(url)
+
+        SeasonPenalty.objects.create(season_id=2, points=5)
+        self.assertCached(url)
+
+
+class CacheBackendTests(SimpleTestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+
+    def tearDown(self):
+        for suffix in ['', '-wal', '-shm']:
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+    def tiered_caches(self):
+        return {
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {'BACKEND': 'standings.cache_backends.SQLiteCache', 'LOCATION': self.path},
+            'local_a': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'a'},
+            'local_b': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'b'},
+            'server_a': {'BACKEND': 'standings.cache_backends.TieredCache', 'OPTIONS': {'LOCAL': 'local_a'}},
+            'server_b': {'BACKEND': 'standings.cache_backends.TieredCache', 'OPTIONS': {'LOCAL': 'local_b'}},
+        }
+
+    def test_sqlite_cache(self):
+        with override_settings(CACHES=self.tiered_caches()):
+            shared = caches['shared']
+            shared.set('points', 10)
+            self.assertEqual(shared.get('points'), 10)
+            self.assertFalse(shared.add('points', 20))
+            self.assertEqual(shared.incr('points', 5), 15)
+
+            shared.set('gone', 1, timeout=-1)
+            self.assertIsNone(shared.get('gone'))
+            self.assertTrue(shared.add('gone', 2))
+
+            shared.delete('points')
+            with self.assertRaises(ValueError):
+                shared.incr('points')
+
+            connection = shared.connection
+            shared.close()
+            self.assertEqual(shared.get('gone'), 2)
+            self.assertIsNot(shared.connection, connection)
+
+    def test_tiered_caches_share_locks_and_versions(self):
+        with override_settings(CACHES=self.tiered_caches()):
+            server_a, server_b = caches['server_a'], caches['server_b']
+            server_a.set('standings', 'season 1')
+            self.assertEqual(server_b.get('standings'), 'season 1')
+            self.assertEqual(caches['local_b'].get('standings'), 'season 1')
+
+            self.assertTrue(server_a.add('lock', True))
+            self.assertFalse(server_b.add('lock', True))
+
+            server_a.set('version', 1)
+            server_b.incr('version')
+            self.assertEqual(server_b.get('version'), 2)
+
+    def test_single_flight_serves_stale_while_locked(self):
+        cache.set('stale', 'old standings')
+        cache.add('lock:fresh', True)
+        try:
+            self.assertEqual(single_flight('fresh', lambda: 'new standings', stale_key='stale'), 'old standings')
+        finally:
+            cache.delete('lock:fresh')
+
+        self.assertEqual(single_flight('fresh', lambda: 'new standings', stale_key='stale'), 'new standings')
+        self.assertEqual(cache.get('stale'), 'new standings')
+
+
+class DriverCareerTests(TestCase):
+    fixtures = ["division", "driver", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def setUp(self):
+        cache.clear()
+        Season.objects.get(pk=1).update_stats()
+
+    def test_driver_page_query_count_is_fixed(self):
+        DriverCareer.for_driver(Driver.objects.get(pk=99))
+
+        with self.assertNumQueries(7):
+            self.client.get(reverse('driver', args=[99]))
+
+    def test_result_changes_rebuild_career(self):
+        career = DriverCareer.for_driver(Driver.objects.get(pk=99))
+        result = Result.objects.filter(driver_id=99, race__season_id=1).first()
+        points = career.seasons[0]['teams'][0]['points']
+
+        result.points += 10
+        result.save()
+        self.assertTrue(DriverCareer.objects.get(pk=career.pk).stale)
+
+        career = DriverCareer.for_driver(Driver.objects.get(pk=99))
+        self.assertFalse(career.stale)
+        self.assertEqual(career.seasons[0]['teams'][0]['points'], points + 10)
+
+    def test_concurrent_first_builds_share_one_row(self):
+        driver = Driver.objects.get(pk=100)
+        (first, second) = (DriverCareer(driver=driver), DriverCareer(driver=driver))
+        first.refresh()
+        second.refresh()
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(DriverCareer.objects.filter(driver=driver).count(), 1)
+
+
+class TeamHistoryTests(TestCase):
+    fixtures = ["division", "driver", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def setUp(self):
+        cache.clear()
+        for season in Season.objects.all():
+            TeamHistory.refresh(season.id, Team.objects.values_list('id', flat=True))
+
+    def test_team_page_query_count_is_fixed(self):
+        with self.assertNumQueries(7):
+            self.client.get(reverse('team', args=[1]))
+
+    def test_moving_a_result_updates_both_teams(self):
+        result = Result.objects.filter(race__season_id=1).exclude(team_id=1).first()
+        old_team_id = result.team_id
+
+        result.team_id = 1
+        result.save()
+
+        self.assertIn(result.id, TeamHistory.objects.get(team_id=1, season_id=1, driver_id=result.driver_id).result_ids)
+        self.assertFalse(any(
+            result.id in row.result_ids for row in TeamHistory.objects.filter(team_id=old_team_id, season_id=1)
+        ))
+
+    def test_disqualification_zeroes_the_team_history(self):
+        row = TeamHistory.objects.filter(season_id=1, points__gt=0).first()
+
+        penalty = SeasonPenalty.objects.create(season_id=1, driver_id=row.driver_id, disqualified=True)
+        penalty.process()
+
+        self.assertEqual(TeamHistory.objects.get(pk=row.pk).points, 0)
+
+
+class RaceModelTests(TestCase):
+    fixtures = ["division", "driver", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def test_fill_attributes_query_count_does_not_grow_with_results(self):
+        with CaptureQueriesContext(connection) as full_grid:
+            Race.objects.get(pk=2).fill_attributes()
+
+        Race.objects.get(pk=2).result_set.filter(position__gt=10).delete()
+
+        with CaptureQueriesContext(connection) as short_grid:
+            Race.objects.get(pk=2).fill_attributes()
+
+        self.assertEqual(len(full_grid.captured_queries), len(short_grid.captured_queries))
+
+    def test_fill_attributes_scores_results(self):
+        race = Race.objects.get(pk=2)
+        race.result_set.update(points=0, gap='', finalized=False)
+        race.fill_attributes()
+
+        winner = race.result_set.get(position=1)
+        self.assertEqual(winner.points, 25)
+        self.assertEqual(winner.gap, '0.000')
+        self.assertEqual(race.result_set.get(position=15).points, 1)
+
+    def create_laps(self, race):
+        (winner, second) = race.result_set.all()[:2]
+        Lap.objects.bulk_create([
+            Lap(result=winner, session='race', lap_number=1, lap_time=90.5, compound='Soft', pitstop=True),
+            Lap(result=winner, session='race', lap_number=2, lap_time=91.5, compound='Medium'),
+            Lap(result=second, session='race', lap_number=1, lap_time=92.0, compound='Hard'),
+            Lap(result=second, session='qualify', lap_number=1, lap_time=89.0, compound='Soft'),
+            Lap(result=second, session='qualify', lap_number=2, lap_time=88.5, compound='Medium'),
+        ])
+
+    def test_telemetry_loads_laps_in_one_query(self):
+        race = Race.objects.get(pk=2)
+        self.create_laps(race)
+        results = list(race.result_set.all())
+        (winner, second) = results[:2]
+
+        with self.assertNumQueries(1):
+            telemetry = RaceTelemetry(race, results).build()
+
+        self.assertEqual(telemetry.labels, [1, 2])
+        self.assertEqual(telemetry.winner_laps, [90.5, 91.5])
+        self.assertEqual(telemetry.lap_times[second.driver_id], [92.0])
+        self.assertEqual(telemetry.lap_times[results[2].driver_id], [])
+        self.assertEqual(telemetry.pitstops[winner.driver_id], [['Soft', True, 1], ['Medium', False, 2]])
+        self.assertEqual(
+            telemetry.compounds[winner.driver_id],
+            [{'lap_count': 1, 'compound': 'Soft'}, {'lap_count': 1, 'compound': 'Medium'}]
+        )
+        self.assertEqual(telemetry.q_compounds, {second.driver_id: {'compound': 'Medium', 'lap_time': 88.5}})
+
+    @override_settings(PACKED_LAPS=True)
+    def test_packed_laps_round_trip(self):
+        race = Race.objects.get(pk=2)
+        self.create_laps(race)
+        LapPack.refresh(race)
+        fields = ['lap_number'] + LogFile.lap_fields + ['race_time']
+
+        for pack in LapPack.objects.all():
+            laps = Lap.objects.filter(result_id=pack.result_id, session=pack.session).order_by('lap_number')
+            self.assertEqual(
+                [[getattr(lap, field) for field in fields] for lap in pack.laps()],
+                [[getattr(lap, field) for field in fields] for lap in laps]
+            )
+
+        results = list(race.result_set.all())
+        packed = RaceTelemetry(race, results).build()
+        with self.settings(PACKED_LAPS=False):
+            unpacked = RaceTelemetry(race, results).build()
+        for attribute in ('labels', 'winner_laps', 'lap_times', 'pitstops', 'compounds', 'q_compounds'):
+            self.assertEqual(getattr(packed, attribute), getattr(unpacked, attribute))
+
+        lap = Lap.objects.get(result=results[1], session='race')
+        lap.lap_time = 95.0
+        lap.save()
+        self.assertEqual(LapPack.objects.get(result=results[1], session='race').unpack()['lap_time'], [95.0])
+
+    @override_settings(PACKED_LAPS=True)
+    def test_partly_packed_race_reads_unpacked_laps(self):
+        race = Race.objects.get(pk=2)
+        self.create_laps(race)
+        LapPack.refresh(race)
+        results = list(race.result_set.all())
+
+        # a half run pack_laps, and a lap added to a result that has no pack
+        LapPack.objects.filter(result=results[1], session='qualify').delete()
+        Lap.objects.create(result=results[2], session='race', lap_number=1, lap_time=93.0, compound='Hard')
+
+        with self.assertNumQueries(2):
+            packed = RaceTelemetry(race, results).build()
+        with self.settings(PACKED_LAPS=False):
+            unpacked = RaceTelemetry(race, results).build()
+        for attribute in ('labels', 'winner_laps', 'lap_times', 'pitstops', 'compounds', 'q_compounds'):
+            self.assertEqual(getattr(packed, attribute), getattr(unpacked, attribute))
+        self.assertEqual(packed.lap_times[results[2].driver_id], [93.0])
+
+    def test_track_records_are_rebuilt_in_bulk(self):
+        TrackRecord.refresh()
+        # unchanged records are only read, after clearing the tracks' records_stale marks
+        with self.assertNumQueries(4):
+            TrackRecord.refresh()
+
+        best = {}
+        for result in Result.objects.filter(race_fastest_lap__gt=0).select_related('race'):
+            key = (result.race.track_id, result.race.season_id)
+            best[key] = min(best.get(key, result.race_fastest_lap), result.race_fastest_lap)
+        records = TrackRecord.objects.filter(session_type='race')
+        self.assertEqual({(record.track_id, record.season_id): record.lap_time for record in records}, best)
+
+        record = records.first()
+        Result.objects.filter(race__track_id=record.track_id, race__season_id=record.season_id).\
+            update(race_fastest_lap=0, qualifying_fastest_lap=0)
+        record.track.update_records()
+        self.assertFalse(TrackRecord.objects.filter(track_id=record.track_id, season_id=record.season_id).exists())
+
+
+class LogFileModelTests(TestCase):
+    fixtures = ["division", "driver", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.xml')
+        os.close(handle)
+        synthetic_log_file(self.path, driver_count=4, lap_count=30)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_reimport_updates_laps_in_place(self):
+        race = Race.objects.get(pk=2)
+        LogFile(race=race, file=self.path).process()
+        laps = dict(Lap.objects.filter(result__race=race).values_list('id', 'lap_time'))
+        self.assertEqual(len(laps), 4 * 30)
+
+        with CaptureQueriesContext(connection) as reimport:
+            LogFile(race=race, file=self.path).process()
+
+        self.assertEqual(dict(Lap.objects.filter(result__race=race).values_list('id', 'lap_time')), laps)
+        self.assertFalse([q for q in reimport.captured_queries if q['sql'].startswith('INSERT INTO "standings_lap"')])
+
+    @override_settings(PACKED_LAPS=True)
+    def test_import_packs_laps(self):
+        race = Race.objects.get(pk=2)
+        LogFile(race=race, file=self.path).process()
+
+        packs = LapPack.objects.filter(result__race=race)
+        self.assertEqual(sorted(pack.count for pack in packs), [30] * 4)
+        self.assertEqual(
+            sorted(lap_time for pack in packs for lap_time in pack.unpack()['lap_time']),
+            sorted(Lap.objects.filter(result__race=race).values_list('lap_time', flat=True))
+        )
+
+
+class JobTests(TestCase):
+    fixtures = ["division", "driver", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def test_queued_jobs_run_once(self):
+        Race.objects.get(pk=2).result_set.update(points=0, finalized=False)
+        job = jobs.enqueue('fill_attributes', race_id=2)
+        self.assertEqual(jobs.enqueue('fill_attributes', race_id=2), job)
+
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(Job.objects.get(pk=job.id).status, 'done')
+        self.assertEqual(Race.objects.get(pk=2).result_set.get(position=1).points, 25)
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_failed_job_keeps_error(self):
+        job = jobs.enqueue('fill_attributes', race_id=0)
+        jobs.run_pending()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('DoesNotExist', job.error)
+
+    def test_stale_running_job_is_queued_again(self):
+        job = jobs.enqueue('update_records', track_id=Race.objects.get(pk=2).track_id)
+        running = jobs.enqueue('update_records', track_id=0)
+        Job.objects.filter(pk=job.pk).update(status='running', started=timezone.now() - timedelta(hours=2))
+        Job.objects.filter(pk=running.pk).update(status='running', started=timezone.now())
+
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'done')
+        self.assertEqual(Job.objects.get(pk=running.pk).status, 'running')
+
+
+class SeasonLockTests(TransactionTestCase):
+    fixtures = ["division", "driver", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def hold_lock(self, season_id):
+        # the lock is taken on a connection of its own, as by another worker, until the returned event is set
+        (locked, release) = (threading.Event(), threading.Event())
+
+        def hold():
+            with transaction.atomic():
+                Season.lock(season_id)
+                locked.set()
+                release.wait(10)
+            connection.close()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        locked.wait(10)
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+
+        return release
+
+    def test_jobs_on_a_season_take_turns(self):
+        release = self.hold_lock(1)
+        job = jobs.enqueue('update_stats', season_id=1)
+
+        worker = threading.Thread(target=lambda: (jobs.run_pending(), connection.close()))
+        worker.start()
+        worker.join(1)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'running')
+
+        release.set()
+        worker.join(10)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'done')
+
+    def test_readers_do_not_wait_for_a_locked_season(self):
+        season = Season.objects.get(pk=1)
+        StandingsSnapshot.objects.filter(season=season).delete()
+        expected = season.get_standings()
+
+        self.hold_lock(1)
+        self.assertEqual(season.get_snapshot_standings(), expected)
+        self.assertFalse(StandingsSnapshot.objects.filter(season=season).exists())
+
+
+class NameResolverTests(TestCase):
+    fixtures = ["division", "driver", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def test_accented_names_match_as_the_database_folds_them(self):
+        names = ['Jérôme Søren Łukasz', 'Jerome Soren Lukasz', 'Tom Oldenmenger']
+        resolved = NameResolver(Driver).resolve(names)
+        count = Driver.objects.count()
+
+        # whatever unaccent folds together is one driver, and resolving again creates nothing
+        for name in names:
+            self.assertEqual(Driver.objects.get(name__unaccent=name), resolved[name])
+        self.assertEqual(NameResolver(Driver).resolve(names), resolved)
+        self.assertEqual(Driver.objects.count(), count)
+
+    def test_resolve_grid(self):
+        Driver.objects.create(name='Tom Oldenmenger')
+        resolver = NameResolver(Driver)
+
+        # the names' keys, the candidates, the slugs taken and the insert
+        with self.assertNumQueries(4):
+            resolved = resolver.resolve(['Tom  Oldenmenger', 'New Driver', 'New Driver'])
+
+        self.assertEqual(resolved['Tom Oldenmenger'].id, 99)
+        self.assertEqual(resolver.duplicates, {99})
+        self.assertEqual(resolved['New Driver'].slug, 'new-driver')
+        self.assertEqual(Driver.objects.filter(name='New Driver').count(), 1)
+
+    def test_names_without_a_slug_only_load_empty_slugs(self):
+        Driver.objects.filter(pk=99).update(slug='')
+        with CaptureQueriesContext(connection) as queries:
+            slugs = unique_slugs(Driver, ['漢字', '漢字'])
+        self.assertEqual(len(set(slugs) - {''}), 2)
+        self.assertNotIn('LIKE %', queries.captured_queries[0]['sql'].replace("'", ''))
+
+
+class LogParserTests(SimpleTestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.xml')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_parse_log_streams_drivers(self):
+        synthetic_log_file(self.path, driver_count=3, lap_count=20, session='Qualify')
+        drivers = list(read_ahead(parse_log(self.path)))
+
+        self.assertEqual([driver.name for driver in drivers], ['Driver 1', 'Driver 2', 'Driver 3'])
+        self.assertEqual({driver.session for driver in drivers}, {'qualify'})
+        self.assertEqual([lap.number for lap in drivers[0].lap_records], list(range(1, 21)))
+        self.assertEqual(drivers[0].lap_records[0].compound, 'medium')
+
+    def test_read_ahead_raises_parse_errors(self):
+        with open(self.path, 'w') as outfile:
+            outfile.write('<rFactorXML><RaceResults><Race><Driver><Name>Driver 1</Name></Driver><Driver>')
+
+        with self.assertRaises(etree.XMLSyntaxError):
+            list(read_ahead(parse_log(self.path)))
+
+
+class CountbackSortTests(SimpleTestCase):
+    def test_composite_sort_matches_chained_sorts(self):
+        for seed in range(5):
+            for countback_range in [1, 10, 30]:
+                drivers = synthetic_standings(120, 15, countback_range, seed=seed)
+                self.assertEqual(
+                    chained_countback_sort(drivers, countback_range),
+                    composite_countback_sort(drivers, countback_range)
+                )
+
+
+class CompoundMapTests(TestCase):
+    fixtures = ["division", "league", "point_system", "season"]
+
+    def test_compounds_map_to_first_matching_slot(self):
+        tyre_map = SeasonTyreMap.objects.create(season_id=1, c1='Soft', c2='Medium', c3='Hard', c5='Wet')
+        tyre_map = tyre_map.compiled()
+
+        self.assertEqual(tyre_map.map('0,Soft'), 'c1')
+        self.assertEqual(tyre_map.map('2,HARD'), 'c3')
+        self.assertEqual(tyre_map.map('Intermediate'), 'Intermediate')
+        self.assertIn('0,Soft', tyre_map.mapped)
+
+    def test_saving_the_map_recompiles_it(self):
+        tyre_map = SeasonTyreMap.objects.create(season_id=1, c1='Soft')
+        self.assertEqual(tyre_map.compiled().map('Soft'), 'c1')
+
+        tyre_map.c1 = ''
+        tyre_map.c2 = 'Soft'
+        tyre_map.save()
+        self.assertEqual(SeasonTyreMap.objects.get(pk=tyre_map.pk).compiled().map('Soft'), 'c2')
+
+
+class BenchmarkTests(TestCase):
+    def test_every_page_of_a_synthetic_league_renders(self):
+        rows = urls(repeat=1, drivers=6, rounds=2, laps=3)
+
+        self.assertEqual([row['name'] for row in rows], [name for name, _ in league_urls(Season.objects.get())])
+        self.assertTrue(all(row['queries'] > 0 for row in rows))
+
+    def test_regressions(self):
+        baseline = {'race': {'name': 'race', 'seconds': 0.2, 'queries': 10, 'peak_kb': 1000}}
+
+        within = {'name': 'race', 'seconds': 0.24, 'queries': 10, 'peak_kb': 1200}
+        slower = {'name': 'race', 'seconds': 0.3, 'queries': 11, 'peak_kb': 1000}
+        self.assertEqual(regressions([within], baseline, 0.25), [])
+        self.assertEqual(len(regressions([slower], baseline, 0.25)), 2)
+        self.assertEqual(regressions([{'name': 'new page', 'seconds': 1, 'queries': 100}], baseline, 0.25), [])
+
+
+class ProfilingTests(TestCase):
+    fixtures = ["division", "driver", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.profiling = override_settings(
+            PROFILING=True, PROFILING_PATH=os.path.join(self.directory, 'profiles.jsonl'),
+            MIDDLEWARE=['standings.profiling.ProfilingMiddleware'] + settings.MIDDLEWARE
+        )
+        self.profiling.enable()
+
+    def tearDown(self):
+        profiling.clear()
+        self.profiling.disable()
+        os.rmdir(self.directory)
+
+    def test_requests_are_recorded_and_reported(self):
+        self.client.get(reverse('race', args=[2]))
+        Race.objects.get(pk=2).fill_attributes()
+
+        with profiling.profile('job', 'update_stats'):
+            Season.objects.get(pk=1).get_standings()
+
+        (page, job) = profiling.load()
+        self.assertEqual((page['kind'], page['view'], page['status']), ('request', 'race', 200))
+        self.assertGreater(page['queries'], 0)
+        self.assertIn('templates', page['timers'])
+        self.assertIn('get_standings', job['timers'])
+
+        report = profiling.report([page, page, job], sort='queries')
+        self.assertEqual([(x['name'], x['count']) for x in report['pages']], [('race', 2), ('update_stats', 1)])
+
+    def test_streamed_responses_are_recorded_once_consumed(self):
+        response = self.client.get('/api/export/results')
+        self.assertEqual(profiling.load(), [])
+
+        b''.join(response.streaming_content)
+        (page,) = profiling.load()
+        self.assertEqual((page['view'], page['status']), ('standings_api.views.export_view', 200))
+        self.assertGreater(page['queries'], 0)
+
+    def test_unwritable_store_does_not_break_pages(self):
+        # a file where the store's directory should be
+        with self.settings(PROFILING_PATH=os.path.join(__file__, 'profiles.jsonl')), \
+                self.assertLogs('standings.profiling', 'ERROR'):
+            self.assertEqual(self.client.get(reverse('race', args=[2])).status_code, 200)
+
+    def test_report_is_an_admin_page(self):
+        self.assertEqual(self.client.get(reverse('profile_report')).status_code, 302)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.client.get(reverse('race', args=[2]))
+        response = self.client.get(reverse('profile_report'))
+        self.assertContains(response, 'race')
+
+    def test_duplicate_queries_share_a_fingerprint(self):
+        self.assertEqual(
+            profiling.fingerprint('SELECT * FROM "t" WHERE "id" = 5 AND "name" = \'x\' AND "x" IN (%s, %s)'),
+            profiling.fingerprint('SELECT * FROM "t" WHERE "id" = 12 AND "name" = \'y\' AND "x" IN (%s, %s, %s)')
+        )
@@ -2,6 +2,7 @@ from inflect import engine
 from collections.abc import Iterable
 import re
 from itertools import zip_longest
+from django.db.models import Q
 from django.utils.text import slugify
 
 
@@ -50,6 +51,39 @@ def apply_positions(table, key='points', use_position=False):
     return table
 
 
+def apply_gaps(table, key='points'):
+    for index, row in enumerate(table):
+        if index == 0:
+            row['gap'] = {'to_leader': "-", "to_last_pos": "-"}
+        else:
+            row['gap'] = {'to_leader': table[0][key] - row[key], "to_last_pos": table[index - 1][key] - row[key]}
+
+    return table
+
+
+def countback_sort(items, positions, points=None, tie_breaker=None, depth=10):
+    """
+    Sorts items with a single composite key: points (highest first), then the
+    number of 1st places, 2nd places and so on down to `depth` (most first),
+    then the tie breaker (lowest first). Items that are still tied keep their
+    original order.
+
+    `positions`, `points` and `tie_breaker` are called with each item and
+    return a {position: count} mapping, the points and the tie breaker value.
+    """
+    def key(item):
+        counts = positions(item)
+        ranking = [-counts.get(pos, 0) for pos in range(1, depth + 1)]
+        if points is not None:
+            ranking.insert(0, -points(item))
+        if tie_breaker is not None:
+            ranking.append(tie_breaker(item))
+
+        return ranking
+
+    return sorted(items, key=key)
+
+
 def sort_counter(results, ordinal=True, convert_int=True):
     p = engine()
     if convert_int:
@@ -71,49 +105,6 @@ def flatten(l):
             yield el
 
 
-def expire_view_cache(path, meta, key_prefix=None):
-    """
-    This function allows you to invalidate any item from the per-view cache.
-    It probably won't work with things cached using the per-site cache
-    middleware (because that takes account of the Vary: Cookie header).
-    This assumes you're using the Sites framework.
-    Arguments:
-        * path: The URL of the view to invalidate, like `/blog/posts/1234/`.
-        * meta: Meta details of the request
-        * key_prefix: The same as that used for the cache_page()
-          function/decorator (if any).
-    """
-    from django.conf import settings
-    from django.core.cache import cache
-    from django.utils.cache import get_cache_key
-    from django.core.handlers.wsgi import WSGIRequest
-
-    # Create a fake request object
-    request = WSGIRequest(meta)
-    request.method = 'GET'
-    request.path = path
-
-    if 'admin' in path:
-        request.META['QUERY_STRING'] = ''
-
-    if settings.USE_I18N:
-        request.LANGUAGE_CODE = settings.LANGUAGE_CODE
-
-    # If this key is in the cache, delete it:
-    try:
-        cache_key = get_cache_key(request, key_prefix=key_prefix)
-        if cache_key:
-            if cache_key in cache:
-                cache.delete(cache_key)
-                return (True, 'Successfully invalidated')
-            else:
-                return (False, 'Cache_key does not exist in cache')
-        else:
-            raise ValueError('Failed to create cache_key')
-    except (ValueError, Exception) as e:
-        return (False, e)
-
-
 def calculate_average(values, key):
     try:
         value = sum(values[key]) / len(values[key])
@@ -151,16 +142,34 @@ def grouper(iterable, n, fillvalue=None):
 
 
 def unique_slug_generator(model_instance, title):
-    slug = slugify(title)
-    model_class = model_instance.__class__
+    return unique_slugs(model_instance.__class__, [title])[0]
+
+
+def unique_slugs(model_class, titles):
+    # the slugs already taken for every title are loaded in one query
+    bases = [slugify(title) for title in titles]
+
+    query = Q()
+    for base in set(bases):
+        if base:
+            query |= Q(slug__startswith=base)
+        else:
+            # a name slugify() drops every character of, which would otherwise match every slug in the table
+            query |= Q(slug='') | Q(slug__startswith='-')
+    taken = set(model_class._default_manager.filter(query).values_list('slug', flat=True)) if bases else set()
+
+    slugs = []
+    for slug in bases:
+        slug_identifer = 0
 
-    slug_identifer = 0
+        while slug in taken:
+            slug_identifer += 1
+            slug = f"{slug}-{slug_identifer}"
 
-    while model_class._default_manager.filter(slug=slug).exists():
-        slug_identifer += 1
-        slug = f"{slug}-{slug_identifer}"
+        taken.add(slug)
+        slugs.append(slug)
 
-    return slug
+    return slugs
 
 
 def check_field_overwrite(result, post_fields, new_result):
@@ -178,9 +187,4 @@ def map_compound(stm, compound):
     if not stm:
         return compound
 
-    try:
-        result = [f"c{x + 1}" for x in range(7) if getattr(stm, f"c{x + 1}").lower() in compound.lower() and getattr(stm, f"c{x + 1}")][0]
-    except IndexError:
-        result = compound
-
-    return result
\ No newline at end of file
+    return stm.compiled().map(compound)
@@ -1,9 +1,13 @@
-from django.views.decorators.cache import cache_page
-from django.db.models import Count, Q, Sum
+from django.conf import settings
+from django.db.models import Count, Q
 from django.shortcuts import get_object_or_404, render
 from django.http import Http404
-from .models import Season, Driver, Team, League, Division, Race, Track, Result, SeasonStats, SeasonPenalty, Lap, PointSystem, SeasonTyreMap
-from standings.utils import sort_counter, calculate_average, truncate_point_system, grouper, map_compound
+from .cache import cached_view
+from .models import Season, Driver, DriverCareer, Team, League, Division, Race, Track, Result, SeasonStats, \
+    SeasonPenalty, PointSystem, SeasonTyreMap, TeamHistory
+from .telemetry import RaceTelemetry
+from standings.utils import sort_counter, calculate_average, truncate_point_system, grouper, \
+    countback_sort
 from collections import Counter
 from django_countries.fields import Country
 from datetime import date, datetime
@@ -24,17 +28,17 @@ def index_view(request):
 def season_view_alternate(request, division, season):
     try:
         tmp = Season.objects.get(slug=season, division__slug=division)
-        return season_view(request, tmp.id)
+        return season_view(request, season_id=tmp.id)
     except Season.DoesNotExist:
         raise Http404("Season not found.")
 
 
-@cache_page(None)
+@cached_view(season='season_id')
 def season_view(request, season_id):
     season = get_object_or_404(Season, pk=season_id)
 
     upto = int(re.sub(r"[^0-9]+", "", request.GET.get('upto', str(season.race_set.count()))))
-    standings_driver, standings_team = season.get_standings(upto=upto)
+    standings_driver, standings_team = season.get_snapshot_standings(upto=upto)
 
     ps = season.point_system
     point_systems = { "season": {
@@ -63,6 +67,7 @@ def season_view(request, season_id):
     context = {
         "upto": int(upto or season.race_set.count()),
         "season": season,
+        "races": list(season.race_set.select_related('track')),
         "drivers": standings_driver,
         "teams": standings_team,
         "point_systems": point_systems
@@ -71,6 +76,7 @@ def season_view(request, season_id):
     return render(request, 'standings/season.html', context)
 
 
+@cached_view(season='season_id')
 def season_stats_view(request, season_id):
     season = get_object_or_404(Season, pk=season_id)
     stats = season.seasonstats_set.order_by('-wins')
@@ -85,64 +91,54 @@ def season_stats_view(request, season_id):
 
 def team_view_slug(request, slug):
     team = get_object_or_404(Team, slug=slug)
-    return team_view(request, team.id, from_slug=True)
+    return team_view(request, team_id=team.id, from_slug=True)
 
 
+@cached_view(team='team_id')
 def team_view(request, team_id, from_slug=False):
-    seasons = {}
     team = get_object_or_404(Team, pk=team_id)
+    history = list(TeamHistory.objects.filter(team=team).select_related('driver').order_by('driver_id'))
 
-    season_list = Season.objects.filter(race__result__team_id=team_id).distinct()
-    for season in season_list:
-        seasons[season.id] = {
-            "season": season,
-            "drivers": {},
-            "penalties": SeasonPenalty.objects.filter(season=season, team=team)
-        }
+    season_list = Season.objects.select_related('division__league', 'point_system').\
+        prefetch_related('race_set').in_bulk({row.season_id for row in history})
+    results = Result.objects.select_related('race__season', 'race__point_system').\
+        in_bulk([result_id for row in history for result_id in row.result_ids])
+    penalties = SeasonPenalty.objects.filter(team=team).select_related('driver')
+
+    seasons = {}
+    for row in history:
+        if row.season_id not in seasons:
+            seasons[row.season_id] = {
+                "season": season_list[row.season_id],
+                "drivers": [],
+                "penalties": [penalty for penalty in penalties if penalty.season_id == row.season_id]
+            }
+
+        seasons[row.season_id]['drivers'].append({
+            "driver": row.driver,
+            "results": [results[result_id] for result_id in row.result_ids],
+            "points": row.points - row.penalty_points
+        })
 
-        for result in team.result_set.filter(race__season_id=season.id).distinct().order_by('driver_id').\
-                values('driver_id'):
-            if season.id not in seasons:
-                seasons[season.id] = {
-                    "season": season,
-                    "drivers": {},
-                    "penalties": SeasonPenalty.objects.filter(season=season, team=team)
-                }
-
-            if result['driver_id'] not in seasons[season.id]['drivers']:
-                results = Result.objects.filter(
-                    race__season_id=season.id,
-                    team_id=team.id,
-                    driver_id=result['driver_id']).all()
-
-                driver = Driver.objects.get(pk=result['driver_id'])
-                seasons[season.id]['drivers'][result['driver_id']] = {
-                    "driver": driver,
-                    "results": results,
-                    "points": results.aggregate(sum=Sum('points'))['sum']
-                }
-
-                for penalty in seasons[season.id]['penalties'].filter(driver=driver):
-                    seasons[season.id]['drivers'][result['driver_id']]['points'] -= penalty.points
-
-    for td in seasons:
-        sorted_drivers = []
-        for driver in sorted(seasons[td]['drivers'],
-                             key=lambda item: seasons[td]['drivers'][item]['points'],
-                             reverse=True):
-            sorted_drivers.append(seasons[td]['drivers'][driver])
-        seasons[td]['drivers'] = sorted_drivers
+    for season in seasons.values():
+        season['drivers'] = sorted(season['drivers'], key=lambda item: item['points'], reverse=True)
 
     team_stats = {}
     counter_keys = ['race_positions', 'dnf_reasons', 'qualifying_positions']
-    td = list(set([x[0] for x in Result.objects.filter(team_id=team_id).values_list('driver_id')]))
 
-    stats = SeasonStats.objects.filter(driver_id__in=td).prefetch_related('season__division')
-    divisions = Division.objects.filter(season__race__result__team_id=team_id).distinct()
+    divisions = sorted(
+        {season.division_id: season.division for season in season_list.values()}.values(),
+        key=lambda item: (item.order, item.id)
+    )
+    stats = SeasonStats.objects.filter(
+        driver_id__in={row.driver_id for row in history}, season__division__in=divisions
+    ).select_related('driver', 'season', 'best_result')
     for division in divisions:
         team_stats[division.id] = {
             'name': division.name,
-            'stats': SeasonStats.collate(stats.filter(season__division_id=division.id), focus='team')
+            'stats': SeasonStats.collate(
+                [stat for stat in stats if stat.season.division_id == division.id], focus='team'
+            )
         }
         team_stats[division.id]['stats']['avg_qualifying'] = calculate_average(
             team_stats[division.id]['stats'],
@@ -184,73 +180,60 @@ def team_view(request, team_id, from_slug=False):
 
 def driver_view_slug(request, slug):
     driver = get_object_or_404(Driver, slug=slug)
-    return driver_view(request, driver.id, from_slug=True)
+    return driver_view(request, driver_id=driver.id, from_slug=True)
 
 
+@cached_view(driver='driver_id')
 def driver_view(request, driver_id, from_slug=False):
-    seasons = {}
     driver = get_object_or_404(Driver, pk=driver_id)
-    stats = SeasonStats.objects.filter(driver=driver).prefetch_related('season__division')
-
-    season_list = Season.objects.filter(race__result__driver_id=driver_id).distinct()
-    for season in season_list:
-        seasons[season.id] = {
-            "season": season,
-            "teams": {},
-            "penalties": SeasonPenalty.objects.filter(season=season, driver=driver)
-        }
+    career = DriverCareer.for_driver(driver)
+
+    season_ids = [row['season_id'] for row in career.seasons]
+    season_list = Season.objects.select_related('division__league', 'point_system').\
+        prefetch_related('race_set').in_bulk(season_ids)
+    results = driver.result_set.filter(race__season_id__in=season_ids).select_related(
+        'driver', 'team', 'subbed_by', 'allocate_points', 'race__season', 'race__point_system'
+    )
+    penalties = SeasonPenalty.objects.filter(driver=driver).select_related('team')
 
-        results = driver.result_set.filter(race__season__id=season.id).prefetch_related('team')
-        for result in results:
-            team_results = results.filter(team=result.team)
-            if result.team.id not in seasons[season.id]['teams']:
-                seasons[season.id]['teams'][result.team.id] = {
-                    "team": result.team,
-                    "results": team_results,
-                    "points": team_results.aggregate(sum=Sum('points'))['sum']
-                }
+    team_results = {}
+    for result in results:
+        team_results.setdefault((result.race.season_id, result.team_id), []).append(result)
 
-            for penalty in seasons[season.id]['penalties'].filter(team=result.team):
-                seasons[season.id]['teams'][result.team.id]['points'] -= penalty.points
+    teams = Team.objects.in_bulk([team['team_id'] for row in career.seasons for team in row['teams']])
+
+    sorted_seasons = {}
+    for idx, row in enumerate(career.seasons):
+        sorted_seasons[idx] = {
+            "season": season_list[row['season_id']],
+            "teams": {
+                team['team_id']: {
+                    "team": teams.get(team['team_id']),
+                    "results": team_results.get((row['season_id'], team['team_id']), []),
+                    "points": team['points']
+                } for team in row['teams']
+            },
+            "penalties": [penalty for penalty in penalties if penalty.season_id == row['season_id']]
+        }
+        if row['position'] is not None:
+            sorted_seasons[idx]['position'] = row['position']
 
     driver_stats = {}
     counter_keys = ['race_positions', 'dnf_reasons', 'qualifying_positions']
 
-    divisions = Division.objects.filter(season__race__result__driver_id=driver_id).distinct()
-    for division in divisions:
-        driver_stats[division.id] = {
-            'name': division.name,
-            'stats': SeasonStats.collate(stats.filter(season__division_id=division.id))
-        }
-        driver_stats[division.id]['stats']['avg_qualifying'] = calculate_average(
-            driver_stats[division.id]['stats'],
-            'qualifying_positions'
-        )
-        driver_stats[division.id]['stats']['avg_race'] = calculate_average(
-            driver_stats[division.id]['stats'],
-            'race_positions'
-        )
+    for division in career.divisions:
+        stats = division['stats']
+        stats['avg_qualifying'] = calculate_average(stats, 'qualifying_positions')
+        stats['avg_race'] = calculate_average(stats, 'race_positions')
 
         for key in counter_keys:
-            if key in driver_stats[division.id]['stats']:
+            if key in stats:
                 if key == 'dnf_reasons':
-                    driver_stats[division.id]['stats'][key] = ', '.join(
-                        sort_counter(Counter(driver_stats[division.id]['stats'][key]), ordinal=False, convert_int=False)
-                    )
+                    stats[key] = ', '.join(sort_counter(Counter(stats[key]), ordinal=False, convert_int=False))
                 else:
-                    positions = list(grouper(sort_counter(Counter(driver_stats[division.id]['stats'][key])), 3, ''))
-                    driver_stats[division.id]['stats'][key] = positions
+                    stats[key] = list(grouper(sort_counter(Counter(stats[key])), 3, ''))
 
-    sorted_seasons = {}
-    seasons_sort = sorted(seasons, key=lambda item: seasons[item]['season'].start_date)
-    seasons_sort = sorted(seasons_sort, key=lambda item: seasons[item]['season'].division.order)
-    for season_id, season in enumerate(seasons_sort):
-        sorted_seasons[season_id] = seasons[season]
-        try:
-            stats = SeasonStats.objects.get(season_id=season, driver_id=driver_id)
-            sorted_seasons[season_id]['position'] = stats.season_position
-        except SeasonStats.DoesNotExist:
-            pass
+        driver_stats[division['division_id']] = {'name': division['name'], 'stats': stats}
 
     context = {
         'driver': driver,
@@ -316,17 +299,11 @@ def division_view(request, division_id):
     return render(request, 'standings/division.html', context)
 
 
+@cached_view(race='race_id')
 def race_view(request, race_id):
     race = get_object_or_404(Race, pk=race_id)
     stm = SeasonTyreMap.objects.filter(season_id=race.season_id).first()
 
-    try:
-        labels = [lap[0] for lap in race.result_set.get(position=1).race_lap_set().values_list('lap_number')]
-        winner_laps = [lap[0] for lap in race.result_set.get(position=1).race_lap_set().values_list('lap_time')]
-    except (Result.DoesNotExist, Lap.DoesNotExist):
-        labels = []
-        winner_laps = []
-
     q_first = 0
     q_laps = {x.driver_id: {'time': x.qualifying_fastest_lap, 'diff': 0, 'pos': x.qualifying} for x in
               Result.objects.filter(race_id=race_id, qualifying_fastest_lap__gt=0).order_by('qualifying')}
@@ -335,51 +312,21 @@ def race_view(request, race_id):
             q_first = lap['time']
         lap['diff'] = lap['time'] - q_first
 
-    pitstops = {}
-    lap_times = {}
-    drivers = {}
-    for result in race.result_set.all():
-        lap_times[result.driver_id] = [lap[0] for lap in result.race_lap_set().values_list('lap_time')]
-        drivers[result.driver_id] = result.driver.name
-        pitstops[result.driver_id] = []
-        for lap in result.race_lap_set():
-            pitstops[result.driver_id].append([map_compound(stm, lap.compound), lap.pitstop, lap.lap_number])
-
-    compounds = {}
-    compound_list = Lap.objects.filter(result__race_id=race_id, session='race').\
-        values('result__driver_id', 'compound', 'lap_number', 'pitstop').order_by('lap_number')
-    for result in compound_list:
-        if result['result__driver_id'] not in compounds:
-            compounds[result['result__driver_id']] = [{'lap_count': 0}]
-
-        compounds[result['result__driver_id']][-1]['lap_count'] += 1
-        compound_map = map_compound(stm, result['compound'])
-        compounds[result['result__driver_id']][-1]['compound'] = compound_map
-        if result['pitstop'] == 1:
-            compounds[result['result__driver_id']].append({'lap_count': 0})
-
-    q_compounds = {}
-    compound_list = Lap.objects.filter(result__race_id=race_id, session='qualify', lap_time__gt=0).\
-        values('result__driver_id', 'compound', 'lap_time').order_by('result__driver_id', 'lap_time')
-    for result in compound_list:
-        if result['result__driver_id'] not in q_compounds or \
-                result['lap_time'] < q_compounds[result['result__driver_id']]['lap_time']:
-            q_compounds[result['result__driver_id']] = {
-                'compound': map_compound(stm, result['compound']),
-                'lap_time': result['lap_time']
-            }
+    results = list(race.result_set.select_related('driver'))
+    drivers = {result.driver_id: result.driver.name for result in results}
+    telemetry = RaceTelemetry(race, results, stm).build()
 
     context = {
         'race': race,
         'drivers': drivers,
-        'labels': labels,
-        'lap_times': lap_times,
-        'winner_laps': winner_laps,
-        'disable_charts': 'true' if len(labels) == 0 else 'false',
-        'compounds': compounds,
-        'q_compounds': q_compounds,
+        'labels': telemetry.labels,
+        'lap_times': telemetry.lap_times,
+        'winner_laps': telemetry.winner_laps,
+        'disable_charts': 'true' if len(telemetry.labels) == 0 else 'false',
+        'compounds': telemetry.compounds,
+        'q_compounds': telemetry.q_compounds,
         'qualifying_gaps': q_laps,
-        'pitstops': pitstops
+        'pitstops': telemetry.pitstops
     }
 
     return render(request, 'standings/race.html', context)
@@ -399,15 +346,18 @@ def track_view(request, track_id):
 
 def laps_view(request, result_id):
     result = get_object_or_404(Result, pk=result_id)
-    laps = result.lap_set.filter(session='race').order_by('lap_number')
+    pack = result.lap_packs.filter(session='race').first() if getattr(settings, 'PACKED_LAPS', False) else None
+    laps = pack.laps() if pack is not None else result.lap_set.filter(session='race').order_by('lap_number')
     try:
         stm = SeasonTyreMap.objects.get(season_id=result.race.season_id)
     except SeasonTyreMap.DoesNotExist:
         stm = None
 
+    tyre_map = stm.compiled() if stm else None
     mapped_laps = []
     for lap in laps:
-        lap.compound = map_compound(stm, lap.compound)
+        if tyre_map is not None:
+            lap.compound = tyre_map.map(lap.compound)
         mapped_laps.append(lap)
 
     context = {
@@ -435,9 +385,7 @@ def countries_view(request, division=None):
         stats[country.code][row['position']] = row['position__count']
 
     sorted_stats = {}
-    stats_sort = sorted(stats, key=lambda item: stats[item][10], reverse=True)
-    for pos in list(reversed([x for x in range(1, 10)])):
-        stats_sort = sorted(stats_sort, key=lambda item: stats[item][pos], reverse=True)
+    stats_sort = countback_sort(stats, positions=lambda item: stats[item], depth=10)
 
     for country in stats_sort:
         sorted_stats[country] = stats[country]
@@ -485,9 +433,7 @@ def country_view(request, country_id, division=None):
         stats[row['driver_id']][row['position']] = row['position__count']
 
     sorted_stats = {}
-    stats_sort = sorted(stats, key=lambda item: stats[item][10], reverse=True)
-    for pos in list(reversed([x for x in range(1, 10)])):
-        stats_sort = sorted(stats_sort, key=lambda item: stats[item][pos], reverse=True)
+    stats_sort = countback_sort(stats, positions=lambda item: stats[item], depth=10)
 
     for driver_id in stats_sort:
         sorted_stats[driver_id] = stats[driver_id]
@@ -0,0 +1,217 @@
+from datetime import datetime, time
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from standings.models import Lap, Result
+import csv
+import io
+import json
+
+
+# (column, field, type) of each export, types are those of the Arrow schema
+result_columns = [
+    ('season_id', 'race__season_id', 'int'),
+    ('season', 'race__season__name', 'str'),
+    ('division', 'race__season__division__name', 'str'),
+    ('race_id', 'race_id', 'int'),
+    ('race', 'race__name', 'str'),
+    ('round_number', 'race__round_number', 'int'),
+    ('start_time', 'race__start_time', 'datetime'),
+    ('result_id', 'id', 'int'),
+    ('driver_id', 'driver_id', 'int'),
+    ('driver', 'driver__name', 'str'),
+    ('team_id', 'team_id', 'int'),
+    ('team', 'team__name', 'str'),
+    ('qualifying', 'qualifying', 'int'),
+    ('position', 'position', 'int'),
+    ('classified', 'classified', 'bool'),
+    ('race_laps', 'race_laps', 'int'),
+    ('race_time', 'race_time', 'float'),
+    ('race_fastest_lap', 'race_fastest_lap', 'float'),
+    ('qualifying_fastest_lap', 'qualifying_fastest_lap', 'float'),
+    ('fastest_lap', 'fastest_lap', 'bool'),
+    ('points', 'points', 'float'),
+    ('penalty_points', 'penalty_points', 'int'),
+    ('dnf_reason', 'dnf_reason', 'str'),
+]
+
+lap_columns = [
+    ('season_id', 'result__race__season_id', 'int'),
+    ('race_id', 'result__race_id', 'int'),
+    ('result_id', 'result_id', 'int'),
+    ('driver_id', 'result__driver_id', 'int'),
+    ('session', 'session', 'str'),
+    ('lap_number', 'lap_number', 'int'),
+    ('position', 'position', 'int'),
+    ('pitstop', 'pitstop', 'bool'),
+    ('sector_1', 'sector_1', 'float'),
+    ('sector_2', 'sector_2', 'float'),
+    ('sector_3', 'sector_3', 'float'),
+    ('lap_time', 'lap_time', 'float'),
+    ('race_time', 'race_time', 'float'),
+    ('compound', 'compound', 'str'),
+    ('wear_fl', 'wear_fl', 'float'),
+    ('wear_fr', 'wear_fr', 'float'),
+    ('wear_rl', 'wear_rl', 'float'),
+    ('wear_rr', 'wear_rr', 'float'),
+]
+
+content_types = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# rows fetched from the server-side cursor, and written out, at a time
+chunk_size = 2000
+
+
+def clean_params(params):
+    """
+    The race filters in `params` converted to ids and dates, so a bad value
+    is turned away before the stream starts rather than failing in the
+    query. Raises ValueError naming the parameter.
+    """
+    cleaned = {}
+    for param in ('season', 'division'):
+        value = params.get(param, None)
+        if value is not None:
+            try:
+                cleaned[param] = int(value)
+            except ValueError:
+                raise ValueError('{} must be an id'.format(param))
+
+    for param in ('start_date', 'end_date'):
+        value = params.get(param, None)
+        if value is not None:
+            try:
+                parsed = parse_datetime(value) or parse_date(value)
+            except ValueError:
+                parsed = None
+
+            if parsed is None:
+                raise ValueError('{} must be a date (YYYY-MM-DD) or a date and time'.format(param))
+
+            if not isinstance(parsed, datetime):
+                parsed = datetime.combine(parsed, time())
+            cleaned[param] = parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+    return cleaned
+
+
+def filter_races(queryset, params, race='race'):
+    """
+    Narrows `queryset` to the races picked by the season, division,
+    start_date and end_date query parameters, `race` is the path from the
+    queryset's model to Race.
+    """
+    filters = {
+        'season': '{}__season_id',
+        'division': '{}__season__division_id',
+        'start_date': '{}__start_time__gte',
+        'end_date': '{}__start_time__lt',
+    }
+
+    for param, lookup in filters.items():
+        value = params.get(param, None)
+        if value is not None:
+            queryset = queryset.filter(**{lookup.format(race): value})
+
+    return queryset
+
+
+def results(params):
+    queryset = filter_races(Result.objects.all(), params).order_by('race_id', 'position', 'id')
+    return result_columns, queryset.values_list(*[field for _, field, _ in result_columns])
+
+
+def laps(params):
+    queryset = filter_races(Lap.objects.all(), params, 'result__race').\
+        order_by('result_id', 'session', 'lap_number', 'id')
+    return lap_columns, queryset.values_list(*[field for _, field, _ in lap_columns])
+
+
+exports = {
+    'results': results,
+    'laps': laps,
+}
+
+
+def chunks(rows):
+    # iterator() reads through a server-side cursor, so only one chunk of rows is ever in memory
+    chunk = []
+    for row in rows.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def plain(columns, row):
+    return [value.isoformat() if kind == 'datetime' and value is not None else value
+            for (_, _, kind), value in zip(columns, row)]
+
+
+def write_ndjson(columns, rows):
+    names = [name for name, _, _ in columns]
+    for chunk in chunks(rows):
+        yield ''.join(json.dumps(dict(zip(names, plain(columns, row)))) + '\n' for row in chunk)
+
+
+def write_csv(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _, _ in columns])
+
+    for chunk in chunks(rows):
+        writer.writerows(plain(columns, row) for row in chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def write_arrow(columns, rows):
+    import pyarrow.ipc
+
+    types = {
+        'int': pyarrow.int64(),
+        'float': pyarrow.float64(),
+        'bool': pyarrow.bool_(),
+        'str': pyarrow.string(),
+        'datetime': pyarrow.timestamp('us', tz='UTC'),
+    }
+    schema = pyarrow.schema([(name, types[kind]) for name, _, kind in columns])
+
+    # every chunk becomes a record batch of the IPC stream, sent as soon as it is written
+    buffer = io.BytesIO()
+    writer = pyarrow.ipc.new_stream(buffer, schema)
+    for chunk in chunks(rows):
+        writer.write_batch(pyarrow.record_batch(
+            [pyarrow.array(values, type=field.type) for values, field in zip(zip(*chunk), schema)], schema=schema
+        ))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    writer.close()
+    yield buffer.getvalue()
+
+
+writers = {
+    'ndjson': write_ndjson,
+    'csv': write_csv,
+    'arrow': write_arrow,
+}
+
+
+def arrow_available():
+    try:
+        import pyarrow.ipc
+    except ImportError:
+        return False
+
+    return True
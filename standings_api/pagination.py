@@ -0,0 +1,19 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Cursor pagination on the view's `ordering`. Each page is read with a
+    WHERE on the last row of the previous one instead of an OFFSET or a
+    COUNT, so the first and the thousandth page cost the same single query.
+
+    The first field of the ordering should be indexed and close to unique,
+    rows sharing its value are stepped over with a (small) offset.
+    """
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'ordering', self.ordering)
+        return (ordering,) if isinstance(ordering, str) else tuple(ordering)
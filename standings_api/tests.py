@@ -1,3 +1,91 @@
+import csv
+import io
+import json
+import unittest
+
 from django.test import TestCase
 
-# Create your tests here.
+from standings.models import Lap, Race, Result
+from standings_api.export import arrow_available, result_columns
+
+
+class ListEndpointTests(TestCase):
+    fixtures = ["division", "driver", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def fetch_all(self, url, queries):
+        rows = []
+        while url is not None:
+            with self.assertNumQueries(queries):
+                data = self.client.get(url).json()
+            rows += data['results']
+            url = data['next']
+
+        return rows
+
+    def test_results_are_paged_in_one_query(self):
+        rows = self.fetch_all('/api/results?page_size=25', 1)
+
+        expected = Result.objects.order_by('race_id', 'position', 'id').\
+            values_list('race__name', 'driver__name', 'position')
+        self.assertEqual(
+            [(row['race']['name'], row['driver']['name'], row['position']) for row in rows], list(expected)
+        )
+        self.assertEqual(
+            rows[0]['race']['season']['division']['league'], {'name': 'Formula SimRacing World Championship'}
+        )
+
+    def test_result_filters_are_kept_across_pages(self):
+        race = Race.objects.get(pk=2)
+        rows = self.fetch_all('/api/results?page_size=7&season={}'.format(race.season_id), 1)
+
+        self.assertEqual(len(rows), Result.objects.filter(race__season_id=race.season_id).count())
+
+    def test_race_driver_and_team_lists_are_paged_in_one_query(self):
+        for url in ('/api/races?page_size=3', '/api/drivers?page_size=10', '/api/teams?page_size=4'):
+            self.assertTrue(self.fetch_all(url, 1))
+
+
+class ExportTests(TestCase):
+    fixtures = ["division", "driver", "lap", "league", "point_system", "race", "result", "season", "team", "track"]
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_results_export_as_ndjson(self):
+        season_id = Race.objects.get(pk=2).season_id
+        lines = self.export('/api/export/results?season={}'.format(season_id)).splitlines()
+        rows = [json.loads(line) for line in lines]
+        expected = Result.objects.filter(race__season_id=season_id).order_by('race_id', 'position', 'id').\
+            values_list('id', 'position')
+
+        self.assertEqual([(row['result_id'], row['position']) for row in rows], list(expected))
+
+    def test_laps_export_as_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('/api/export/laps.csv'))))
+
+        self.assertEqual(len(rows), Lap.objects.count())
+        lap = Lap.objects.order_by('result_id', 'session', 'lap_number', 'id').first()
+        self.assertEqual(float(rows[0]['lap_time']), lap.lap_time)
+
+    def test_unknown_format_is_rejected(self):
+        self.assertEqual(self.client.get('/api/export/laps?format=xml').status_code, 400)
+
+    def test_bad_filters_are_rejected_before_streaming(self):
+        for query in ('season=one', 'division=1.5', 'start_date=2020-13-45', 'end_date=yesterday'):
+            response = self.client.get('/api/export/results?{}'.format(query))
+            self.assertEqual(response.status_code, 400, query)
+            self.assertFalse(response.streaming)
+
+    @unittest.skipUnless(arrow_available(), 'pyarrow is not installed')
+    def test_results_export_as_arrow(self):
+        import pyarrow.ipc
+
+        response = self.client.get('/api/export/results.arrow?start_date=2000-01-01')
+        table = pyarrow.ipc.open_stream(b''.join(response.streaming_content)).read_all()
+
+        self.assertEqual(table.column_names, [name for name, _, _ in result_columns])
+        self.assertEqual(table.column('result_id').to_pylist(), list(
+            Result.objects.order_by('race_id', 'position', 'id').values_list('id', flat=True)
+        ))
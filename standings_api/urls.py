@@ -15,6 +15,7 @@ urlpatterns = [
     url(r'^standings/(?P<season_id>[0-9]+)(/(?P<team>team))?$', views.Standings.as_view()),
     url(r'^info/(?P<division_name>[A-Za-z ]+)$', views.DivisionInfo.as_view()),
     url(r'^season/(?P<season_id>[0-9]+)$', views.SeasonDetail.as_view()),
+    url(r'^export/(?P<kind>results|laps)$', views.export_view),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns)
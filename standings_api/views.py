@@ -1,4 +1,9 @@
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from standings.cache import cached_view
 from standings.models import Driver, Result, Race, Team, SeasonStats, Season, Division, SeasonCarNumber, PointSystem
+from standings_api import export
+from standings_api.pagination import KeysetPagination
 from standings_api.serializers import DriverSerializer, ResultSerializer, RaceSerializer, TeamSerializer
 from standings.utils import calculate_average
 from rest_framework.views import APIView
@@ -12,16 +17,20 @@ from django.utils.text import slugify
 
 
 class DriverList(mixins.ListModelMixin, generics.GenericAPIView):
-    queryset = Driver.objects.all().order_by('name')
+    queryset = Driver.objects.all()
     serializer_class = DriverSerializer
+    pagination_class = KeysetPagination
+    ordering = ('name', 'id')
 
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
 
 
 class TeamList(mixins.ListModelMixin, generics.GenericAPIView):
-    queryset = Team.objects.all().order_by('name')
+    queryset = Team.objects.select_related('parent')
     serializer_class = TeamSerializer
+    pagination_class = KeysetPagination
+    ordering = ('name', 'id')
 
     def get(self, request, *args, **kwargs):
         return self.list(request, *args, **kwargs)
@@ -29,9 +38,14 @@ class TeamList(mixins.ListModelMixin, generics.GenericAPIView):
 
 class ResultList(generics.ListAPIView):
     serializer_class = ResultSerializer
+    pagination_class = KeysetPagination
+    # races are created in round order, and keying on the race keeps every page an index range scan
+    ordering = ('race_id', 'position', 'id')
 
     def get_queryset(self):
-        queryset = Result.objects.order_by('race__round_number')
+        queryset = Result.objects.select_related(
+            'race__season__division__league', 'driver', 'team__parent'
+        )
 
         driver_name = self.request.query_params.get('name', None)
         if driver_name is not None:
@@ -49,9 +63,11 @@ class ResultList(generics.ListAPIView):
 
 class RaceList(generics.ListAPIView):
     serializer_class = RaceSerializer
+    pagination_class = KeysetPagination
+    ordering = ('start_time', 'round_number', 'id')
 
     def get_queryset(self):
-        queryset = Race.objects.order_by('start_time', 'round_number')
+        queryset = Race.objects.select_related('season__division__league')
 
         start_date = self.request.query_params.get('start_date', None)
         if start_date is not None:
@@ -75,6 +91,7 @@ class RaceList(generics.ListAPIView):
         return self.list(request, *args, **kwargs)
 
 
+@method_decorator(cached_view(season='season_id'), name='dispatch')
 class DriverDetail(APIView):
     @staticmethod
     def get(request, number, season_id):
@@ -82,12 +99,14 @@ class DriverDetail(APIView):
             driver = SeasonCarNumber.objects.get(car_number=number, season_id=season_id).driver
             standings = Season.objects.get(pk=season_id).get_standings(use_position=True)
             standings = [x for x in standings[0] if x['driver'].id == driver.id][0]
+            # the team the driver raced for last
+            team = standings['teams'][-1]
             detail = {
                 'id': driver.id,
                 'name': driver.name,
                 'team': {
-                    'id': standings['team'].id,
-                    'name': standings['team'].name,
+                    'id': team.id,
+                    'name': team.name,
                 },
                 'points': standings['points'],
                 'position': standings['position'],
@@ -99,6 +118,7 @@ class DriverDetail(APIView):
             return Response({'error': 'Driver or season not found'}, status=404)
 
 
+@method_decorator(cached_view(team='pk'), name='dispatch')
 class TeamDetail(mixins.RetrieveModelMixin, generics.GenericAPIView):
     queryset = Team.objects.all()
     serializer_class = TeamSerializer
@@ -107,6 +127,7 @@ class TeamDetail(mixins.RetrieveModelMixin, generics.GenericAPIView):
         return self.retrieve(request, *args, **kwargs)
 
 
+@method_decorator(cached_view(season='season_id'), name='dispatch')
 class SeasonDetail(mixins.RetrieveModelMixin, generics.GenericAPIView):
     @staticmethod
     def get(request, season_id):
@@ -166,6 +187,7 @@ class SeasonDetail(mixins.RetrieveModelMixin, generics.GenericAPIView):
             return Response({'error': 'Season not found'}, status=404)
 
 
+@method_decorator(cached_view(race='race_id'), name='dispatch')
 class RaceDetail(APIView):
     queryset = Race.objects.all()
     serializer_class = RaceSerializer
@@ -258,13 +280,14 @@ class DriverStats(APIView):
         return Response(driver_stats)
 
 
+@method_decorator(cached_view(season='season_id'), name='dispatch')
 class Standings(APIView):
     @staticmethod
     def get(request, season_id, team):
         season = Season.objects.get(pk=season_id)
         if season:
             data = []
-            standings = season.get_standings(use_position=True)
+            standings = season.get_snapshot_standings(use_position=True, with_results=False)
             if team:
                 standings = standings[1]
             else:
@@ -322,3 +345,30 @@ class DivisionInfo(APIView):
             })
         except (IndexError, AttributeError):
             return Response({}, status=404)
+
+
+def export_view(request, kind, format=None):
+    """
+    Streams every result or lap of the races picked by the season, division,
+    start_date and end_date parameters as NDJSON (the default), CSV or an
+    Arrow IPC stream, chosen by the url suffix or the format parameter.
+    """
+    export_format = format or request.GET.get('format', 'ndjson')
+    if export_format not in export.writers:
+        return JsonResponse({'error': 'Unknown format, use one of {}'.format(', '.join(export.writers))}, status=400)
+
+    if export_format == 'arrow' and not export.arrow_available():
+        return JsonResponse({'error': 'Arrow exports need pyarrow installed on the server'}, status=501)
+
+    try:
+        params = export.clean_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    (columns, rows) = export.exports[kind](params)
+    response = StreamingHttpResponse(
+        export.writers[export_format](columns, rows), content_type=export.content_types[export_format]
+    )
+    response['Content-Disposition'] = 'attachment; filename="{}.{}"'.format(kind, export_format)
+
+    return response